@@ -0,0 +1,62 @@
+import hmac
+import math
+import os
+import threading
+from typing import Dict, Optional
+
+# Token for admin-only endpoints (bulk scoring, emotion trends); they are off without it
+ADMIN_TOKEN = os.getenv("MIRA_ADMIN_TOKEN")
+# Reverse proxies in front of the server that append to X-Forwarded-For; 0 ignores the header
+TRUSTED_PROXIES = int(os.getenv("MIRA_TRUSTED_PROXIES", "0"))
+
+
+class AdmissionController:
+    """Caps how many /model streams one client (see client_key) holds open.
+
+    Shared queue capacity is enforced by the generation scheduler; this only
+    stops a single client from filling it with parallel requests.
+    """
+
+    def __init__(self, max_per_user: int = 2):
+        self.max_per_user = max_per_user
+        self._active: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, user: str) -> bool:
+        with self._lock:
+            count = self._active.get(user, 0)
+            if self.max_per_user > 0 and count >= self.max_per_user:
+                return False
+            self._active[user] = count + 1
+            return True
+
+    def release(self, user: str):
+        with self._lock:
+            count = self._active.get(user, 0) - 1
+            if count > 0:
+                self._active[user] = count
+            else:
+                self._active.pop(user, None)
+
+
+def client_key(remote_addr: Optional[str], forwarded_for: Optional[str] = None) -> str:
+    """The client an admission slot is counted against.
+
+    Not the session id: that is a chat id the client picks, so a fresh one per
+    request would dodge the limit. Behind MIRA_TRUSTED_PROXIES proxies, the
+    address the outermost one saw, read from the right of X-Forwarded-For.
+    """
+    if TRUSTED_PROXIES > 0 and forwarded_for:
+        hops = [hop.strip() for hop in forwarded_for.split(",") if hop.strip()]
+        if hops:
+            return hops[max(0, len(hops) - TRUSTED_PROXIES)]
+    return remote_addr or ""
+
+
+def admin_authorized(token: Optional[str]) -> bool:
+    """Whether `token` (the X-Admin-Token header) matches MIRA_ADMIN_TOKEN."""
+    return bool(ADMIN_TOKEN) and token is not None and hmac.compare_digest(token, ADMIN_TOKEN)
+
+
+def retry_after_header(seconds: float) -> str:
+    return str(max(1, math.ceil(seconds)))
@@ -1,9 +1,20 @@
 from flask import Flask, request, jsonify, Response, stream_with_context
-from mira import MIRA
+from admission import AdmissionController, admin_authorized, client_key, retry_after_header
+from batch_scoring import read_messages
+from metrics import ERRORS, INFLIGHT_STREAMS, REJECTED, REQUEST_SECONDS
+import metrics
+from streaming import NDJSON_MIMETYPE, SSE_HEADERS, SSE_MIMETYPE, coalesce, frame, wants_sse
+from scheduler import SchedulerFull
+from inference_backend import create_backend
+from profiler import ProfilerBusy
+import profiler
+from tracing import debug_authorized, finish_trace, get_trace, recent_traces, span, start_trace
+import os
 from flask_cors import CORS
 import logging
 import time
-import json
+import io
+import itertools
 
 app = Flask(__name__)
 CORS(app, origins=[
@@ -11,51 +22,201 @@ CORS(app, origins=[
     "http://localhost:5173"
 ])
 
-mira = MIRA()
+# Models load in the background; /ready turns healthy once they are warmed up.
+# MIRA_WORKERS > 1 spreads the models over CPU-pinned worker processes instead,
+# MIRA_BACKEND=server uses the host's shared model_server.py, and
+# MIRA_BACKEND=stub serves a deterministic fake with no weights (benchmarks, CI).
+# Workers re-import this module under `python app.py`; the pool only starts in the parent.
+mira = create_backend()
+
+# Overload handling: per-user stream limit here, queue bound and queue-wait SLO
+# in the scheduler. "reject" answers 503 + Retry-After, "canned" streams the
+# canned reply for the detected emotion instead of queueing for the LLaMA.
+admission = AdmissionController(max_per_user=int(os.getenv("MIRA_MAX_STREAMS_PER_USER", "2")))
+overload_mode = os.getenv("MIRA_OVERLOAD_MODE", "reject")
+batch_max_messages = int(os.getenv("MIRA_BATCH_MAX_MESSAGES", "2000"))
+trends_max_sessions = 1000
+
+@app.route('/ready', methods=['GET'])
+def ready():
+    if mira.ready.is_set():
+        return jsonify({'status': 'ready'})
+    return jsonify({'status': 'loading'}), 503
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
 
 @app.route('/model', methods=['POST'])
 def process_message():
+    t0 = time.perf_counter()
+    if not mira.ready.is_set():
+        return jsonify({'error': 'Model is still loading'}), 503, {'Retry-After': '5'}
+
     try:
         data = request.get_json()
         if not data or 'input' not in data:
             return jsonify({'error': 'Invalid request format'}), 400
 
         user_input = data['input'].strip()
+        session_id = data.get('session_id')
         if not user_input:
             return jsonify({'result': "Please share how you're feeling."})
+        sse = wants_sse(request.headers.get('Accept'))
 
-        # Detect emotions
-        emotion_results = mira.detect_emotions(user_input)
-        emotion_summary = ", ".join([
-            f"{er['emotion']} ({er['confidence']:.0%})"
-            for er in emotion_results
-        ])
+        # The session id only routes the chat; the limit is per client
+        user = client_key(request.remote_addr, request.headers.get('X-Forwarded-For'))
+        admitted = admission.acquire(user)
+        if not admitted:
+            REJECTED.labels("user_limit").inc()
+            if overload_mode != "canned":
+                return jsonify({'error': 'Too many concurrent requests'}), 503, {'Retry-After': '1'}
+        # Sampled by MIRA_TRACE_SAMPLE, or forced with X-MIRA-Trace and the debug token; None otherwise
+        trace = start_trace("model", force=request.headers.get('X-MIRA-Trace') == '1'
+                            and debug_authorized(request.headers.get('X-Debug-Token')))
+        stream = mira.stream_reply(user_input, session_id=session_id, shed=not admitted, trace=trace)
+        try:
+            # Waits for the emotion header; a backed-up queue refuses here, before any byte is sent
+            with span(trace, "wait_header"):
+                first = next(stream)
+        except SchedulerFull as e:
+            if admitted:
+                admission.release(user)
+            REJECTED.labels("queue").inc()
+            return jsonify({'error': 'Server is busy'}), 503, {'Retry-After': retry_after_header(e.retry_after)}
+        except Exception:
+            if admitted:
+                admission.release(user)
+            raise
 
-        # Streaming generator
+        # Streaming generator. stream_reply queues the prompt for prefill while the
+        # emotions are still being classified, then yields the emotion header
+        # followed by the reply chunks, coalesced into fewer writes
         def generate():
-            # Send emotion info first
-            yield json.dumps({
-                "emotions": emotion_results,
-                "emotion_summary": emotion_summary,
-                "chunk": "",
-                "done": False
-            }) + "\n"
-
-            # Stream LLaMA response
-            for chunk in mira.generate_llama_response_stream(user_input, emotion_summary):
-                yield json.dumps({
-                    "chunk": chunk["chunk"],
-                    "done": chunk["done"]
-                }) + "\n"
-
-        return Response(stream_with_context(generate()), mimetype='application/json')
+            INFLIGHT_STREAMS.inc()
+            try:
+                # The WSGI server closes this generator when the client disconnects;
+                # closing the model stream then cancels the generation
+                emotion_results, emotion_summary, emotion_scores, full_response = [], "", {}, ""
+                try:
+                    with span(trace, "write_reply"):
+                        for chunk in coalesce(itertools.chain([first], stream)):
+                            if "emotions" in chunk:
+                                emotion_results, emotion_summary = chunk["emotions"], chunk["emotion_summary"]
+                                emotion_scores = chunk.get("emotion_scores", {})
+                            else:
+                                full_response += chunk["chunk"]
+                            yield frame(chunk, sse)
+                finally:
+                    stream.close()
+
+                # Remember the turn for this chat's next prompt
+                if session_id:
+                    with span(trace, "log_conversation"):
+                        mira.log_conversation(user_input, {
+                            "emotions_detected": emotion_results,
+                            "emotion_summary": emotion_summary,
+                            "emotion_scores": emotion_scores
+                        }, full_response, session_id=session_id)
+            finally:
+                INFLIGHT_STREAMS.dec()
+                REQUEST_SECONDS.observe(time.perf_counter() - t0)
+                if trace is not None:
+                    trace.add("request", trace.started_at, session=bool(session_id), reply_chars=len(full_response))
+                    finish_trace(trace)
+
+        if sse:
+            response = Response(stream_with_context(generate()), mimetype=SSE_MIMETYPE, headers=SSE_HEADERS)
+        else:
+            response = Response(stream_with_context(generate()), mimetype=NDJSON_MIMETYPE)
+        # Runs even if the client goes away before the body is started
+        response.call_on_close(stream.close)
+        if admitted:
+            response.call_on_close(lambda: admission.release(user))
+        if trace is not None:
+            response.headers['X-MIRA-Trace-Id'] = trace.trace_id
+        return response
 
     except Exception as e:
         logging.error(f"Error processing message: {e}", exc_info=True)
+        ERRORS.labels("request").inc()
         return jsonify({
             'result': "Sorry, I encountered an error. Please try again.",
             'error': str(e)
         }), 500
 
+@app.route('/emotions/batch', methods=['POST'])
+def score_messages():
+    # Bulk emotion scores for stored messages (JSON array or JSONL body), no LLaMA
+    # involved; results stream back as JSON lines tagged with each message id.
+    # Admin only: a batch shares the classifier with live chat
+    if not admin_authorized(request.headers.get('X-Admin-Token')):
+        return jsonify({'error': 'Not found'}), 404
+    if not mira.ready.is_set():
+        return jsonify({'error': 'Model is still loading'}), 503, {'Retry-After': '5'}
+    try:
+        messages = list(read_messages(io.StringIO(request.get_data(as_text=True))))
+    except (ValueError, AttributeError) as e:
+        return jsonify({'error': f'Invalid batch: {e}'}), 400
+    if len(messages) > batch_max_messages:
+        return jsonify({'error': f'At most {batch_max_messages} messages per batch'}), 413
+
+    def generate():
+        for result in mira.score_messages(messages):
+            yield frame(result)
+
+    return Response(stream_with_context(generate()), mimetype=NDJSON_MIMETYPE)
+
+@app.route('/emotions/trends', methods=['GET'])
+def emotion_trends():
+    # Decayed emotion distribution of the chats named by ?session_id=...&session_id=...,
+    # for dashboards. Admin only, and never a listing: session ids are chat ids
+    if not admin_authorized(request.headers.get('X-Admin-Token')):
+        return jsonify({'error': 'Not found'}), 404
+    session_ids = request.args.getlist('session_id')
+    if not session_ids:
+        return jsonify({'error': 'Pass one or more session_id parameters'}), 400
+    if len(session_ids) > trends_max_sessions:
+        return jsonify({'error': f'At most {trends_max_sessions} sessions per request'}), 413
+    return jsonify({'sessions': mira.emotion_trends(session_ids)})
+
+@app.route('/debug/traces', methods=['GET'])
+def debug_traces():
+    # Recently sampled /model requests, newest first, with time per stage
+    if not debug_authorized(request.headers.get('X-Debug-Token')):
+        return jsonify({'error': 'Not found'}), 404
+    return jsonify({'traces': recent_traces()})
+
+@app.route('/debug/traces/<trace_id>', methods=['GET'])
+def debug_trace(trace_id):
+    # One trace in Chrome trace-event format (chrome://tracing, Perfetto)
+    if not debug_authorized(request.headers.get('X-Debug-Token')):
+        return jsonify({'error': 'Not found'}), 404
+    trace = get_trace(trace_id)
+    if trace is None:
+        return jsonify({'error': 'Unknown or expired trace'}), 404
+    return jsonify(trace.to_chrome())
+
+@app.route('/debug/profile', methods=['GET'])
+def debug_profile():
+    # Samples this process's stacks for ?seconds= (default 10, capped by
+    # MIRA_PROFILE_MAX_S); ?format=top returns a function table instead of
+    # collapsed stacks
+    if not debug_authorized(request.headers.get('X-Debug-Token')):
+        return jsonify({'error': 'Not found'}), 404
+    try:
+        seconds = float(request.args.get('seconds', '10'))
+        interval = max(float(request.args.get('interval_ms', '5')), 1.0) / 1000
+    except ValueError:
+        return jsonify({'error': 'seconds and interval_ms must be numbers'}), 400
+    try:
+        stacks, samples, elapsed = profiler.sample_stacks(seconds, interval)
+    except ProfilerBusy as e:
+        return jsonify({'error': str(e)}), 409
+    if request.args.get('format') == 'top':
+        return jsonify({'samples': samples, 'seconds': round(elapsed, 3),
+                        'functions': profiler.top(stacks, samples, elapsed)})
+    return Response(profiler.collapsed(stacks), mimetype='text/plain')
+
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5000, debug=False)
\ No newline at end of file
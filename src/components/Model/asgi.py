@@ -0,0 +1,260 @@
+"""Async serving mode for the /model endpoint.
+
+Same request/response contract as app.py (newline-delimited JSON chunks with
+`emotions`, `chunk` and `done`), but every open stream is a coroutine rather
+than a worker thread. Run with:
+
+    uvicorn asgi:app --host 0.0.0.0 --port 5000
+"""
+import io
+import logging
+import os
+import time
+
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.requests import Request
+from starlette.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from starlette.routing import Route
+
+import metrics
+import profiler
+from admission import AdmissionController, admin_authorized, client_key, retry_after_header
+from batch_scoring import read_messages
+from inference_backend import create_backend
+from metrics import ERRORS, INFLIGHT_STREAMS, REJECTED, REQUEST_SECONDS
+from profiler import ProfilerBusy
+from scheduler import SchedulerFull
+from streaming import NDJSON_MIMETYPE, SSE_HEADERS, SSE_MIMETYPE, acoalesce, frame, wants_sse
+from tracing import debug_authorized, finish_trace, get_trace, recent_traces, span, start_trace
+
+# Models load in the background; /ready turns healthy once they are warmed up.
+# MIRA_BACKEND=server uses the host's shared model_server.py; MIRA_BACKEND=stub
+# serves a deterministic fake with no weights (benchmarks, CI). The worker pool
+# has no async streams, so MIRA_WORKERS is ignored here.
+mira = create_backend(allow_pool=False)
+
+# Overload handling, as in app.py
+admission = AdmissionController(max_per_user=int(os.getenv("MIRA_MAX_STREAMS_PER_USER", "2")))
+overload_mode = os.getenv("MIRA_OVERLOAD_MODE", "reject")
+batch_max_messages = int(os.getenv("MIRA_BATCH_MAX_MESSAGES", "2000"))
+trends_max_sessions = 1000
+
+
+class _ClosingStreamingResponse(StreamingResponse):
+    """StreamingResponse that always runs `on_close` once the response is over.
+
+    The body generator's own `finally` never runs if the client disconnects
+    before Starlette starts iterating it; this is the ASGI counterpart of
+    Flask's `call_on_close`, so the model stream and the admission slot are
+    released either way.
+    """
+
+    def __init__(self, content, on_close, **kwargs):
+        super().__init__(content, **kwargs)
+        self.on_close = on_close
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            await self.on_close()
+
+
+async def ready(request: Request):
+    if mira.ready.is_set():
+        return JSONResponse({'status': 'ready'})
+    return JSONResponse({'status': 'loading'}, status_code=503)
+
+
+async def prometheus_metrics(request: Request):
+    return PlainTextResponse(metrics.render(), media_type='text/plain; version=0.0.4')
+
+
+async def process_message(request: Request):
+    t0 = time.perf_counter()
+    if not mira.ready.is_set():
+        return JSONResponse({'error': 'Model is still loading'}, status_code=503, headers={'Retry-After': '5'})
+
+    try:
+        try:
+            data = await request.json()
+        except ValueError:
+            data = None
+        if not data or 'input' not in data:
+            return JSONResponse({'error': 'Invalid request format'}, status_code=400)
+
+        user_input = data['input'].strip()
+        session_id = data.get('session_id')
+        if not user_input:
+            return JSONResponse({'result': "Please share how you're feeling."})
+        sse = wants_sse(request.headers.get('accept'))
+
+        # The session id only routes the chat; the limit is per client
+        user = client_key(request.client.host if request.client else None, request.headers.get('x-forwarded-for'))
+        admitted = admission.acquire(user)
+        if not admitted:
+            REJECTED.labels("user_limit").inc()
+            if overload_mode != "canned":
+                return JSONResponse({'error': 'Too many concurrent requests'}, status_code=503,
+                                    headers={'Retry-After': '1'})
+        # Sampled or forced, as in app.py
+        trace = start_trace("model", force=request.headers.get('x-mira-trace') == '1'
+                            and debug_authorized(request.headers.get('x-debug-token')))
+        stream = mira.astream_reply(user_input, session_id=session_id, shed=not admitted, trace=trace)
+        try:
+            # Waits for the emotion header; a backed-up queue refuses here, before any byte is sent
+            with span(trace, "wait_header"):
+                first = await stream.__anext__()
+        except SchedulerFull as e:
+            if admitted:
+                admission.release(user)
+            REJECTED.labels("queue").inc()
+            return JSONResponse({'error': 'Server is busy'}, status_code=503,
+                                headers={'Retry-After': retry_after_header(e.retry_after)})
+        except Exception:
+            if admitted:
+                admission.release(user)
+            raise
+
+        async def replay():
+            yield first
+            async for chunk in stream:
+                yield chunk
+
+        # Streaming generator; each write is awaited, so a slow client only
+        # holds back its own stream. The prompt is prefilled while the emotions
+        # are classified; the emotion header comes first, then the reply chunks
+        async def generate():
+            INFLIGHT_STREAMS.inc()
+            try:
+                emotion_results, emotion_summary, emotion_scores, full_response = [], "", {}, ""
+                with span(trace, "write_reply"):
+                    async for chunk in acoalesce(replay()):
+                        if "emotions" in chunk:
+                            emotion_results, emotion_summary = chunk["emotions"], chunk["emotion_summary"]
+                            emotion_scores = chunk.get("emotion_scores", {})
+                        else:
+                            full_response += chunk["chunk"]
+                        yield frame(chunk, sse)
+
+                if session_id:
+                    # May block (sqlite trend write, model server socket); keep it off the loop
+                    with span(trace, "log_conversation"):
+                        await run_in_threadpool(mira.log_conversation, user_input, {
+                            "emotions_detected": emotion_results,
+                            "emotion_summary": emotion_summary,
+                            "emotion_scores": emotion_scores
+                        }, full_response, session_id=session_id)
+            finally:
+                INFLIGHT_STREAMS.dec()
+                REQUEST_SECONDS.observe(time.perf_counter() - t0)
+                if trace is not None:
+                    trace.add("request", trace.started_at, session=bool(session_id), reply_chars=len(full_response))
+                    finish_trace(trace)
+
+        body = generate()
+
+        # Runs even if the client goes away before the body is started:
+        # closing the model stream cancels the generation
+        async def close():
+            try:
+                await body.aclose()
+                await stream.aclose()
+            finally:
+                if admitted:
+                    admission.release(user)
+
+        headers = dict(SSE_HEADERS) if sse else {}
+        if trace is not None:
+            headers['X-MIRA-Trace-Id'] = trace.trace_id
+        return _ClosingStreamingResponse(body, close, media_type=SSE_MIMETYPE if sse else NDJSON_MIMETYPE,
+                                         headers=headers)
+
+    except Exception as e:
+        logging.error(f"Error processing message: {e}", exc_info=True)
+        ERRORS.labels("request").inc()
+        return JSONResponse({
+            'result': "Sorry, I encountered an error. Please try again.",
+            'error': str(e)
+        }, status_code=500)
+
+
+async def score_messages(request: Request):
+    # Bulk emotion scoring, as in app.py (admin only); the scoring iterator runs in the threadpool
+    if not admin_authorized(request.headers.get('x-admin-token')):
+        return JSONResponse({'error': 'Not found'}, status_code=404)
+    if not mira.ready.is_set():
+        return JSONResponse({'error': 'Model is still loading'}, status_code=503, headers={'Retry-After': '5'})
+    try:
+        messages = list(read_messages(io.StringIO((await request.body()).decode('utf-8'))))
+    except (ValueError, AttributeError) as e:
+        return JSONResponse({'error': f'Invalid batch: {e}'}, status_code=400)
+    if len(messages) > batch_max_messages:
+        return JSONResponse({'error': f'At most {batch_max_messages} messages per batch'}, status_code=413)
+    return StreamingResponse((frame(result) for result in mira.score_messages(messages)), media_type=NDJSON_MIMETYPE)
+
+
+
+async def emotion_trends(request: Request):
+    # Per-session emotion trends, as in app.py (admin only, named sessions only)
+    if not admin_authorized(request.headers.get('x-admin-token')):
+        return JSONResponse({'error': 'Not found'}, status_code=404)
+    session_ids = request.query_params.getlist('session_id')
+    if not session_ids:
+        return JSONResponse({'error': 'Pass one or more session_id parameters'}, status_code=400)
+    if len(session_ids) > trends_max_sessions:
+        return JSONResponse({'error': f'At most {trends_max_sessions} sessions per request'}, status_code=413)
+    return JSONResponse({'sessions': await run_in_threadpool(mira.emotion_trends, session_ids)})
+
+async def debug_traces(request: Request):
+    # Recent traces and single traces in Chrome format, as in app.py
+    if not debug_authorized(request.headers.get('x-debug-token')):
+        return JSONResponse({'error': 'Not found'}, status_code=404)
+    trace_id = request.path_params.get('trace_id')
+    if trace_id is None:
+        return JSONResponse({'traces': recent_traces()})
+    trace = get_trace(trace_id)
+    if trace is None:
+        return JSONResponse({'error': 'Unknown or expired trace'}, status_code=404)
+    return JSONResponse(trace.to_chrome())
+
+
+async def debug_profile(request: Request):
+    # Sampling profile of this process, as in app.py; the sampler runs in the threadpool
+    if not debug_authorized(request.headers.get('x-debug-token')):
+        return JSONResponse({'error': 'Not found'}, status_code=404)
+    try:
+        seconds = float(request.query_params.get('seconds', '10'))
+        interval = max(float(request.query_params.get('interval_ms', '5')), 1.0) / 1000
+    except ValueError:
+        return JSONResponse({'error': 'seconds and interval_ms must be numbers'}, status_code=400)
+    try:
+        stacks, samples, elapsed = await run_in_threadpool(profiler.sample_stacks, seconds, interval)
+    except ProfilerBusy as e:
+        return JSONResponse({'error': str(e)}, status_code=409)
+    if request.query_params.get('format') == 'top':
+        return JSONResponse({'samples': samples, 'seconds': round(elapsed, 3),
+                             'functions': profiler.top(stacks, samples, elapsed)})
+    return PlainTextResponse(profiler.collapsed(stacks))
+
+app = Starlette(
+    routes=[
+        Route('/model', process_message, methods=['POST']),
+        Route('/ready', ready, methods=['GET']),
+        Route('/metrics', prometheus_metrics, methods=['GET']),
+        Route('/emotions/batch', score_messages, methods=['POST']),
+        Route('/emotions/trends', emotion_trends, methods=['GET']),
+        Route('/debug/traces', debug_traces, methods=['GET']),
+        Route('/debug/traces/{trace_id}', debug_traces, methods=['GET']),
+        Route('/debug/profile', debug_profile, methods=['GET'])
+    ],
+    middleware=[Middleware(
+        CORSMiddleware,
+        allow_origins=["https://www.mirahub.me", "http://localhost:5173"],
+        allow_methods=["POST"],
+        allow_headers=["Content-Type"]
+    )]
+)
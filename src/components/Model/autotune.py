@@ -0,0 +1,249 @@
+"""Measure llama.cpp runtime settings on this host and save the fastest as a profile.
+
+Sweeps thread count, then batch/ubatch size, loading the GGUF once per
+setting and timing a fixed prompt set: prefill tokens/s,
+decode tokens/s and resident memory. The winner is written to
+MIRA_LLAMA_PROFILE (default llama_profile.json), which MIRA, mira1.py and
+mira2.py read when they create their Llama:
+
+    python autotune.py --tier small
+    python autotune.py --model-path /models/Meta-Llama-3.1-8B-Instruct-Q4_K_M.gguf
+
+Settings are ranked by the time a typical turn would take (a
+--turn-prompt-tokens prompt plus a --turn-reply-tokens reply). n_ctx is not
+tuned: it is the app's window (prompt budget plus reply), and a smaller one
+would only cut the history MIRA can send. A profile records the host it was measured on and is ignored
+on a different one.
+"""
+import argparse
+import gc
+import json
+import logging
+import os
+import platform
+import sys
+import time
+from datetime import datetime
+from typing import Dict, List, Optional
+
+logger = logging.getLogger("MIRA")
+
+PROFILE_PATH = os.getenv("MIRA_LLAMA_PROFILE", "llama_profile.json")
+TUNED_KEYS = ("n_threads", "n_batch", "n_ubatch", "n_gpu_layers")
+
+# Fixed prompt set: short and long student messages in the chat template
+PROMPTS = [
+    "I'm fine, just tired.",
+    "I have three exams next week and I can't focus on any of them. Every time I open my notes I "
+    "start worrying about failing and then I end up scrolling on my phone for hours.",
+    "My roommate and I had a big argument yesterday about cleaning, and now it feels awkward to be "
+    "in the same room. I don't know if I should apologise first or wait for them to talk to me. "
+    "I also have a group project due on Friday and one of the members hasn't replied to any messages "
+    "for a week, so I'm doing most of the work alone. On top of that my part-time job changed my "
+    "shifts without asking. I feel like everything is piling up and I don't know where to start.",
+]
+TEMPLATE = (
+    "<|start_header_id|>system<|end_header_id|>\nYou are MIRA, an emotionally intelligent chatbot.\n<|eot_id|>\n"
+    "<|start_header_id|>user<|end_header_id|>\n{message}\n<|eot_id|>\n<|start_header_id|>assistant<|end_header_id|>"
+)
+
+
+def host_fingerprint() -> Dict:
+    """What a profile is only valid for: CPU set, architecture and GPU."""
+    gpu = None
+    try:
+        import torch
+        if torch.cuda.is_available():
+            gpu = torch.cuda.get_device_name(0)
+    except ImportError:
+        pass
+    return {"machine": platform.machine(), "processor": platform.processor(), "cpus": os.cpu_count(), "gpu": gpu}
+
+
+def tuned_params(model_file: str, defaults: Dict, path: Optional[str] = None) -> Dict:
+    """`defaults` with the settings measured for `model_file` (a GGUF file name) on this host."""
+    path = path or PROFILE_PATH
+    params = dict(defaults)
+    try:
+        with open(path, encoding="utf-8") as f:
+            profile = json.load(f)
+    except FileNotFoundError:
+        return params
+    except (OSError, ValueError) as e:
+        logger.warning(f"Ignoring unreadable llama profile {path}: {e}")
+        return params
+
+    if profile.get("host") != host_fingerprint():
+        logger.warning(f"Llama profile {path} was measured on another host ({profile.get('host')}); ignoring it.")
+        return params
+    entry = profile.get("models", {}).get(os.path.basename(model_file))
+    if entry is None:
+        return params
+    params.update({key: value for key, value in entry["params"].items() if key in TUNED_KEYS})
+    logger.info(f"Llama settings for {os.path.basename(model_file)} from {path}: "
+                f"{ {key: params[key] for key in TUNED_KEYS if key in params} }")
+    return params
+
+
+def _rss_mb() -> Optional[float]:
+    """Current resident memory in MB, or None where it can't be read."""
+    try:
+        with open("/proc/self/status", encoding="utf-8") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss / (1024 * 1024)
+    except ImportError:
+        pass
+    try:
+        import resource  # not on Windows
+    except ImportError:
+        return None
+    # Peak, not current; only an upper bound
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def measure(model_path: str, params: Dict, prompts: List[str], decode_tokens: int) -> Dict:
+    """Load the model with `params` and time prefill and decode over `prompts`."""
+    from llama_cpp import Llama
+
+    llama = Llama(model_path=model_path, use_mmap=True, verbose=False, **params)
+    try:
+        # Untimed warmup pass
+        llama.create_completion(TEMPLATE.format(message="Hello"), max_tokens=2)
+        prompt_tokens, prefill_s, decoded, decode_s = 0, 0.0, 0, 0.0
+        for message in prompts:
+            prompt = TEMPLATE.format(message=message)
+            llama.reset()  # no prefix reuse between prompts: time a full prefill
+            t0 = time.perf_counter()
+            first = last = None
+            count = 0
+            for _ in llama.create_completion(prompt, max_tokens=decode_tokens, temperature=0.0, stream=True):
+                last = time.perf_counter()
+                if first is None:
+                    first = last
+                count += 1
+            if first is None:
+                continue
+            prompt_tokens += len(llama.tokenize(prompt.encode("utf-8"), special=True))
+            prefill_s += first - t0
+            decoded += count - 1
+            decode_s += last - first
+        return {
+            "prefill_tokens_per_s": prompt_tokens / prefill_s if prefill_s else 0.0,
+            "decode_tokens_per_s": decoded / decode_s if decode_s else 0.0,
+            "rss_mb": _rss_mb()
+        }
+    finally:
+        del llama
+        gc.collect()
+
+
+def turn_seconds(result: Dict, prompt_tokens: int, reply_tokens: int) -> float:
+    if not result["prefill_tokens_per_s"] or not result["decode_tokens_per_s"]:
+        return float("inf")
+    return prompt_tokens / result["prefill_tokens_per_s"] + reply_tokens / result["decode_tokens_per_s"]
+
+
+def _thread_candidates() -> List[int]:
+    cpus = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else (os.cpu_count() or 1)
+    candidates = {cpus, max(1, cpus // 2), max(1, cpus - 1)}
+    power = 1
+    while power < cpus:
+        candidates.add(power)
+        power *= 2
+    return sorted(candidates)
+
+
+def _int_list(value: str) -> List[int]:
+    return [int(item) for item in value.split(",") if item.strip()]
+
+
+def main():
+    from model_registry import MODEL_TIERS, local_model_path
+
+    parser = argparse.ArgumentParser(description="Find the fastest llama.cpp settings for this host.")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--tier", choices=list(MODEL_TIERS), help="Tune a MIRA model tier (local path or HF cache)")
+    source.add_argument("--model-path", help="Tune this GGUF file")
+    parser.add_argument("--threads", type=_int_list, default=None, help="Thread counts to try (default: powers of two up to the CPU count)")
+    parser.add_argument("--batch", type=_int_list, default=[64, 128, 256, 512], help="n_batch values to try")
+    parser.add_argument("--ubatch", type=_int_list, default=[64, 128, 256, 512], help="n_ubatch values to try (<= n_batch)")
+    parser.add_argument("--ctx", type=int, default=2048, help="n_ctx to measure with (the app's window; not tuned)")
+    parser.add_argument("--n-gpu-layers", type=int, default=None, help="Layers to offload (default: all with a GPU, else 0)")
+    parser.add_argument("--decode-tokens", type=int, default=64)
+    parser.add_argument("--turn-prompt-tokens", type=int, default=600, help="Prompt size of a typical turn, for ranking")
+    parser.add_argument("--turn-reply-tokens", type=int, default=128, help="Reply size of a typical turn, for ranking")
+    parser.add_argument("--max-rss-mb", type=float, default=None, help="Skip settings whose RSS exceeds this")
+    parser.add_argument("--output", default=PROFILE_PATH)
+    args = parser.parse_args()
+
+    if args.model_path:
+        model_path = args.model_path
+    else:
+        model_path = local_model_path(args.tier)
+        if not model_path:
+            parser.error(f"No local GGUF for tier '{args.tier}'; set MIRA_GGUF_PATH_{args.tier.upper()} or pass --model-path.")
+
+    gpu_layers = args.n_gpu_layers
+    if gpu_layers is None:
+        gpu_layers = -1 if host_fingerprint()["gpu"] else 0
+
+    runs = []
+
+    def run(params: Dict) -> Optional[Dict]:
+        t0 = time.perf_counter()
+        try:
+            result = measure(model_path, params, PROMPTS, args.decode_tokens)
+        except Exception as e:
+            print(f"{params}: failed ({e})", file=sys.stderr)
+            return None
+        result["turn_s"] = turn_seconds(result, args.turn_prompt_tokens, args.turn_reply_tokens)
+        rss = "?" if result["rss_mb"] is None else f"{result['rss_mb']:.0f}"
+        print(f"{params}: prefill {result['prefill_tokens_per_s']:.0f} tok/s, decode {result['decode_tokens_per_s']:.1f} tok/s, "
+              f"RSS {rss} MB, turn {result['turn_s']:.2f}s ({time.perf_counter() - t0:.0f}s)", file=sys.stderr)
+        runs.append({"params": dict(params), **result})
+        if args.max_rss_mb and result["rss_mb"] is not None and result["rss_mb"] > args.max_rss_mb:
+            return None
+        return result
+
+    def best(candidates: List[Dict]) -> Dict:
+        scored = [(result["turn_s"], params) for params in candidates for result in [run(params)] if result]
+        if not scored:
+            raise SystemExit("No setting could be measured.")
+        return min(scored, key=lambda item: item[0])[1]
+
+    # One dimension at a time: threads, then batch sizes
+    base = {"n_threads": 6, "n_batch": 64, "n_ubatch": 64, "n_ctx": args.ctx, "n_gpu_layers": gpu_layers}
+    chosen = best([{**base, "n_threads": threads} for threads in (args.threads or _thread_candidates())])
+    chosen = best([{**chosen, "n_batch": batch, "n_ubatch": ubatch}
+                   for batch in args.batch for ubatch in args.ubatch if ubatch <= batch])
+    measured = next(r for r in reversed(runs) if r["params"] == chosen)
+
+    host = host_fingerprint()
+    profile = {"host": host, "models": {}}
+    try:
+        with open(args.output, encoding="utf-8") as f:
+            existing = json.load(f)
+        if existing.get("host") == host:
+            profile = existing
+    except (OSError, ValueError):
+        pass
+    profile["models"][os.path.basename(model_path)] = {
+        "params": chosen,
+        "measured": {key: measured[key] for key in ("prefill_tokens_per_s", "decode_tokens_per_s", "rss_mb")},
+        "tuned_at": datetime.now().isoformat(),
+        "runs": runs
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(profile, f, indent=2)
+    print(f"Chosen for {os.path.basename(model_path)}: {chosen}; profile written to {args.output}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
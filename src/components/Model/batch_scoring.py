@@ -0,0 +1,141 @@
+"""Bulk emotion scoring for stored messages (analytics backfills).
+
+Messages are read as a JSON array or as JSON lines. Each one is either a
+string or an object with `id`/`messageid` and `text`/`message_content`, so a
+plain export of the `message` table works as is:
+
+    psql -At -c "SELECT row_to_json(m) FROM (SELECT messageid, message_content FROM message WHERE sender = 'human') m" > messages.jsonl
+    python batch_scoring.py messages.jsonl --output scores.jsonl
+
+Within a window of messages, texts are sorted by length so each padded batch
+holds similar lengths. Results are therefore written as they finish, not in
+input order; every result carries its message id.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from itertools import islice
+from typing import Callable, Dict, IO, Iterable, Iterator, List, Tuple
+
+BULK_BATCH_SIZE = int(os.getenv("EMOTION_BULK_BATCH", "32"))
+SORT_WINDOW = 2048
+
+
+def read_messages(stream: IO[str]) -> Iterator[Tuple[str, str]]:
+    """Yield (id, text) from a JSON array or a JSON-lines text stream."""
+    first = stream.read(1)
+    while first and first.isspace():
+        first = stream.read(1)
+    if not first:
+        return
+    if first == "[":
+        items: Iterable = json.loads(first + stream.read())
+    else:
+        items = (json.loads(line) for line in _lines(first, stream) if line.strip())
+    for index, item in enumerate(items):
+        if isinstance(item, str):
+            yield str(index), item
+            continue
+        message_id = item.get("id", item.get("messageid", item.get("messageID", index)))
+        text = item.get("text", item.get("message_content", ""))
+        yield str(message_id), text if isinstance(text, str) else ""
+
+
+def _lines(first: str, stream: IO[str]) -> Iterator[str]:
+    yield first + stream.readline()
+    yield from stream
+
+
+def _result(message_id: str, scores) -> Dict:
+    if isinstance(scores, Exception) or not scores or not isinstance(scores[0], dict):
+        return {"id": message_id, "error": str(scores) if isinstance(scores, Exception) else "no scores"}
+    ranked = sorted(scores, key=lambda x: x["score"], reverse=True)
+    return {
+        "id": message_id,
+        "emotions": [{"emotion": e["label"], "confidence": float(e["score"])} for e in ranked[:2]],
+        "scores": {e["label"]: round(float(e["score"]), 6) for e in scores}
+    }
+
+
+def score_messages(classify_many: Callable[[List[str]], List], messages: Iterable[Tuple[str, str]],
+                   batch_size: int = BULK_BATCH_SIZE, window: int = SORT_WINDOW) -> Iterator[Dict]:
+    """Score (id, text) pairs in length-sorted batches, yielding one result dict per message."""
+    messages = iter(messages)
+    while True:
+        chunk = list(islice(messages, window))
+        if not chunk:
+            return
+        valid = [(message_id, text) for message_id, text in chunk if text.strip()]
+        for message_id, text in chunk:
+            if not text.strip():
+                yield {"id": message_id, "error": "empty text"}
+        valid.sort(key=lambda item: len(item[1]))
+        for start in range(0, len(valid), batch_size):
+            batch = valid[start:start + batch_size]
+            for (message_id, _), scores in zip(batch, classify_many([text for _, text in batch])):
+                yield _result(message_id, scores)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Score stored messages with the emotion classifier.")
+    parser.add_argument("input", help="JSON array or JSONL file of messages ('-' for stdin)")
+    parser.add_argument("--output", default="-", help="JSONL results file ('-' for stdout)")
+    parser.add_argument("--url", help="Score through a running server's /emotions/batch instead of loading the model")
+    parser.add_argument("--token", default=os.getenv("MIRA_ADMIN_TOKEN"),
+                        help="Admin token for --url (default: MIRA_ADMIN_TOKEN)")
+    parser.add_argument("--request-size", type=int, default=2000,
+                        help="Messages per --url request (at most the server's MIRA_BATCH_MAX_MESSAGES)")
+    parser.add_argument("--model", default="j-hartmann/emotion-english-distilroberta-base")
+    parser.add_argument("--backend", default=os.getenv("EMOTION_BACKEND", "pytorch"))
+    parser.add_argument("--batch-size", type=int, default=BULK_BATCH_SIZE)
+    parser.add_argument("--window-agg", default=os.getenv("EMOTION_WINDOW_AGG", "max"),
+                        help="How long messages' window scores are combined: max, mean, weighted or off")
+    args = parser.parse_args()
+
+    source = sys.stdin if args.input == "-" else open(args.input, encoding="utf-8")
+    sink = sys.stdout if args.output == "-" else open(args.output, "w", encoding="utf-8")
+    t0 = time.perf_counter()
+    count = 0
+    with source, sink:
+        if args.url:
+            if not args.token:
+                parser.error("--url needs the server's admin token (--token or MIRA_ADMIN_TOKEN).")
+            results = _score_remote(args.url, source, args.token, args.request_size)
+        else:
+            from emotion_backends import load_emotion_classifier
+            from emotion_batcher import EmotionBatcher
+
+            window_aggregate = None if args.window_agg == "off" else args.window_agg
+            batcher = EmotionBatcher(load_emotion_classifier(args.model, backend=args.backend,
+                                                             window_aggregate=window_aggregate))
+            results = score_messages(batcher.classify_many, read_messages(source), batch_size=args.batch_size)
+        for result in results:
+            sink.write(json.dumps(result) + "\n")
+            count += 1
+    elapsed = time.perf_counter() - t0
+    print(f"Scored {count} messages in {elapsed:.1f}s ({count / elapsed if elapsed else 0:.0f} msg/s).", file=sys.stderr)
+
+
+def _score_remote(url: str, source: IO[str], token: str, request_size: int) -> Iterator[Dict]:
+    import urllib.request
+
+    messages = read_messages(source)
+    while True:
+        chunk = list(islice(messages, request_size))
+        if not chunk:
+            return
+        body = "".join(json.dumps({"id": message_id, "text": text}) + "\n" for message_id, text in chunk)
+        request = urllib.request.Request(url, data=body.encode("utf-8"), headers={
+            "Content-Type": "application/x-ndjson",
+            "X-Admin-Token": token
+        })
+        with urllib.request.urlopen(request) as response:
+            for line in response:
+                if line.strip():
+                    yield json.loads(line)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,392 @@
+import codecs
+import logging
+import queue
+import time
+from typing import List, Optional, Tuple
+
+from metrics import GENERATIONS, PREFILL_SECONDS, TOKEN_SECONDS, TTFT_SECONDS
+from scheduler import _DONE, GenerationRequest, GenerationScheduler, SchedulerFull
+
+logger = logging.getLogger("MIRA")
+
+
+class SequenceBatch:
+    """A second llama.cpp context over the same weights, holding `slots` independent sequences.
+
+    `Llama.create_completion` drives one sequence per context. This context is
+    created with `n_seq_max = slots` and `slots` times the model's context
+    window, so each sequence gets a window as large as the Llama's own, and
+    one `llama_decode` call evaluates tokens of every sequence together. Its
+    KV cache costs `slots` times that of the Llama object.
+    """
+
+    def __init__(self, llama, slots: int):
+        import llama_cpp
+        from llama_cpp import _internals
+
+        self._llama_cpp = llama_cpp
+        self._internals = _internals
+        self.llama = llama
+        self.n_ctx = llama.n_ctx()
+        params = type(llama.context_params).from_buffer_copy(llama.context_params)
+        params.n_seq_max = slots
+        params.n_ctx = self.n_ctx * slots
+        if hasattr(params, "kv_unified"):
+            params.kv_unified = False
+        self.n_batch = params.n_batch
+        self.ctx = _internals.LlamaContext(model=llama._model, params=params, verbose=False)
+        self.batch = _internals.LlamaBatch(n_tokens=self.n_batch, embd=0, n_seq_max=1, verbose=False)
+        self._vocab = llama._model.vocab
+
+    def truncate(self, seq_id: int, keep: int):
+        """Drop the sequence's tokens from position `keep` on."""
+        self.ctx.kv_cache_seq_rm(seq_id, keep, -1)
+
+    def clear(self):
+        self.ctx.kv_cache_clear()
+
+    def decode(self, entries: List[Tuple[int, int, int, bool]]):
+        """Evaluate (token, position, seq_id, wants_logits) entries in one forward pass."""
+        batch = self.batch.batch
+        for i, (token, pos, seq_id, logits) in enumerate(entries):
+            batch.token[i] = token
+            batch.pos[i] = pos
+            batch.seq_id[i][0] = seq_id
+            batch.n_seq_id[i] = 1
+            batch.logits[i] = logits
+        batch.n_tokens = len(entries)
+        self.ctx.decode(self.batch)
+
+    def sampler(self, temperature: float, top_p: float, top_k: int = 40, min_p: float = 0.05):
+        """A sampler chain matching create_completion's defaults; `sample(i)` reads the i-th batch entry's logits."""
+        sampler = self._internals.LlamaSampler()
+        if temperature <= 0:
+            sampler.add_greedy()
+        else:
+            sampler.add_top_k(top_k)
+            sampler.add_top_p(top_p, 1)
+            sampler.add_min_p(min_p, 1)
+            sampler.add_temp(temperature)
+            sampler.add_dist(self._llama_cpp.LLAMA_DEFAULT_SEED)
+        ctx = self.ctx
+        return _Sampler(lambda index: sampler.sample(ctx, index), sampler.close)
+
+    def is_eog(self, token: int) -> bool:
+        return self._llama_cpp.llama_vocab_is_eog(self._vocab, token)
+
+    def piece(self, token: int) -> bytes:
+        return self.llama.detokenize([token])
+
+
+class _Sampler:
+    __slots__ = ("sample", "close")
+
+    def __init__(self, sample, close):
+        self.sample = sample
+        self.close = close
+
+
+class _Slot:
+    """One sequence of the batch: the tokens in its KV cache and the request it is serving."""
+
+    def __init__(self, seq_id: int):
+        self.seq_id = seq_id
+        self.tokens: List[int] = []
+        self.session_id: Optional[str] = None
+        self.freed_at = 0.0
+        self.request: Optional[GenerationRequest] = None
+
+    def start(self, request: GenerationRequest):
+        self.request = request
+        self.session_id = request.session_id
+        self.pending: List[int] = []
+        # Prompt still missing its suffix (emotion summary): prefill, don't sample
+        self.complete = request.suffix is None or request.suffix.done()
+        self.next_token: Optional[int] = None
+        self.sampler: Optional[_Sampler] = None
+        self.decoder = codecs.getincrementaldecoder("utf-8")(errors="ignore")
+        self.held = ""
+        self.stop: List[str] = [stop for stop in (request.params.get("stop") or []) if stop]
+        self.max_tokens = request.params.get("max_tokens") or 16
+        self.deadline = request.started_at + request.time_budget if request.time_budget else None
+        self.completion_started: Optional[float] = None
+        self.prefilled_at = request.started_at
+        self.first_token: Optional[float] = None
+        self.last_token: Optional[float] = None
+        self.token_times: Optional[List[float]] = [] if request.trace is not None else None
+
+
+def _common_prefix(a: List[int], b: List[int]) -> int:
+    common = 0
+    for x, y in zip(a, b):
+        if x != y:
+            break
+        common += 1
+    return common
+
+
+class BatchedGenerationScheduler(GenerationScheduler):
+    """GenerationScheduler that decodes up to `slots` chats in the same forward pass.
+
+    Continuous batching: every step gathers the next token of each decoding
+    chat plus a chunk of the prompts still being prefilled (up to n_batch
+    tokens in all) into one `llama_decode` call. A new request joins at the
+    next step instead of waiting for the running ones to finish. On CPU the
+    weights are read once per step rather than once per chat, so aggregate
+    tokens/s grows with the number of active chats.
+
+    Each slot keeps its sequence's tokens after a reply; the chat's next turn
+    goes back to that slot when it is free and only prefills the new tokens,
+    which replaces the SessionStateCache of the single-sequence scheduler.
+    Sampling covers temperature, top_p and stop strings (what MIRA uses);
+    speculative decoding is not applied here.
+    """
+
+    def __init__(self, llama, slots: int, max_queue: int = 32, name: str = "llama",
+                 engine: Optional[SequenceBatch] = None):
+        self.engine = engine or SequenceBatch(llama, slots)
+        self._slots = [_Slot(seq_id) for seq_id in range(slots)]
+        if getattr(llama, "draft_model", None) is not None:
+            logger.warning(f"Speculative decoding is not used with batched decoding on '{name}'.")
+        super().__init__(llama, max_queue=max_queue, name=name)
+
+    @property
+    def slots(self) -> int:
+        return len(self._slots)
+
+    @property
+    def active(self) -> int:
+        return sum(slot.request is not None for slot in self._slots)
+
+    @property
+    def busy(self) -> bool:
+        return self.active == self.slots
+
+    def estimated_wait(self) -> float:
+        # `slots` generations run side by side, each taking ~service_time
+        return (self.queue_depth + self.busy) * self.service_time / self.slots
+
+    def _run(self):
+        while True:
+            try:
+                self._admit()
+                if not self._step():
+                    self._wait_for_work()
+            except Exception as e:
+                logger.error(f"Batched generation on '{self.name}' failed: {e}", exc_info=True)
+                self._fail_all(e)
+
+    def _wait_for_work(self):
+        """Block until a request arrives or, while prompts wait for their suffix, briefly."""
+        if self.busy:
+            time.sleep(0.005)
+            return
+        waiting = self.active > 0
+        try:
+            request = self._queue.get(timeout=0.005 if waiting else None)
+        except queue.Empty:
+            return
+        self._start(request)
+
+    def _admit(self):
+        while self.active < self.slots:
+            try:
+                request = self._queue.get_nowait()
+            except queue.Empty:
+                return
+            self._start(request)
+
+    def _start(self, request: GenerationRequest):
+        self._queue_gauge.set(self.queue_depth)
+        request.started_at = time.time()
+        if request.trace is not None:
+            request.trace.add("queue_wait", request.enqueued_at, request.started_at, model=self.name)
+        if request.cancelled:
+            self._record_stop(request, "cancelled")
+            self._close(request)
+            return
+        waited = request.started_at - request.enqueued_at
+        if request.max_wait is not None and waited > request.max_wait:
+            self._record_stop(request, "shed")
+            request._emit(SchedulerFull(f"Waited {waited:.1f}s for '{self.name}'.", retry_after=self.estimated_wait()))
+            self._close(request)
+            return
+        slot = self._pick_slot(request)
+        slot.start(request)
+        try:
+            self._set_prompt(slot, request.prompt + (request.suffix.result() if slot.complete and request.suffix else ""))
+        except Exception as e:
+            self._fail(slot, e)
+
+    def _pick_slot(self, request: GenerationRequest) -> _Slot:
+        free = [slot for slot in self._slots if slot.request is None]
+        if request.session_id:
+            for slot in free:
+                if slot.session_id == request.session_id:
+                    return slot
+        # Least recently used, so recent chats keep their cached tokens
+        return min(free, key=lambda slot: slot.freed_at)
+
+    def _set_prompt(self, slot: _Slot, prompt: str):
+        tokens = self.llama.tokenize(prompt.encode("utf-8"), special=True)
+        if len(tokens) >= self.engine.n_ctx:
+            raise ValueError(f"Prompt of {len(tokens)} tokens exceeds the context window of {self.engine.n_ctx}.")
+        common = _common_prefix(slot.tokens, tokens)
+        if slot.complete and common == len(tokens):
+            common -= 1  # the last prompt token is re-evaluated for its logits
+        if common < len(slot.tokens):
+            self.engine.truncate(slot.seq_id, common)
+            del slot.tokens[common:]
+        slot.pending = tokens[common:]
+        if slot.complete:
+            slot.completion_started = time.time()
+            slot.sampler = self.engine.sampler(slot.request.params.get("temperature", 0.8),
+                                               slot.request.params.get("top_p", 0.95))
+
+    def _step(self) -> bool:
+        """One forward pass over all active slots; False when there was nothing to evaluate."""
+        now = time.time()
+        for slot in self._slots:
+            request = slot.request
+            if request is None:
+                continue
+            if request.cancelled:
+                self._record_stop(request, "cancelled")
+                self._finish(slot, completed=False)
+            elif slot.deadline is not None and now > slot.deadline:
+                self._record_stop(request, "timed_out")
+                self._finish(slot, completed=False)
+            elif not slot.complete and not slot.pending and request.suffix.done():
+                # Prefix prefilled and the suffix arrived: queue just the rest
+                if request.trace is not None:
+                    request.trace.add("wait_emotions", slot.prefilled_at)
+                slot.complete = True
+                try:
+                    self._set_prompt(slot, request.prompt + request.suffix.result())
+                except Exception as e:
+                    self._fail(slot, e)
+
+        entries: List[Tuple[int, int, int, bool]] = []
+        sampled: List[Tuple[_Slot, int]] = []
+        for slot in self._slots:
+            if slot.request is not None and slot.next_token is not None:
+                sampled.append((slot, len(entries)))
+                entries.append((slot.next_token, len(slot.tokens), slot.seq_id, True))
+                slot.tokens.append(slot.next_token)
+                slot.next_token = None
+        budget = self.engine.n_batch - len(entries)
+        for slot in sorted((slot for slot in self._slots if slot.request is not None and slot.pending),
+                           key=lambda slot: slot.request.started_at):
+            if budget <= 0:
+                break
+            chunk, slot.pending = slot.pending[:budget], slot.pending[budget:]
+            for token in chunk:
+                entries.append((token, len(slot.tokens), slot.seq_id, False))
+                slot.tokens.append(token)
+            budget -= len(chunk)
+            if not slot.pending:
+                if slot.complete:
+                    entries[-1] = entries[-1][:3] + (True,)
+                    sampled.append((slot, len(entries) - 1))
+                else:
+                    slot.prefilled_at = time.time()
+        if not entries:
+            return False
+
+        self.engine.decode(entries)
+        for slot, index in sampled:
+            self._sample(slot, index)
+        return True
+
+    def _sample(self, slot: _Slot, index: int):
+        request = slot.request
+        token = slot.sampler.sample(index)
+        now = time.time()
+        if slot.first_token is None:
+            slot.first_token = now
+            PREFILL_SECONDS.observe(now - slot.completion_started)
+            TTFT_SECONDS.observe(now - request.enqueued_at)
+        else:
+            TOKEN_SECONDS.observe(now - slot.last_token)
+        slot.last_token = now
+        if self.engine.is_eog(token):
+            self._finish(slot)
+            return
+        request.tokens += 1
+        if slot.token_times is not None:
+            slot.token_times.append(now)
+        if not self._emit_text(slot, slot.decoder.decode(self.engine.piece(token))):
+            self._finish(slot)
+            return
+        if request.tokens >= slot.max_tokens or len(slot.tokens) + 1 >= self.engine.n_ctx:
+            self._finish(slot)
+            return
+        slot.next_token = token
+
+    def _emit_text(self, slot: _Slot, text: str) -> bool:
+        """Send `text`, holding back a possible stop-string start; False once a stop string appears."""
+        text = slot.held + text
+        for stop in slot.stop:
+            at = text.find(stop)
+            if at >= 0:
+                slot.held = ""
+                if at:
+                    slot.request._emit(text[:at])
+                return False
+        hold = 0
+        for stop in slot.stop:
+            for size in range(min(len(stop) - 1, len(text)), hold, -1):
+                if text.endswith(stop[:size]):
+                    hold = size
+                    break
+        slot.held = text[len(text) - hold:] if hold else ""
+        if len(text) > hold:
+            slot.request._emit(text[:len(text) - hold])
+        return True
+
+    def _finish(self, slot: _Slot, completed: bool = True):
+        request = slot.request
+        if completed:
+            if slot.held:
+                request._emit(slot.held)
+            self.stats["completed"] += 1
+            GENERATIONS.labels("completed").inc()
+        if slot.first_token is not None:
+            self.prefill_time += 0.2 * (slot.first_token - slot.completion_started - self.prefill_time)
+            if request.tokens > 1:
+                self.token_time += 0.2 * ((slot.last_token - slot.first_token) / (request.tokens - 1) - self.token_time)
+            if request.trace is not None:
+                request.trace.add("prefill", slot.completion_started, slot.first_token, model=self.name, batched=True)
+                request.trace.add("decode", slot.first_token, slot.last_token, tokens=request.tokens,
+                                  cancelled=request.cancelled)
+                request.trace.tokens(slot.token_times)
+        self.service_time += 0.2 * (time.time() - request.started_at - self.service_time)
+        if slot.sampler is not None:
+            slot.sampler.close()
+        slot.request = None
+        slot.next_token = None
+        slot.freed_at = time.time()
+        self._close(request)
+
+    @staticmethod
+    def _close(request: GenerationRequest):
+        request.finished = True
+        request._emit(_DONE)
+
+    def _fail(self, slot: _Slot, error: Exception):
+        logger.error(f"Generation on '{self.name}' failed: {error}")
+        GENERATIONS.labels("error").inc()
+        slot.request._emit(error)
+        self._finish(slot, completed=False)
+
+    def _fail_all(self, error: Exception):
+        """A failed decode leaves the KV cache in an unknown state: end every generation and start clean."""
+        for slot in self._slots:
+            if slot.request is not None:
+                self._fail(slot, error)
+            slot.tokens = []
+            slot.session_id = None
+        self.engine.clear()
+
+    def __repr__(self) -> str:
+        return f"BatchedGenerationScheduler({self.name!r}, slots={self.slots}, active={self.active})"
@@ -0,0 +1,269 @@
+"""Load test and latency benchmark for the /model streaming endpoint.
+
+Replays recorded conversations (the JSONL conversation log) or synthetic ones
+against /model at a fixed concurrency. It parses the newline-delimited JSON
+stream and writes a machine-readable summary that can be diffed run to run.
+
+    python benchmark.py --serve-stub --concurrency 16 --output bench.json
+    python benchmark.py --url http://127.0.0.1:5000/model --conversations conversations/ --baseline bench.json
+"""
+import argparse
+import glob
+import http.client
+import json
+import os
+import random
+import statistics
+import threading
+import time
+import uuid
+from collections import defaultdict
+from datetime import datetime
+from typing import Dict, List, Optional
+from urllib.parse import urlparse
+
+SYNTHETIC_MESSAGES = [
+    "hi",
+    "i'm fine",
+    "thanks",
+    "I have three exams next week and I can't focus on any of them.",
+    "My roommate keeps eating my food and I'm so annoyed.",
+    "I finally finished my final year project!",
+    "I feel like nobody in my class likes me.",
+    "Can you give me some tips to sleep better before exams?",
+    "I'm scared I'll lose my scholarship if my grades drop.",
+    "Today was actually a pretty good day."
+]
+
+# Summary metrics compared against --baseline (lower is better for all of them)
+COMPARED_METRICS = [("ttft", "p50"), ("ttft", "p95"), ("inter_chunk", "p50"), ("e2e", "p50"), ("e2e", "p95"), ("e2e", "p99")]
+
+
+def load_conversations(path: str) -> List[List[str]]:
+    """Read conversations from a conversation-log folder/JSONL file or a JSON array of message lists."""
+    paths = sorted(glob.glob(os.path.join(path, "conversation_*.jsonl"))) if os.path.isdir(path) else [path]
+    if len(paths) == 1 and paths[0].endswith(".json"):
+        with open(paths[0], encoding="utf-8") as f:
+            return [list(conversation) for conversation in json.load(f)]
+
+    sessions: Dict[str, List[str]] = defaultdict(list)
+    for log_path in paths:
+        with open(log_path, encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                if record.get("user_input"):
+                    sessions[record.get("session", "")].append(record["user_input"])
+    return list(sessions.values())
+
+
+def synthetic_conversations(count: int, turns: int, seed: int) -> List[List[str]]:
+    rng = random.Random(seed)
+    return [[rng.choice(SYNTHETIC_MESSAGES) for _ in range(turns)] for _ in range(count)]
+
+
+def stream_request(url: str, message: str, session_id: str, timeout: float) -> Dict:
+    """Send one /model request and time the stream as it arrives."""
+    target = urlparse(url)
+    connection_class = http.client.HTTPSConnection if target.scheme == "https" else http.client.HTTPConnection
+    connection = connection_class(target.hostname, target.port, timeout=timeout)
+    body = json.dumps({"input": message, "session_id": session_id})
+    t0 = time.perf_counter()
+    try:
+        connection.request("POST", target.path or "/model", body, {"Content-Type": "application/json"})
+        response = connection.getresponse()
+        if response.status != 200:
+            return {"error": f"HTTP {response.status}"}
+
+        first_line: Optional[float] = None
+        chunk_times: List[float] = []
+        chars = 0
+        tier = None
+        done = False
+        buffer = b""
+        while not done:
+            data = response.read1(65536)
+            if not data:
+                break
+            now = time.perf_counter()
+            buffer += data
+            *lines, buffer = buffer.split(b"\n")
+            for line in lines:
+                if not line.strip():
+                    continue
+                message_data = json.loads(line)
+                if first_line is None:
+                    first_line = now
+                if "emotions" in message_data:
+                    tier = message_data.get("tier")
+                if message_data.get("chunk"):
+                    chunk_times.append(now)
+                    chars += len(message_data["chunk"])
+                done = done or bool(message_data.get("done"))
+        end = time.perf_counter()
+    except Exception as e:
+        return {"error": f"{type(e).__name__}: {e}"}
+    finally:
+        connection.close()
+
+    if not done:
+        return {"error": "stream ended without done"}
+    return {
+        "ttfb": first_line - t0 if first_line is not None else None,
+        "ttft": chunk_times[0] - t0 if chunk_times else None,
+        "inter_chunk": [b - a for a, b in zip(chunk_times, chunk_times[1:])],
+        "chunks": len(chunk_times),
+        "chars": chars,
+        "decode_s": chunk_times[-1] - chunk_times[0] if len(chunk_times) > 1 else 0.0,
+        "e2e": end - t0,
+        "tier": tier
+    }
+
+
+def percentiles(values: List[float]) -> Dict[str, float]:
+    if not values:
+        return {}
+    ordered = sorted(values)
+
+    def pick(q: float) -> float:
+        return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+    return {
+        "mean": statistics.mean(ordered),
+        "p50": pick(0.50),
+        "p95": pick(0.95),
+        "p99": pick(0.99),
+        "max": ordered[-1],
+        "count": len(ordered)
+    }
+
+
+def run(url: str, conversations: List[List[str]], concurrency: int, think_time: float, timeout: float) -> Dict:
+    pending = list(reversed(conversations))
+    results: List[Dict] = []
+    lock = threading.Lock()
+
+    def client():
+        while True:
+            with lock:
+                if not pending:
+                    return
+                conversation = pending.pop()
+            session_id = f"bench-{uuid.uuid4()}"
+            for message in conversation:
+                result = stream_request(url, message, session_id, timeout)
+                with lock:
+                    results.append(result)
+                if think_time:
+                    time.sleep(think_time)
+
+    t0 = time.perf_counter()
+    threads = [threading.Thread(target=client, daemon=True) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - t0
+
+    ok = [r for r in results if "error" not in r]
+    errors = defaultdict(int)
+    for r in results:
+        if "error" in r:
+            errors[r["error"]] += 1
+    total_chunks = sum(r["chunks"] for r in ok)
+    tiers = defaultdict(int)
+    for r in ok:
+        tiers[str(r["tier"])] += 1
+    return {
+        "requests": len(results),
+        "errors": dict(errors),
+        "wall_s": wall,
+        "requests_per_s": len(ok) / wall if wall else 0.0,
+        # Chunks are tokens only with MIRA_STREAM_WINDOW_MS=0; characters are
+        # comparable whether or not the server coalesces them
+        "aggregate_tokens_per_s": total_chunks / wall if wall else 0.0,
+        "aggregate_chars_per_s": sum(r["chars"] for r in ok) / wall if wall else 0.0,
+        "per_stream_tokens_per_s": percentiles([r["chunks"] / r["decode_s"] for r in ok if r["decode_s"] > 0]),
+        "ttfb": percentiles([r["ttfb"] for r in ok if r["ttfb"] is not None]),
+        "ttft": percentiles([r["ttft"] for r in ok if r["ttft"] is not None]),
+        "inter_chunk": percentiles([gap for r in ok for gap in r["inter_chunk"]]),
+        "e2e": percentiles([r["e2e"] for r in ok]),
+        # Which model tier answered, from the emotion header (None: canned/stub)
+        "tiers": dict(tiers)
+    }
+
+
+def serve_stub() -> str:
+    """Start app.py on the stub backend in this process and return its /model URL."""
+    os.environ["MIRA_BACKEND"] = "stub"
+    from werkzeug.serving import make_server
+    import app as flask_app
+
+    server = make_server("127.0.0.1", 0, flask_app.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_port}/model"
+
+
+def compare(summary: Dict, baseline_path: str):
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = json.load(f)["summary"]
+    for metric, stat in COMPARED_METRICS:
+        old, new = baseline.get(metric, {}).get(stat), summary.get(metric, {}).get(stat)
+        if not old or new is None:
+            continue
+        change = (new - old) / old * 100
+        flag = "  <-- regression" if change > 10 else ""
+        print(f"{metric} {stat}: {old * 1000:.1f}ms -> {new * 1000:.1f}ms ({change:+.1f}%){flag}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test the /model streaming endpoint.")
+    parser.add_argument("--url", default="http://127.0.0.1:5000/model")
+    parser.add_argument("--serve-stub", action="store_true", help="Benchmark app.py in-process on the stub backend")
+    parser.add_argument("--conversations", help="Conversation log folder/JSONL, or a JSON array of message lists")
+    parser.add_argument("--synthetic", type=int, default=32, help="Number of synthetic conversations")
+    parser.add_argument("--turns", type=int, default=3, help="Turns per synthetic conversation")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--think-time", type=float, default=0.0, help="Seconds between turns of one conversation")
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="bench_results.json")
+    parser.add_argument("--baseline", help="Earlier --output file to compare against")
+    args = parser.parse_args()
+
+    url = serve_stub() if args.serve_stub else args.url
+    if args.conversations:
+        conversations = load_conversations(args.conversations)
+    else:
+        conversations = synthetic_conversations(args.synthetic, args.turns, args.seed)
+
+    summary = run(url, conversations, args.concurrency, args.think_time, args.timeout)
+    report = {
+        "timestamp": datetime.now().isoformat(),
+        "config": {
+            "url": url,
+            "backend": "stub" if args.serve_stub else "remote",
+            "conversations": len(conversations),
+            "concurrency": args.concurrency,
+            "think_time": args.think_time,
+            "seed": args.seed
+        },
+        "summary": summary
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+
+    print(f"{summary['requests']} requests, {sum(summary['errors'].values())} errors, "
+          f"{summary['requests_per_s']:.2f} req/s, {summary['aggregate_tokens_per_s']:.1f} tokens/s")
+    for metric in ("ttfb", "ttft", "inter_chunk", "e2e"):
+        stats = summary[metric]
+        if stats:
+            print(f"{metric}: p50={stats['p50'] * 1000:.1f}ms p95={stats['p95'] * 1000:.1f}ms p99={stats['p99'] * 1000:.1f}ms")
+    print(f"Results written to {args.output}")
+    if args.baseline:
+        compare(summary, args.baseline)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+import glob
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from datetime import datetime
+from typing import Dict, Iterator, List, Optional
+
+logger = logging.getLogger("MIRA")
+
+_FLUSH = object()
+_CLOSE = object()
+
+
+class ConversationLogWriter:
+    """Append-only JSONL conversation log written off the response path.
+
+    `append` only enqueues the record. A background thread writes one line per
+    record, fsyncs every `fsync_every` records or `flush_interval` seconds, and
+    rotates to a new file by size or age. Per-turn cost stays constant no
+    matter how long the session runs.
+    """
+
+    def __init__(self, folder: str = "conversations", fsync_every: int = 32, flush_interval: float = 1.0,
+                 max_bytes: int = 64 * 1024 * 1024, rotate_interval: float = 24 * 3600):
+        self.folder = folder
+        self.fsync_every = fsync_every
+        self.flush_interval = flush_interval
+        self.max_bytes = max_bytes
+        self.rotate_interval = rotate_interval
+        self._queue: "queue.Queue" = queue.Queue()
+        self._file = None
+        self._opened_at = 0.0
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+        self._worker = threading.Thread(target=self._run, name="conversation-log", daemon=True)
+        self._worker.start()
+
+    def append(self, record: Dict):
+        self._queue.put(record)
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """Block until everything appended so far is on disk."""
+        done = threading.Event()
+        self._queue.put((_FLUSH, done))
+        return done.wait(timeout)
+
+    def close(self, timeout: Optional[float] = None):
+        done = threading.Event()
+        self._queue.put((_CLOSE, done))
+        done.wait(timeout)
+
+    def _open(self):
+        os.makedirs(self.folder, exist_ok=True)
+        path = os.path.join(self.folder, f"conversation_{datetime.now().strftime('%Y%m%d_%H%M%S_%f')}.jsonl")
+        self._file = open(path, "a", encoding="utf-8")
+        self._opened_at = time.monotonic()
+        logger.info(f"Writing conversation log to {path}.")
+
+    def _sync(self):
+        if self._file is not None and self._unsynced:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+
+    def _rotate_if_needed(self):
+        if self._file is None:
+            return
+        too_big = self._file.tell() >= self.max_bytes
+        too_old = time.monotonic() - self._opened_at >= self.rotate_interval
+        if too_big or too_old:
+            self._sync()
+            self._file.close()
+            self._file = None
+
+    def _run(self):
+        while True:
+            timeout = max(0.0, self.flush_interval - (time.monotonic() - self._last_sync))
+            try:
+                item = self._queue.get(timeout=timeout if self._unsynced else None)
+            except queue.Empty:
+                self._sync()
+                continue
+
+            if isinstance(item, tuple) and item and item[0] in (_FLUSH, _CLOSE):
+                command, done = item
+                try:
+                    self._sync()
+                    if command is _CLOSE and self._file is not None:
+                        self._file.close()
+                        self._file = None
+                finally:
+                    done.set()
+                if command is _CLOSE:
+                    return
+                continue
+
+            try:
+                if self._file is None:
+                    self._open()
+                self._file.write(json.dumps(item, ensure_ascii=False) + "\n")
+                self._unsynced += 1
+                if self._unsynced >= self.fsync_every or time.monotonic() - self._last_sync >= self.flush_interval:
+                    self._sync()
+                self._rotate_if_needed()
+            except Exception as e:
+                logger.error(f"Failed to write conversation log: {e}", exc_info=True)
+
+
+def read_log(folder: str = "conversations") -> Iterator[Dict]:
+    """Yield every logged record, oldest file first."""
+    for path in sorted(glob.glob(os.path.join(folder, "conversation_*.jsonl"))):
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    # A crash can leave a partial last line; skip it
+                    logger.warning(f"Skipping malformed line in {path}.")
+
+
+def rebuild_latest(folder: str = "conversations", session: Optional[str] = None,
+                   filename: str = "conversation_latest.json") -> str:
+    """Write the `conversation_latest.json` view for `session` (default: the most recent one)."""
+    records: List[Dict] = list(read_log(folder))
+    if session is None and records:
+        session = records[-1].get("session")
+    history = [
+        {key: value for key, value in record.items() if key != "session"}
+        for record in records if record.get("session") == session
+    ]
+    path = os.path.join(folder, filename)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(history, f, indent=2)
+    os.replace(tmp_path, path)
+    return path
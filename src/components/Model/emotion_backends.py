@@ -0,0 +1,244 @@
+import argparse
+import logging
+import os
+import platform
+import statistics
+import time
+from typing import Dict, List, Optional
+
+from transformers import AutoTokenizer, pipeline
+
+logger = logging.getLogger("MIRA")
+
+EMOTION_BACKENDS = ("pytorch", "onnx", "onnx-int8")
+WINDOW_AGGREGATIONS = ("max", "mean", "weighted")
+
+SAMPLE_TEXTS = [
+    "I'm fine",
+    "idk",
+    "thanks",
+    "I failed my exam and I don't know how to tell my parents.",
+    "I got the internship!!! I can't believe it.",
+    "Everyone in my group project ignores my messages and it makes me furious.",
+    "I keep thinking something bad is going to happen before my presentation tomorrow.",
+    "The food in the cafeteria today was honestly disgusting.",
+    "I didn't expect my friend to show up at my door this morning.",
+    "Nothing much happened today, just classes and homework."
+]
+
+
+def load_emotion_classifier(model_name: str, backend: str = "pytorch", device: int = -1,
+                            intra_op_threads: Optional[int] = None, cache_dir: str = "onnx_models",
+                            window_aggregate: Optional[str] = None, window_stride: int = 128):
+    """Return a text-classification pipeline for `model_name` on the requested backend.
+
+    Every backend is called the same way and returns the full sigmoid score list
+    per input, so callers (EmotionBatcher, detect_emotions) don't care which runs.
+    With `window_aggregate` set, inputs past the model's token limit are scored
+    over overlapping windows (see WindowedClassifier) instead of being truncated.
+    """
+    classifier = _load_pipeline(model_name, backend, device, intra_op_threads, cache_dir)
+    if window_aggregate:
+        return WindowedClassifier(classifier, aggregate=window_aggregate, stride=window_stride)
+    return classifier
+
+
+def _load_pipeline(model_name: str, backend: str, device: int, intra_op_threads: Optional[int], cache_dir: str):
+    if backend == "pytorch":
+        return pipeline(
+            "text-classification",
+            model=model_name,
+            device=device,
+            top_k=None,
+            function_to_apply="sigmoid",
+            return_all_scores=True
+        )
+    if backend in ("onnx", "onnx-int8"):
+        if device != -1:
+            logger.warning(f"Emotion backend '{backend}' runs on CPU only; ignoring device {device}.")
+        return _load_onnx_classifier(model_name, quantize=backend == "onnx-int8",
+                                     intra_op_threads=intra_op_threads, cache_dir=cache_dir)
+    raise ValueError(f"Unknown emotion backend '{backend}'. Choose one of: {', '.join(EMOTION_BACKENDS)}")
+
+
+def _load_onnx_classifier(model_name: str, quantize: bool, intra_op_threads: Optional[int], cache_dir: str):
+    try:
+        import onnxruntime as ort
+        from optimum.onnxruntime import ORTModelForSequenceClassification, ORTQuantizer
+        from optimum.onnxruntime.configuration import AutoQuantizationConfig
+    except ImportError as e:
+        raise ImportError(
+            "ONNX emotion backends need optimum with onnxruntime: pip install \"optimum[onnxruntime]\""
+        ) from e
+
+    export_dir = os.path.join(cache_dir, model_name.replace("/", "--"))
+    if not os.path.exists(os.path.join(export_dir, "model.onnx")):
+        logger.info(f"Exporting '{model_name}' to ONNX in {export_dir}...")
+        ORTModelForSequenceClassification.from_pretrained(model_name, export=True).save_pretrained(export_dir)
+        AutoTokenizer.from_pretrained(model_name).save_pretrained(export_dir)
+
+    model_dir, file_name = export_dir, "model.onnx"
+    if quantize:
+        model_dir, file_name = export_dir + "-int8", "model_quantized.onnx"
+        if not os.path.exists(os.path.join(model_dir, file_name)):
+            logger.info(f"Applying dynamic int8 quantization to '{model_name}' in {model_dir}...")
+            if platform.machine().lower() in ("arm64", "aarch64"):
+                qconfig = AutoQuantizationConfig.arm64(is_static=False, per_channel=False)
+            else:
+                qconfig = AutoQuantizationConfig.avx2(is_static=False, per_channel=False)
+            ORTQuantizer.from_pretrained(export_dir).quantize(save_dir=model_dir, quantization_config=qconfig)
+            AutoTokenizer.from_pretrained(export_dir).save_pretrained(model_dir)
+
+    session_options = ort.SessionOptions()
+    session_options.intra_op_num_threads = intra_op_threads or os.cpu_count() or 1
+    session_options.inter_op_num_threads = 1
+    session_options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+
+    model = ORTModelForSequenceClassification.from_pretrained(
+        model_dir,
+        file_name=file_name,
+        session_options=session_options,
+        provider="CPUExecutionProvider"
+    )
+    return pipeline(
+        "text-classification",
+        model=model,
+        tokenizer=AutoTokenizer.from_pretrained(model_dir),
+        top_k=None,
+        function_to_apply="sigmoid"
+    )
+
+
+class WindowedClassifier:
+    """Text-classification pipeline wrapper that scores long inputs over overlapping token windows.
+
+    A batch is tokenized once with overflow: each text becomes as many
+    `max_length` windows as it needs, overlapping by `stride` tokens. Windows of
+    single-window texts and of long texts run as (at most) two padded forward
+    passes, so a long message costs one batched pass rather than a truncated
+    score. Window scores are combined per text by `aggregate`: "max" (an emotion
+    counts if any part shows it), "mean", or "weighted" (mean weighted by
+    window length). Called and answering like the wrapped pipeline.
+    """
+
+    def __init__(self, classifier, aggregate: str = "max", stride: int = 128):
+        if aggregate not in WINDOW_AGGREGATIONS:
+            raise ValueError(f"Unknown window aggregation '{aggregate}'. Choose one of: {', '.join(WINDOW_AGGREGATIONS)}")
+        self.classifier = classifier
+        self.model = classifier.model
+        self.tokenizer = classifier.tokenizer
+        self.aggregate = aggregate
+        positions = getattr(self.model.config, "max_position_embeddings", 514)
+        # RoBERTa reserves two position slots for the padding offset
+        self.max_length = min(self.tokenizer.model_max_length, positions - 2)
+        self.stride = min(stride, self.max_length // 2)
+        self.labels = [self.model.config.id2label[i] for i in range(len(self.model.config.id2label))]
+
+    def __call__(self, texts, batch_size: Optional[int] = None, **kwargs):
+        if isinstance(texts, str):
+            return self([texts])[0]
+        import numpy as np
+
+        encoded = self.tokenizer(
+            list(texts),
+            truncation=True,
+            max_length=self.max_length,
+            stride=self.stride,
+            return_overflowing_tokens=True
+        )
+        owners = list(encoded["overflow_to_sample_mapping"])
+        windows_per_text = np.bincount(owners, minlength=len(texts))
+        short = [w for w, owner in enumerate(owners) if windows_per_text[owner] == 1]
+        long = [w for w, owner in enumerate(owners) if windows_per_text[owner] > 1]
+
+        probs = np.zeros((len(owners), len(self.labels)), dtype=np.float32)
+        for group in (short, long):
+            if group:
+                probs[group] = self._forward([
+                    {key: encoded[key][w] for key in ("input_ids", "attention_mask")} for w in group
+                ])
+
+        lengths = np.array([len(ids) for ids in encoded["input_ids"]], dtype=np.float32)
+        rows_by_text: List[List[int]] = [[] for _ in range(len(texts))]
+        for w, owner in enumerate(owners):
+            rows_by_text[owner].append(w)
+        results = []
+        for rows in rows_by_text:
+            window_probs = probs[rows]
+            if self.aggregate == "max":
+                scores = window_probs.max(axis=0)
+            elif self.aggregate == "mean":
+                scores = window_probs.mean(axis=0)
+            else:
+                scores = np.average(window_probs, axis=0, weights=lengths[rows])
+            results.append([{"label": label, "score": float(score)} for label, score in zip(self.labels, scores)])
+        return results
+
+    def _forward(self, features: List[Dict]):
+        import torch
+
+        batch = self.tokenizer.pad(features, return_tensors="pt")
+        device = getattr(self.classifier, "device", None)
+        if device is not None and getattr(device, "type", "cpu") != "cpu":
+            batch = {key: value.to(device) for key, value in batch.items()}
+        with torch.no_grad():
+            logits = self.model(**batch).logits
+        # Same sigmoid the pipelines are configured with
+        return torch.sigmoid(logits).float().cpu().numpy()
+
+
+def compare_backends(model_name: str, texts: List[str], backends: List[str],
+                     intra_op_threads: Optional[int] = None) -> Dict[str, Dict]:
+    """Score `texts` on every backend and report latency plus parity against the first one."""
+    scores: Dict[str, List[Dict[str, float]]] = {}
+    report: Dict[str, Dict] = {}
+    for backend in backends:
+        classifier = load_emotion_classifier(model_name, backend, intra_op_threads=intra_op_threads)
+        classifier(texts[0])  # first-call overhead isn't part of the measurement
+        latencies, backend_scores = [], []
+        for text in texts:
+            t0 = time.perf_counter()
+            result = classifier(text)
+            latencies.append(time.perf_counter() - t0)
+            result = result[0] if isinstance(result[0], list) else result
+            backend_scores.append({e["label"]: float(e["score"]) for e in result})
+        scores[backend] = backend_scores
+        report[backend] = {
+            "mean_ms": statistics.mean(latencies) * 1000,
+            "p95_ms": sorted(latencies)[int(0.95 * (len(latencies) - 1))] * 1000
+        }
+
+    reference = backends[0]
+    for backend in backends[1:]:
+        same_labels = all(set(a) == set(b) for a, b in zip(scores[reference], scores[backend]))
+        top2_agree = sum(
+            sorted(a, key=a.get, reverse=True)[:2] == sorted(b, key=b.get, reverse=True)[:2]
+            for a, b in zip(scores[reference], scores[backend])
+        ) / len(texts)
+        max_diff = max(abs(a[label] - b[label]) for a, b in zip(scores[reference], scores[backend]) for label in a)
+        report[backend].update({
+            "identical_labels": same_labels,
+            "top2_agreement": top2_agree,
+            "max_score_diff": max_diff
+        })
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare emotion classifier backends for accuracy and latency.")
+    parser.add_argument("--model", default="j-hartmann/emotion-english-distilroberta-base")
+    parser.add_argument("--backends", nargs="+", default=["pytorch", "onnx-int8"], choices=EMOTION_BACKENDS)
+    parser.add_argument("--texts", help="File with one message per line (defaults to built-in samples)")
+    parser.add_argument("--threads", type=int, help="intra-op thread count for ONNX Runtime")
+    args = parser.parse_args()
+
+    texts = SAMPLE_TEXTS
+    if args.texts:
+        with open(args.texts) as f:
+            texts = [line.strip() for line in f if line.strip()]
+
+    for backend, stats in compare_backends(args.model, texts, args.backends, args.threads).items():
+        print(f"{backend}: " + ", ".join(
+            f"{key}={value:.4f}" if isinstance(value, float) else f"{key}={value}"
+            for key, value in stats.items()
+        ))
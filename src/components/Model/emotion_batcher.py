@@ -0,0 +1,83 @@
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Dict, List, Tuple
+
+logger = logging.getLogger("MIRA")
+
+
+class EmotionBatcher:
+    """Collects classifier calls that arrive within a few milliseconds into one padded batch.
+
+    Each caller gets a Future resolving to the classifier's full score list for its
+    own text, so the per-call pipeline overhead is paid once per batch instead of
+    once per message.
+    """
+
+    def __init__(self, classifier, max_batch_size: int = 16, max_wait_ms: float = 5.0):
+        self.classifier = classifier
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0.0, max_wait_ms) / 1000.0
+        self._queue: "queue.Queue[Tuple[str, Future]]" = queue.Queue()
+        # The classifier is driven by one batch at a time (live or bulk)
+        self._lock = threading.Lock()
+        self._worker = threading.Thread(target=self._run, name="emotion-batcher", daemon=True)
+        self._worker.start()
+
+    def submit(self, text: str) -> Future:
+        future: Future = Future()
+        self._queue.put((text, future))
+        return future
+
+    def classify(self, text: str) -> List[Dict]:
+        return self.submit(text).result()
+
+    def _collect(self) -> List[Tuple[str, Future]]:
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def classify_many(self, texts: List[str]) -> List:
+        """Classify `texts` as one batch, bypassing the wait window (bulk scoring).
+
+        Returns one score list per text, or the Exception raised for that text.
+        Shares the classifier lock with live requests, which wait for at most
+        one bulk batch.
+        """
+        with self._lock:
+            try:
+                results = self.classifier(texts, batch_size=len(texts))
+                if not isinstance(results, list) or len(results) != len(texts):
+                    raise ValueError(f"Unexpected batch output: {results}")
+            except Exception as e:
+                # One bad input shouldn't fail everyone else in the batch
+                logger.warning(f"Batched emotion detection failed ({e}); retrying {len(texts)} inputs one by one.")
+                results = []
+                for text in texts:
+                    try:
+                        single = self.classifier(text)
+                        results.append(single[0] if single and isinstance(single[0], list) else single)
+                    except Exception as single_error:
+                        results.append(single_error)
+        return [scores if isinstance(scores, (list, Exception)) else [scores] for scores in results]
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            results = self.classify_many([text for text, _ in batch])
+            for (_, future), scores in zip(batch, results):
+                if isinstance(scores, Exception):
+                    future.set_exception(scores)
+                else:
+                    future.set_result(scores)
+            logger.debug(f"Emotion batch of {len(batch)} classified.")
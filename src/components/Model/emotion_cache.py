@@ -0,0 +1,172 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Tuple
+
+from metrics import EMOTION_CACHE
+
+logger = logging.getLogger("MIRA")
+
+
+def normalize(text: str) -> str:
+    """Form of a message that is both classified and cached (NFC, no outer whitespace)."""
+    return unicodedata.normalize("NFC", text).strip()
+
+
+class SqliteEmotionStore:
+    """Emotion scores in a local SQLite file, shared by every process that opens it.
+
+    Worker processes each keep their own in-memory cache in front of it, so a
+    message classified by one worker is a cache hit for the others too.
+    """
+
+    def __init__(self, path: str, max_entries: int = 100000):
+        self.path = path
+        self.max_entries = max_entries
+        self._local = threading.local()
+        self._writes = 0
+        with self._connect() as db:
+            db.execute("CREATE TABLE IF NOT EXISTS emotion_cache "
+                       "(key BLOB PRIMARY KEY, scores TEXT NOT NULL, expires REAL NOT NULL)")
+            db.execute("CREATE INDEX IF NOT EXISTS emotion_cache_expires ON emotion_cache (expires)")
+
+    def _connect(self) -> sqlite3.Connection:
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=1.0)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            self._local.db = db
+        return db
+
+    def get(self, key: bytes) -> Optional[Tuple[float, List[Dict]]]:
+        row = self._connect().execute(
+            "SELECT expires, scores FROM emotion_cache WHERE key = ? AND expires > ?", (key, time.time())
+        ).fetchone()
+        return (row[0], json.loads(row[1])) if row else None
+
+    def put(self, key: bytes, expires: float, scores: List[Dict]):
+        with self._connect() as db:
+            db.execute("INSERT OR REPLACE INTO emotion_cache VALUES (?, ?, ?)", (key, json.dumps(scores), expires))
+            self._writes += 1
+            if self._writes % 1000 == 0:
+                self._prune(db)
+
+    def _prune(self, db: sqlite3.Connection):
+        db.execute("DELETE FROM emotion_cache WHERE expires <= ?", (time.time(),))
+        db.execute("DELETE FROM emotion_cache WHERE key IN (SELECT key FROM emotion_cache "
+                   "ORDER BY expires DESC LIMIT -1 OFFSET ?)", (self.max_entries,))
+
+
+class EmotionCache:
+    """Bounded LRU + TTL cache of classifier scores, keyed by a hash of the normalized text.
+
+    The key also covers the model, backend and long-message aggregation, so
+    results from a different classifier setup are never served. Entries hold
+    a 16-byte digest and the score list, not the message itself.
+    """
+
+    def __init__(self, namespace: str, max_entries: int = 4096, ttl_seconds: float = 3600,
+                 store: Optional[SqliteEmotionStore] = None):
+        self.namespace = namespace.encode("utf-8")
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.store = store
+        self._entries: "OrderedDict[bytes, Tuple[float, List[Dict]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def key(self, text: str) -> bytes:
+        return hashlib.blake2b(self.namespace + b"\0" + text.encode("utf-8"), digest_size=16).digest()
+
+    def get(self, text: str) -> Optional[List[Dict]]:
+        """Cached scores for an already normalized text, or None."""
+        key = self.key(text)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(key)
+                self._count("hit")
+                return entry[1]
+            if entry is not None:
+                del self._entries[key]
+        if self.store is not None:
+            try:
+                entry = self.store.get(key)
+            except sqlite3.Error as e:
+                logger.warning(f"Shared emotion cache read failed: {e}")
+                entry = None
+            if entry is not None:
+                with self._lock:
+                    self._insert(key, entry)
+                    self._count("hit")
+                return entry[1]
+        with self._lock:
+            self._count("miss")
+        return None
+
+    def put(self, text: str, scores: List[Dict]):
+        key = self.key(text)
+        expires = time.time() + self.ttl_seconds
+        with self._lock:
+            self._insert(key, (expires, scores))
+        if self.store is not None:
+            try:
+                self.store.put(key, expires, scores)
+            except sqlite3.Error as e:
+                logger.warning(f"Shared emotion cache write failed: {e}")
+
+    def _insert(self, key: bytes, entry: Tuple[float, List[Dict]]):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self._count("eviction")
+
+    def _count(self, result: str):
+        if result == "hit":
+            self.hits += 1
+        elif result == "miss":
+            self.misses += 1
+        else:
+            self.evictions += 1
+        EMOTION_CACHE.labels(result).inc()
+
+    def classify_many(self, classify_many: Callable[[List[str]], List]) -> Callable[[List[str]], List]:
+        """Wrap a batch classifier so only texts missing from the cache reach it."""
+        def cached(texts: List[str]) -> List:
+            texts = [normalize(text) for text in texts]
+            results = [self.get(text) for text in texts]
+            missing = [i for i, scores in enumerate(results) if scores is None]
+            if missing:
+                for i, scores in zip(missing, classify_many([texts[i] for i in missing])):
+                    results[i] = scores
+                    if not isinstance(scores, Exception):
+                        self.put(texts[i], scores)
+            return results
+        return cached
+
+
+def cache_from_env(namespace: str) -> Optional[EmotionCache]:
+    """EMOTION_CACHE_SIZE entries (0 disables), EMOTION_CACHE_TTL_S, and EMOTION_CACHE_PATH to share via SQLite."""
+    size = int(os.getenv("EMOTION_CACHE_SIZE", "4096"))
+    if size <= 0:
+        return None
+    path = os.getenv("EMOTION_CACHE_PATH")
+    store = None
+    if path:
+        try:
+            store = SqliteEmotionStore(path)
+        except sqlite3.Error as e:
+            logger.warning(f"Shared emotion cache at {path} unavailable ({e}); caching in-process only.")
+    return EmotionCache(namespace, max_entries=size, ttl_seconds=float(os.getenv("EMOTION_CACHE_TTL_S", "3600")),
+                        store=store)
@@ -0,0 +1,67 @@
+import os
+from array import array
+from typing import Dict, List, Tuple
+
+# Labels of j-hartmann/emotion-english-distilroberta-base; anything else is ignored
+EMOTION_LABELS = ("anger", "disgust", "fear", "joy", "neutral", "sadness", "surprise")
+_INDEX = {label: i for i, label in enumerate(EMOTION_LABELS)}
+
+# A message's weight halves after this many newer messages
+TREND_HALF_LIFE = float(os.getenv("MIRA_TREND_HALF_LIFE", "3"))
+
+
+class EmotionTrend:
+    """Exponentially decayed average of a chat's full emotion score distribution.
+
+    Holds one float per label plus the total weight, so an update is O(labels)
+    no matter how long the chat is, and the current mood never needs a rescan
+    of the message history.
+    """
+
+    __slots__ = ("_sums", "_weight", "updates")
+
+    def __init__(self):
+        self._sums = array("d", [0.0] * len(EMOTION_LABELS))
+        self._weight = 0.0
+        self.updates = 0
+
+    def update(self, scores: Dict[str, float], half_life: float = TREND_HALF_LIFE):
+        decay = 0.5 ** (1.0 / half_life) if half_life > 0 else 0.0
+        for i in range(len(self._sums)):
+            self._sums[i] *= decay
+        for label, score in scores.items():
+            index = _INDEX.get(label)
+            if index is not None:
+                self._sums[index] += float(score)
+        self._weight = self._weight * decay + 1.0
+        self.updates += 1
+
+    def distribution(self) -> Dict[str, float]:
+        if not self._weight:
+            return {}
+        return {label: self._sums[i] / self._weight for i, label in enumerate(EMOTION_LABELS)}
+
+    def dominant(self, default: str = "neutral") -> str:
+        if not self._weight or not any(self._sums):
+            return default
+        return EMOTION_LABELS[max(range(len(self._sums)), key=self._sums.__getitem__)]
+
+    def state(self) -> Tuple[List[float], float, int]:
+        """Decayed sums, total weight and update count, for persisting the trend."""
+        return list(self._sums), self._weight, self.updates
+
+    @classmethod
+    def from_state(cls, sums: List[float], weight: float, updates: int) -> "EmotionTrend":
+        trend = cls()
+        if len(sums) == len(EMOTION_LABELS):
+            trend._sums = array("d", sums)
+            trend._weight = weight
+            trend.updates = updates
+        return trend
+
+    def to_record(self) -> Dict:
+        return {
+            "distribution": {label: round(score, 6) for label, score in self.distribution().items()},
+            "dominant": self.dominant(),
+            "updates": self.updates
+        }
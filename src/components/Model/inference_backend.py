@@ -0,0 +1,64 @@
+import os
+import threading
+from typing import AsyncIterator, Dict, Iterator, List, Optional, Protocol
+
+from tracing import Trace
+
+
+class InferenceBackend(Protocol):
+    """What app.py, asgi.py and model_server.py need from a backend.
+
+    MIRA, WorkerPool, ModelClient and StubMIRA implement it. The sync methods
+    may block (on the models, a worker process or the model server's socket);
+    async servers call them from a threadpool.
+    """
+
+    ready: threading.Event
+
+    def detect_emotions(self, text: str) -> List[Dict[str, float]]: ...
+
+    def stream_reply(self, user_input: str, session_id: Optional[str] = None,
+                     shed: bool = False, trace: Optional[Trace] = None) -> Iterator[Dict]: ...
+
+    def astream_reply(self, user_input: str, session_id: Optional[str] = None,
+                      shed: bool = False, trace: Optional[Trace] = None) -> AsyncIterator[Dict]: ...
+
+    def score_messages(self, messages: List) -> Iterator[Dict]: ...
+
+    def log_conversation(self, user_input: str, response: Dict, bot_reply: str,
+                         session_id: Optional[str] = None) -> None: ...
+
+    def emotion_trends(self, session_ids: List[str]) -> Dict[str, Dict]: ...
+
+    def close(self) -> None: ...
+
+
+def create_backend(kind: Optional[str] = None, background_load: bool = True,
+                   allow_pool: bool = True) -> InferenceBackend:
+    """The MIRA facade a server process answers from, chosen by MIRA_BACKEND.
+
+    - "local" (default): the models in this process (MIRA), or with
+      MIRA_WORKERS > 1 (and `allow_pool`) a WorkerPool of CPU-pinned processes.
+    - "server": a ModelClient for the host's model_server.py over a Unix
+      socket (MIRA_MODEL_SOCKET), so this process loads no weights.
+    - "stub": a deterministic fake with no weights (benchmarks, CI).
+
+    All of them implement InferenceBackend.
+    """
+    kind = kind or os.getenv("MIRA_BACKEND", "local")
+    if kind == "stub":
+        from stub_mira import StubMIRA
+        return StubMIRA()
+    if kind == "server":
+        from model_client import ModelClient
+        return ModelClient(pool_size=int(os.getenv("MIRA_MODEL_POOL", "8")))
+    if kind != "local":
+        raise ValueError(f"Unknown MIRA_BACKEND={kind!r}; expected local, server or stub.")
+
+    num_workers = int(os.getenv("MIRA_WORKERS", "1"))
+    if allow_pool and num_workers > 1:
+        from worker_pool import WorkerPool
+        cpus_per_worker = os.getenv("MIRA_CPUS_PER_WORKER")
+        return WorkerPool(num_workers, cpus_per_worker=int(cpus_per_worker) if cpus_per_worker else None)
+    from mira import MIRA
+    return MIRA(background_load=background_load)
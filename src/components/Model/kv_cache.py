@@ -0,0 +1,124 @@
+import logging
+import os
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+logger = logging.getLogger("MIRA")
+
+# Assumed when the GGUF metadata doesn't say (the 8B model's figure)
+_FALLBACK_TOKEN_BYTES = 128 * 1024
+
+
+def compact_state(state):
+    """Drop the logits rows from a saved llama.cpp state before caching it.
+
+    `load_state` marks the model for re-evaluation and `create_completion` always
+    evaluates at least the last prompt token again, so saved logits are never
+    read back; with a 128k vocabulary they cost 0.5MB per row. A 1x1 zero array
+    still broadcasts into `load_state`'s score assignment.
+    """
+    scores = getattr(state, "scores", None)
+    if scores is not None and getattr(scores, "size", 0) > 1:
+        empty = scores[:1, :1].copy()
+        empty.fill(0)
+        state.scores = empty
+    return state
+
+
+def kv_bytes_per_token(llama) -> Optional[int]:
+    """F16 KV cache bytes per context token, from the GGUF metadata (None if unknown)."""
+    metadata = getattr(llama, "metadata", None) or {}
+    arch = metadata.get("general.architecture")
+    try:
+        layers = int(metadata[f"{arch}.block_count"])
+        embd = int(metadata[f"{arch}.embedding_length"])
+        heads = int(metadata[f"{arch}.attention.head_count"])
+        kv_heads = int(metadata.get(f"{arch}.attention.head_count_kv", heads))
+    except (KeyError, TypeError, ValueError):
+        return None
+    return 2 * layers * (embd // heads) * kv_heads * 2  # K and V, 2 bytes each
+
+
+def state_cache_bytes(per_token: Optional[int], n_ctx: int, tier_count: int = 1, workers: int = 1) -> int:
+    """One tier's SessionStateCache budget in one process.
+
+    MIRA_KV_CACHE_MB, when set, is the host's budget, split evenly over the
+    worker processes and tiers. Otherwise each tier keeps room for
+    MIRA_KV_CACHE_CHATS full-context chats per host (default 8), split over
+    the workers: a 3B chat at 2048 tokens is about 230MB.
+    """
+    workers = max(1, workers)
+    budget_mb = os.getenv("MIRA_KV_CACHE_MB")
+    if budget_mb:
+        return int(budget_mb) * 1024 * 1024 // (workers * max(1, tier_count))
+    chats = -(-int(os.getenv("MIRA_KV_CACHE_CHATS", "8")) // workers)
+    return max(1, chats) * (per_token or _FALLBACK_TOKEN_BYTES) * n_ctx
+
+
+class SessionStateCache:
+    """LRU cache of llama.cpp states (KV cache + evaluated tokens) keyed by chat session.
+
+    Restoring a session's state before its next turn lets `create_completion`
+    match the already-evaluated prompt prefix and only prefill the new tokens.
+    A state costs roughly its token count times `kv_bytes_per_token` (about
+    112KB for the 3B model), so size `max_bytes` for the number of chats
+    expected to be active at once. Entries are evicted least-recently-used
+    first once `max_bytes` is exceeded.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._states: "OrderedDict[str, object]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _size(state) -> int:
+        # Saved logits count too, unless compact_state dropped them
+        scores = getattr(state, "scores", None)
+        return int(getattr(state, "llama_state_size", 0)) + int(getattr(scores, "nbytes", 0))
+
+    @property
+    def size_bytes(self) -> int:
+        return self._bytes
+
+    def __len__(self) -> int:
+        return len(self._states)
+
+    def get(self, session_id: str):
+        with self._lock:
+            state = self._states.get(session_id)
+            if state is None:
+                self.misses += 1
+                return None
+            self._states.move_to_end(session_id)
+            self.hits += 1
+            return state
+
+    def put(self, session_id: str, state):
+        size = self._size(state)
+        with self._lock:
+            self._discard(session_id)
+            if size > self.max_bytes:
+                logger.debug(f"KV state for session {session_id} ({size} bytes) exceeds cache budget; not cached.")
+                return
+            while self._states and self._bytes + size > self.max_bytes:
+                evicted_id, evicted = self._states.popitem(last=False)
+                self._bytes -= self._size(evicted)
+                self.evictions += 1
+                logger.debug(f"Evicted KV state for session {evicted_id}.")
+            self._states[session_id] = state
+            self._bytes += size
+
+    def discard(self, session_id: str):
+        with self._lock:
+            self._discard(session_id)
+
+    def _discard(self, session_id: str):
+        state: Optional[object] = self._states.pop(session_id, None)
+        if state is not None:
+            self._bytes -= self._size(state)
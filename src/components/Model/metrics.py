@@ -0,0 +1,167 @@
+import bisect
+import threading
+from typing import Dict, List, Optional, Sequence, Tuple
+
+# Latency buckets in seconds: sub-millisecond token steps up to multi-second requests
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+RATIO_BUCKETS = (0.0, 0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 1.0)
+
+
+class _Child:
+    __slots__ = ("_lock", "value")
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0):
+        with self._lock:
+            self.value += amount
+
+    def dec(self, amount: float = 1.0):
+        with self._lock:
+            self.value -= amount
+
+    def set(self, value: float):
+        self.value = value
+
+
+class _HistogramChild:
+    __slots__ = ("_lock", "_bounds", "counts", "sum", "count")
+
+    def __init__(self, bounds: Sequence[float]):
+        self._lock = threading.Lock()
+        self._bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        index = bisect.bisect_left(self._bounds, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], object] = {}
+        self._lock = threading.Lock()
+        if not self.labelnames:
+            self._default = self._new_child()
+            self._children[()] = self._default
+        REGISTRY.append(self)
+
+    def _new_child(self):
+        return _Child()
+
+    def labels(self, *values: str):
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(values, self._new_child())
+        return child
+
+    def _label_text(self, values: Tuple[str, ...], extra: Optional[Tuple[str, str]] = None) -> str:
+        pairs = list(zip(self.labelnames, values))
+        if extra:
+            pairs.append(extra)
+        if not pairs:
+            return ""
+        return "{" + ",".join(f'{key}="{value}"' for key, value in pairs) + "}"
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for values, child in list(self._children.items()):
+            lines.append(f"{self.name}{self._label_text(values)} {child.value}")
+        return lines
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1.0):
+        self._default.inc(amount)
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def inc(self, amount: float = 1.0):
+        self._default.inc(amount)
+
+    def dec(self, amount: float = 1.0):
+        self._default.dec(amount)
+
+    def set(self, value: float):
+        self._default.set(value)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames)
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value: float):
+        self._default.observe(value)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for values, child in list(self._children.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), child.counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f"{self.name}_bucket{self._label_text(values, ('le', le))} {cumulative}")
+            lines.append(f"{self.name}_sum{self._label_text(values)} {child.sum}")
+            lines.append(f"{self.name}_count{self._label_text(values)} {child.count}")
+        return lines
+
+
+REGISTRY: List[_Metric] = []
+
+
+def render() -> str:
+    """All metrics in Prometheus text exposition format."""
+    lines: List[str] = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+EMOTION_SECONDS = Histogram("mira_emotion_inference_seconds", "detect_emotions latency, including batching wait.")
+PREFILL_SECONDS = Histogram("mira_prefill_seconds", "Time from starting a completion to its first token (prompt prefill).")
+TTFT_SECONDS = Histogram("mira_time_to_first_token_seconds", "Time from queueing a generation to its first token.")
+TOKEN_SECONDS = Histogram("mira_decode_token_seconds", "Time between consecutive decoded tokens.")
+REQUEST_SECONDS = Histogram("mira_request_seconds", "Total /model request time, through the end of the stream.")
+INFLIGHT_STREAMS = Gauge("mira_inflight_streams", "/model response streams currently open.")
+QUEUE_DEPTH = Gauge("mira_generation_queue_depth", "Generations waiting for the decode worker.", ["model"])
+GENERATIONS = Counter("mira_generations_total", "Finished generations by outcome.", ["outcome"])
+CANCELLED_TOKENS = Counter("mira_cancelled_tokens_total",
+                           "Tokens decoded for generations stopped early (cancelled, timed out, shed).", ["model"])
+SKIPPED_TOKENS = Counter("mira_skipped_tokens_total",
+                         "Remaining max_tokens budget never decoded because a generation stopped early.", ["model"])
+ERRORS = Counter("mira_errors_total", "Errors by pipeline stage.", ["stage"])
+REJECTED = Counter("mira_rejected_requests_total", "/model requests refused or shed by admission control.", ["reason"])
+FALLBACKS = Counter("mira_fallbacks_total", "Canned/fallback replies served instead of a model answer.", ["reason"])
+EMOTION_CACHE = Counter("mira_emotion_cache_total", "Emotion cache lookups and evictions.", ["result"])
+GENERATION_TIERS = Counter("mira_generation_tier_total", "Generations routed to each model tier.", ["tier"])
+DRAFTED_TOKENS = Counter("mira_speculative_drafted_tokens_total", "Tokens proposed by the speculative drafter.")
+ACCEPTED_TOKENS = Counter("mira_speculative_accepted_tokens_total", "Drafted tokens the model accepted.")
+DRAFT_ACCEPTANCE = Histogram("mira_speculative_acceptance_ratio", "Per-generation share of drafted tokens accepted.",
+                             buckets=RATIO_BUCKETS)
+TOKENS_PER_PASS = Histogram("mira_tokens_per_forward_pass", "Per-generation tokens decoded per forward pass (1.0 without drafting).",
+                            buckets=(1.0, 1.1, 1.25, 1.5, 1.75, 2.0, 2.5, 3.0, 4.0, 6.0))
+TRACES = Counter("mira_traces_total", "Requests recorded by sampled tracing.")
@@ -1,13 +1,29 @@
+import asyncio
 import logging
 import os
-from transformers import pipeline
+import sqlite3
 import torch
-import json
 from datetime import datetime
-from typing import Dict, List, Generator
+from typing import AsyncGenerator, Dict, List, Generator, Optional, Tuple
 from llama_cpp import Llama
+import threading
 import time
-from collections import Counter
+from concurrent.futures import Future, ThreadPoolExecutor
+from batched_scheduler import BatchedGenerationScheduler
+from scheduler import GenerationRequest, GenerationScheduler, SchedulerFull
+from kv_cache import SessionStateCache, kv_bytes_per_token, state_cache_bytes
+from prompt_builder import PromptBuilder
+from model_registry import MODEL_TIERS, ModelRegistry, ModelTier, TierController, local_model_path, tier_names, tier_threads
+from autotune import tuned_params
+from session_store import HISTORY_TURNS, SessionStore, SqliteTrendStore
+from emotion_trend import EmotionTrend
+from conversation_log import ConversationLogWriter, rebuild_latest
+from metrics import EMOTION_SECONDS, ERRORS, FALLBACKS
+from tracing import Trace, span
+from emotion_batcher import EmotionBatcher
+from emotion_cache import EmotionCache, cache_from_env, normalize
+import batch_scoring
+from emotion_backends import load_emotion_classifier
 
 # Configure logging
 logging_level = os.getenv("LOGGING_LEVEL", "INFO").upper()
@@ -17,49 +33,253 @@ logging.basicConfig(
 )
 logger = logging.getLogger("MIRA")
 
+LLAMA_REPO_ID, LLAMA_FILENAME = MODEL_TIERS["small"]
+
+# Shared system block; kept free of indentation, which would only add prompt tokens
+SYSTEM_PROMPT = (
+    "<|start_header_id|>system<|end_header_id|>\n"
+    "You are MIRA, an emotionally intelligent chatbot powered by LLaMA 3.2.\n"
+    "{tone_instruction}\n<|eot_id|>\n"
+)
+
+# Start of every prompt turn, up to where the turn's emotion summary goes
+TURN_HEAD = "<|start_header_id|>system<|end_header_id|>\nUser emotion summary:"
+
+# Reply length cap; the prompt gets the rest of the context window
+MAX_REPLY_TOKENS = 256
+# Room left in the prompt budget for the emotion summary, which comes later
+SUMMARY_TOKENS = 24
+
+# Sampling temperature per emotion, blended by the chat's emotion trend
+EMOTION_TEMPERATURES = {
+    "sadness": 0.6,
+    "fear": 0.6,
+    "joy": 0.9,
+    "anger": 0.9,
+    "neutral": 0.75
+}
+
 class MIRA:
     """Emotion-aware chatbot using RoBERTa for emotion detection and LLaMA 3.2 for streaming responses."""
 
-    def __init__(self, model_name: str = "j-hartmann/emotion-english-distilroberta-base"):
+    def __init__(self, model_name: str = "j-hartmann/emotion-english-distilroberta-base",
+                 emotion_backend: Optional[str] = None, background_load: bool = False,
+                 n_threads: Optional[int] = None, workers: int = 1):
         self.model_name = model_name
+        # llama.cpp threads; worker pools pass the size of their pinned CPU set
+        # Explicit thread count (argument, then MIRA_N_THREADS) beats the autotune profile
+        threads = n_threads or os.getenv("MIRA_N_THREADS")
+        self.n_threads: Optional[int] = int(threads) if threads else None
+        # Processes on this host sharing the KV state budget (see state_cache_bytes)
+        self.workers = workers
+        # "pytorch" (default), "onnx" or "onnx-int8"; see emotion_backends.py
+        self.emotion_backend = emotion_backend or os.getenv("EMOTION_BACKEND", "pytorch")
         self.device = 0 if torch.cuda.is_available() else -1
         self.responses = self._load_responses()
-        self.conversation_history: List[Dict] = []
-        self.recent_emotions: List[str] = []
+        # Turns are appended to a JSONL log by a background writer (see save_conversation)
+        self.conversation_folder = os.getenv("MIRA_CONVERSATION_DIR", "conversations")
+        self.conversation_log: Optional[ConversationLogWriter] = None
+        self.log_session = datetime.now().strftime('%Y%m%d_%H%M%S')
+        self.log_web_turns = os.getenv("MIRA_LOG_CONVERSATIONS", "0") == "1"
+        self.emotion_trend = EmotionTrend()
         self.recent_context: List[Dict[str, str]] = []
         self.personality: str = "friendly"  # Default personality
 
-        # Load emotion classifier
+        # Web sessions keep their own bounded context instead of the lists above
+        self.sessions = SessionStore(
+            max_sessions=int(os.getenv("MIRA_MAX_SESSIONS", "10000")),
+            ttl_seconds=float(os.getenv("MIRA_SESSION_TTL", "3600")),
+            max_bytes=int(os.getenv("MIRA_SESSION_STORE_MB", "64")) * 1024 * 1024,
+            trend_store=self._trend_store()
+        )
+
+        # Filled in by _load_models; /ready reports healthy once `ready` is set
+        self.emotion_classifier = None
+        self.emotion_batcher: Optional[EmotionBatcher] = None
+        self.emotion_cache: Optional[EmotionCache] = None
+        self.llama: Optional[Llama] = None
+        self.scheduler: Optional[GenerationScheduler] = None
+        self.prompt_builder: Optional[PromptBuilder] = None
+        # self.llama / scheduler / prompt_builder are the smallest loaded tier's
+        self.models = ModelRegistry()
+        self.tier_controller = TierController(
+            self.models,
+            latency_slo=float(os.getenv("MIRA_LATENCY_SLO_S", "30")),
+            max_tokens=MAX_REPLY_TOKENS,
+            min_tokens=int(os.getenv("MIRA_MIN_REPLY_TOKENS", "96"))
+        )
+        self.ready = threading.Event()
+        self.warmup = os.getenv("MIRA_WARMUP", "1") != "0"
+
+        # Every generation goes through the decode worker that owns its tier's
+        # model; per-session KV states let follow-up turns skip re-prefilling
+        # the prompt. The cache is sized per tier by state_cache_bytes; a chat
+        # near the 2048-token window takes ~230MB with the 3B model.
+        self.kv_cache: Optional[SessionStateCache] = None
+        self.generation_budget = float(os.getenv("MIRA_GENERATION_BUDGET_S", "60"))
+        # Past the queue-wait SLO a reply is either refused ("reject": callers see
+        # SchedulerFull and answer 503) or replaced by a canned one ("canned")
+        self.queue_wait_slo = float(os.getenv("MIRA_QUEUE_WAIT_SLO_S", "10"))
+        self.overload_mode = os.getenv("MIRA_OVERLOAD_MODE", "reject")
+
+        if background_load:
+            threading.Thread(target=self._load_models, name="mira-loader", daemon=True).start()
+        elif not self._load_models():
+            print("MIRA: Unable to load emotion detection model.")
+            exit(1)
+
+    def _load_models(self) -> bool:
+        """Load (and warm up) both models concurrently. Returns False if the classifier failed."""
+        t0 = time.time()
+        with ThreadPoolExecutor(max_workers=2, thread_name_prefix="mira-load") as pool:
+            emotion_loaded = pool.submit(self._load_emotion_model)
+            pool.submit(self._load_llama).result()
+            if not emotion_loaded.result():
+                logger.critical("Emotion model unavailable; MIRA will not report ready.")
+                return False
+
+        self.ready.set()
+        logger.info(f"MIRA ready in {time.time() - t0:.2f}s.")
+        return True
+
+    def _load_emotion_model(self) -> bool:
         try:
-            self.emotion_classifier = pipeline(
-                "text-classification",
-                model=self.model_name,
+            t0 = time.time()
+            threads = os.getenv("EMOTION_INTRA_OP_THREADS")
+            # Messages past the 512-token limit are scored over overlapping windows
+            window_aggregate = os.getenv("EMOTION_WINDOW_AGG", "max")
+            window_stride = int(os.getenv("EMOTION_WINDOW_STRIDE", "128"))
+            self.emotion_classifier = load_emotion_classifier(
+                self.model_name,
+                backend=self.emotion_backend,
                 device=self.device,
-                top_k=None,
-                function_to_apply="sigmoid",
-                return_all_scores=True
+                intra_op_threads=int(threads) if threads else None,
+                window_aggregate=None if window_aggregate == "off" else window_aggregate,
+                window_stride=window_stride
+            )
+            t1 = time.time()
+            logger.info(f"Emotion model '{self.model_name}' ({self.emotion_backend}) loaded successfully on {'GPU' if self.device == 0 and self.emotion_backend == 'pytorch' else 'CPU'} in {t1 - t0:.2f}s.")
+
+            # Concurrent detect_emotions calls share one classifier batch
+            self.emotion_batcher = EmotionBatcher(
+                self.emotion_classifier,
+                max_batch_size=int(os.getenv("EMOTION_MAX_BATCH", "16")),
+                max_wait_ms=float(os.getenv("EMOTION_MAX_WAIT_MS", "5"))
+            )
+            # Repeated short messages ("idk", "thanks") skip the classifier;
+            # the key covers everything that changes the scores
+            self.emotion_cache = cache_from_env(
+                f"{self.model_name}|{self.emotion_backend}|{window_aggregate}|{window_stride}"
             )
-            logger.info(f"Emotion model '{model_name}' loaded successfully on {'GPU' if self.device == 0 else 'CPU'}.")
+
+            if self.warmup:
+                self.emotion_batcher.classify("Hi, I'm feeling a bit nervous about today.")
+                logger.info(f"Emotion model warmup: {time.time() - t1:.2f}s")
+            return True
         except Exception as e:
             logger.error(f"Failed to load emotion model: {e}", exc_info=True)
-            print("MIRA: Unable to load emotion detection model.")
-            exit(1)
+            return False
+
+    @staticmethod
+    def _draft_model():
+        """Speculative drafter selected by MIRA_SPECULATIVE, or None for plain decoding.
+
+        Only "prompt-lookup" is supported: it drafts from n-grams already in the
+        prompt, so it needs no second model. It turns on logits_all, which adds
+        n_ctx x vocab floats of memory and makes saved session states larger.
+        """
+        mode = os.getenv("MIRA_SPECULATIVE", "off").lower()
+        if mode in ("", "0", "off"):
+            return None
+        if mode != "prompt-lookup":
+            logger.warning(f"Unknown MIRA_SPECULATIVE={mode!r}; using plain decoding.")
+            return None
+        from speculative import CountingPromptLookup
+        # Batching a few drafted tokens is almost free on GPU but not on CPU
+        default_tokens = "10" if torch.cuda.is_available() else "2"
+        return CountingPromptLookup(
+            max_ngram_size=int(os.getenv("MIRA_DRAFT_NGRAM", "2")),
+            num_pred_tokens=int(os.getenv("MIRA_DRAFT_TOKENS", default_tokens))
+        )
+
+    def _load_llama(self):
+        names = tier_names()
+        for name in names:
+            tier = self._load_tier(name, len(names))
+            if tier is not None:
+                self.models.add(tier)
+        default = self.models.default
+        if default is None:
+            return
+        self.llama, self.scheduler, self.prompt_builder = default.llama, default.scheduler, default.prompt_builder
+        self.kv_cache = default.scheduler.state_cache
+        if len(self.models) > 1:
+            logger.info(f"Model tiers loaded: {[tier.name for tier in self.models.tiers]}.")
 
-        # Load LLaMA 3.2 model
+    def _load_tier(self, name: str, tier_count: int) -> Optional[ModelTier]:
+        repo_id, filename = MODEL_TIERS[name]
         try:
-            self.llama = Llama.from_pretrained(
-                repo_id="bartowski/Llama-3.2-3B-Instruct-GGUF",
-                filename="Llama-3.2-3B-Instruct-Q4_K_M.gguf",
+            t0 = time.time()
+            model_path = local_model_path(name)
+            # Defaults, overridden by this host's autotune.py profile if there is one
+            params = tuned_params(model_path or filename, dict(
                 n_ctx=2048,
                 n_threads=6,
                 n_batch=64,
-                n_gpu_layers=40 if torch.cuda.is_available() else 0,
-                verbose=False
-            )
-            logger.info("LLaMA model loaded successfully.")
+                n_gpu_layers=40 if torch.cuda.is_available() else 0
+            ))
+            if self.n_threads:
+                params["n_threads"] = self.n_threads
+            # Each reply runs on one tier, so a tier gets the whole budget unless
+            # MIRA_TIER_THREADS splits it for tiers that decode at the same time
+            threads = tier_threads().get(name)
+            if threads:
+                logger.info(f"Tier '{name}' uses {threads} threads (MIRA_TIER_THREADS).")
+                params.update(n_threads=threads, n_threads_batch=threads)
+            params.update(use_mmap=True, verbose=False)
+            draft_model = self._draft_model()
+            if draft_model is not None:
+                params["draft_model"] = draft_model
+            if model_path:
+                llama = Llama(model_path=model_path, **params)
+            else:
+                logger.info(f"No local GGUF found for tier '{name}'; downloading from the Hugging Face hub.")
+                llama = Llama.from_pretrained(repo_id=repo_id, filename=filename, **params)
+            t1 = time.time()
+            logger.info(f"LLaMA model ({name}) loaded successfully from {model_path or repo_id} in {t1 - t0:.2f}s.")
+
+            if self.warmup:
+                # Primes the graph and allocations; the scheduler isn't running yet
+                llama.create_completion("Hello", max_tokens=1)
+                logger.info(f"LLaMA warmup ({name}): {time.time() - t1:.2f}s")
         except Exception as e:
-            logger.error(f"Failed to load LLaMA model: {e}", exc_info=True)
-            self.llama = None
+            logger.error(f"Failed to load LLaMA model ({name}): {e}", exc_info=True)
+            return None
+
+        max_queue = int(os.getenv("MIRA_MAX_QUEUE", "32"))
+        per_token = kv_bytes_per_token(llama)
+        slots = int(os.getenv("MIRA_BATCH_SLOTS", "1"))
+        if slots > 1:
+            # Several chats decode in the same forward pass, each in its own sequence
+            try:
+                scheduler = BatchedGenerationScheduler(llama, slots, max_queue=max_queue, name=name)
+                kv_mb = f" (~{per_token * llama.n_ctx() * slots // 2**20}MB KV cache)" if per_token else ""
+                logger.info(f"Batched decoding on '{name}': {slots} sequences of {llama.n_ctx()} tokens{kv_mb}.")
+                return ModelTier(name, llama, scheduler, PromptBuilder(llama, max_tokens=MAX_REPLY_TOKENS))
+            except Exception as e:
+                logger.warning(f"Batched decoding unavailable on '{name}' ({e}); decoding one chat at a time.")
+
+        cache_bytes = state_cache_bytes(per_token, llama.n_ctx(), tier_count, self.workers)
+        if per_token:
+            logger.info(f"KV state cache ({name}): {cache_bytes // 2**20}MB holds ~{cache_bytes // per_token} tokens "
+                        f"({cache_bytes // (per_token * llama.n_ctx())} full-context chats).")
+        scheduler = GenerationScheduler(
+            llama,
+            max_queue=max_queue,
+            name=name,
+            state_cache=SessionStateCache(max_bytes=cache_bytes)
+        )
+        return ModelTier(name, llama, scheduler, PromptBuilder(llama, max_tokens=MAX_REPLY_TOKENS))
 
     def _load_responses(self) -> Dict[str, str]:
         return {
@@ -74,111 +294,410 @@ class MIRA:
             "error": "I'm having trouble understanding. Could you rephrase that?"
         }
 
-    def detect_emotions(self, text: str) -> List[Dict[str, float]]:
+    def submit_emotions(self, text: str) -> Future:
+        """Start emotion detection; the Future resolves to the top emotions and never raises."""
+        result: Future = Future()
+        self._submit_scores(text).add_done_callback(lambda done: result.set_result(self._rank(done.result())))
+        return result
+
+    def _submit_scores(self, text: str, trace: Optional[Trace] = None) -> Future:
+        """Start emotion detection; the Future resolves to every label's score ({} on failure)."""
+        result: Future = Future()
         if not isinstance(text, str) or not text.strip():
             logger.warning("Invalid input: Empty or non-string text.")
-            return [{"emotion": "error", "confidence": 0.0}]
+            result.set_result({})
+            return result
+
+        # Classified in normalized form whether or not the cache is on, so a hit
+        # returns exactly what the classifier would
+        text = normalize(text)
+        cached = self.emotion_cache.get(text) if self.emotion_cache else None
+        if cached is not None:
+            if trace is not None:
+                trace.instant("emotion_cache_hit")
+            result.set_result(self._score_map(cached))
+            return result
+
+        t0 = time.perf_counter()
+        started = time.time()
+
+        def resolve(batch: Future):
+            try:
+                scores = self._score_map(batch.result())
+                if scores and self.emotion_cache:
+                    self.emotion_cache.put(text, batch.result())
+            except Exception as e:
+                logger.error(f"Emotion detection failed: {e}", exc_info=True)
+                ERRORS.labels("emotion").inc()
+                scores = {}
+            EMOTION_SECONDS.observe(time.perf_counter() - t0)
+            if trace is not None:
+                trace.add("detect_emotions", started, failed=not scores)
+            result.set_result(scores)
 
         try:
-            results = self.emotion_classifier(text)
-            if not results or not isinstance(results[0], list):
-                logger.error(f"Unexpected model output: {results}")
-                return [{"emotion": "error", "confidence": 0.0}]
-
-            top_emotions = sorted(results[0], key=lambda x: x["score"], reverse=True)[:2]
-            return [{"emotion": e["label"], "confidence": float(e["score"])} for e in top_emotions]
+            self.emotion_batcher.submit(text).add_done_callback(resolve)
         except Exception as e:
-            logger.error(f"Emotion detection failed: {e}", exc_info=True)
-            return [{"emotion": "error", "confidence": 0.0}]
+            failed: Future = Future()
+            failed.set_exception(e)
+            resolve(failed)
+        return result
 
-    def generate_llama_response_stream(self, user_input: str, emotion_summary: str = "") -> Generator[Dict[str, str], None, None]:
-        """Streaming response generator."""
-        if not self.llama:
-            yield {"chunk": "Sorry, my generative brain isn't working right now.", "done": True}
-            return
-
-        dominant_emotion = self.recent_emotions[-1] if self.recent_emotions else "neutral"
-        temp = {
-            "sadness": 0.6,
-            "fear": 0.6,
-            "joy": 0.9,
-            "anger": 0.9,
-            "neutral": 0.75
-        }.get(dominant_emotion, 0.75)
+    def detect_emotions(self, text: str) -> List[Dict[str, float]]:
+        return self.submit_emotions(text).result()
+
+    async def _asubmit_scores(self, text: str, trace: Optional[Trace] = None) -> Future:
+        """_submit_scores from an event loop; a shared emotion cache is a SQLite read, done in the default executor."""
+        if self.emotion_cache is not None and self.emotion_cache.store is not None:
+            return await asyncio.get_running_loop().run_in_executor(None, self._submit_scores, text, trace)
+        return self._submit_scores(text, trace)
+
+    async def adetect_emotions(self, text: str) -> List[Dict[str, float]]:
+        """Async detect_emotions: awaits the batcher's future instead of blocking a thread."""
+        return self._rank(await asyncio.wrap_future(await self._asubmit_scores(text)))
+
+    def score_messages(self, messages: List[Tuple[str, str]]) -> Generator[Dict, None, None]:
+        """Bulk scores for (id, text) pairs, e.g. stored messages; see batch_scoring.py."""
+        classify_many = self.emotion_batcher.classify_many
+        if self.emotion_cache:
+            classify_many = self.emotion_cache.classify_many(classify_many)
+        yield from batch_scoring.score_messages(classify_many, messages)
+
+    @staticmethod
+    def _score_map(scores: List[Dict]) -> Dict[str, float]:
+        if not scores or not isinstance(scores[0], dict):
+            logger.error(f"Unexpected model output: {scores}")
+            return {}
+        return {e["label"]: float(e["score"]) for e in scores}
+
+    @staticmethod
+    def _rank(scores: Dict[str, float]) -> List[Dict[str, float]]:
+        if not scores:
+            return [{"emotion": "error", "confidence": 0.0}]
+        top_emotions = sorted(scores.items(), key=lambda x: x[1], reverse=True)[:2]
+        return [{"emotion": label, "confidence": score} for label, score in top_emotions]
+
+    @staticmethod
+    def format_emotion_summary(emotion_results: List[Dict[str, float]]) -> str:
+        return ", ".join([f"{e['emotion']} ({e['confidence']:.0%})" for e in emotion_results])
+
+    @staticmethod
+    def _turn_tail(user_input: str, emotion_summary: str) -> str:
+        # Everything in a turn from the emotion summary on; the part before it
+        # (TURN_HEAD) can be prefilled while the classifier is still running
+        return (
+            f" {emotion_summary}\n<|eot_id|>\n"
+            f"<|start_header_id|>user<|end_header_id|>\n{user_input}\n<|eot_id|>\n"
+            f"<|start_header_id|>assistant<|end_header_id|>"
+        )
+
+    @classmethod
+    def _format_turn(cls, user_input: str, emotion_summary: str, bot_reply: Optional[str] = None) -> str:
+        # Past turns are rendered exactly as they were when live, so the previous
+        # turn's prompt + reply stays a token prefix of the next prompt (KV reuse)
+        turn = TURN_HEAD + cls._turn_tail(user_input, emotion_summary)
+        if bot_reply is not None:
+            turn += f"{bot_reply}<|eot_id|>\n"
+        return turn
+
+    def _build_generation(self, session_id: Optional[str], user_input: str,
+                          context: Optional[Tuple[List[Dict[str, str]], Dict[str, float]]] = None
+                          ) -> Tuple[ModelTier, str, Dict, str]:
+        """Model tier, prompt up to the current turn's emotion summary, sampling params and the user input to send.
+
+        Nothing in it depends on the current message's emotions (temperature
+        follows the earlier ones), so it can be queued before they are known.
+        Past turns that don't fit the context window are left out, oldest first,
+        and forgotten so the following prompts keep the shortened prefix.
+        The tier and reply length follow the current load (see TierController).
+        `context` is the session's (turns, mood) when the caller already fetched it.
+        """
+        if context is not None:
+            recent_context, mood = context
+        elif session_id:
+            recent_context, mood = self.sessions.context(session_id)
+        else:
+            recent_context, mood = self.recent_context, self.emotion_trend.distribution()
+
+        # Blend of the per-emotion temperatures, weighted by the chat's decayed
+        # emotion distribution rather than the last message's top label
+        total = sum(mood.values())
+        temp = sum(EMOTION_TEMPERATURES.get(label, 0.75) * score for label, score in mood.items()) / total if total else 0.75
 
         tone_instruction = "Use a cheerful and casual tone."  # Always friendly
 
-        context_block = ""
-        for turn in self.recent_context[-3:]:
-            context_block += f"<|start_header_id|>user<|end_header_id|>\n{turn['user']}\n<|eot_id|>\n"
-            context_block += f"<|start_header_id|>assistant<|end_header_id|>\n{turn['bot']}\n<|eot_id|>\n"
-
-        prompt = f"""<|start_header_id|>system<|end_header_id|>
-                    You are MIRA, an emotionally intelligent chatbot powered by LLaMA 3.2.
-                    {tone_instruction}
-                    User emotion summary: {emotion_summary}
-                    <|eot_id|>
-                    {context_block}<|start_header_id|>user<|end_header_id|>
-                    {user_input}
-                    <|eot_id|>
-                    <|start_header_id|>assistant<|end_header_id|>"""
+        # The emotion summary changes every turn, so it is kept out of the shared
+        # system block and attached to the turn it describes
+        system_block = SYSTEM_PROMPT.format(tone_instruction=tone_instruction)
+        turns = [
+            self._format_turn(turn['user'], turn.get('emotion_summary', ''), turn['bot'])
+            for turn in recent_context
+        ]
+        tier, max_tokens = self.tier_controller.choose()
+        kept, user_input = tier.prompt_builder.fit(
+            [system_block, TURN_HEAD, self._turn_tail("", "")], turns, user_input, reserve=SUMMARY_TOKENS
+        )
+        dropped = len(turns) - len(kept)
+        if dropped and session_id:
+            self.sessions.drop_oldest(session_id, dropped)
+        elif dropped:
+            del self.recent_context[:dropped]
+        turns = kept
+        prefix = system_block + "".join(turns) + TURN_HEAD
+
+        return tier, prefix, {
+            "max_tokens": max_tokens,
+            "temperature": temp,
+            "top_p": 0.9,
+            "stop": ["<|eot_id|>"],
+            "session_id": session_id,
+            "time_budget": self.generation_budget,
+            "max_wait": self.queue_wait_slo
+        }, user_input
+
+    def generate_llama_response_stream(self, user_input: str, emotion_summary: str = "",
+                                       session_id: Optional[str] = None) -> Generator[Dict[str, str], None, None]:
+        """Streaming response generator. `session_id` keys the reusable KV state of the chat."""
+        summary: Future = Future()
+        summary.set_result(emotion_summary)
+        yield from self._relay_generation(session_id, user_input, summary)
+
+    def stream_reply(self, user_input: str, session_id: Optional[str] = None,
+                     shed: bool = False, trace: Optional[Trace] = None) -> Generator[Dict, None, None]:
+        """Emotion header followed by the reply chunks, with the prompt prefill overlapping emotion detection.
+
+        The prompt is queued before the classifier finishes; the decode worker
+        prefills it and appends the emotion summary and user turn once they resolve.
+        With `shed` the LLaMA is skipped and the canned reply for the emotion is sent.
+        In "reject" overload mode SchedulerFull is raised before the header.
+        A sampled request's `trace` gets a span per stage and the token timestamps.
+        """
+        scores = self._submit_scores(user_input, trace)
+        if shed:
+            yield from self._canned_stream(scores.result(), header=True)
+            return
+        yield from self._relay_generation(session_id, user_input, self._summary_future(scores), scores, trace)
+
+    def _canned_stream(self, scores: Optional[Dict[str, float]], header: bool) -> Generator[Dict, None, None]:
+        FALLBACKS.labels("overload").inc()
+        if header:
+            yield self._emotion_header(scores)
+        top = self._rank(scores)[0]["emotion"] if scores else "neutral"
+        yield {"chunk": self.responses.get(top, self.responses["neutral"]), "done": True}
+
+    def _summary_future(self, scores: Future) -> Future:
+        summary: Future = Future()
+        scores.add_done_callback(
+            lambda done: summary.set_result(self.format_emotion_summary(self._rank(done.result())))
+        )
+        return summary
+
+    def _tail_future(self, user_input: str, summary: Future) -> Future:
+        tail: Future = Future()
+        summary.add_done_callback(lambda done: tail.set_result(self._turn_tail(user_input, done.result())))
+        return tail
+
+    def _emotion_header(self, scores: Dict[str, float], generation: Optional[GenerationRequest] = None) -> Dict:
+        # `tier` / `max_tokens` say which model answers and how long the reply
+        # may get; both are None when no model generation follows
+        emotion_results = self._rank(scores)
+        return {
+            "emotions": emotion_results,
+            "emotion_summary": self.format_emotion_summary(emotion_results),
+            "emotion_scores": {label: round(score, 6) for label, score in scores.items()},
+            "tier": generation.model if generation is not None else None,
+            "max_tokens": generation.params["max_tokens"] if generation is not None else None,
+            "chunk": "",
+            "done": False
+        }
 
+    def _relay_generation(self, session_id: Optional[str], user_input: str, summary: Future,
+                          scores: Optional[Future] = None,
+                          trace: Optional[Trace] = None) -> Generator[Dict, None, None]:
+        stream = None
+        header_sent = scores is None
         try:
-            stream = self.llama.create_completion(
-                prompt,
-                max_tokens=256,
-                temperature=temp,
-                top_p=0.9,
-                stop=["<|eot_id|>"],
-                stream=True
-            )
-
-            full_response = ""
-            for output in stream:
-                chunk = output["choices"][0]["text"]
-                full_response += chunk
+            if self.scheduler:
+                with span(trace, "build_prompt") as args:
+                    tier, prefix, params, user_input = self._build_generation(session_id, user_input)
+                    args.update(tier=tier.name, max_tokens=params["max_tokens"])
+                stream = tier.scheduler.submit(prefix, suffix=self._tail_future(user_input, summary),
+                                               trace=trace, **params)
+            if not header_sent:
+                header_sent = True
+                yield self._emotion_header(scores.result(), stream)
+            if stream is None:
+                FALLBACKS.labels("llama_unavailable").inc()
+                yield {"chunk": "Sorry, my generative brain isn't working right now.", "done": True}
+                return
+
+            for chunk in stream:
                 yield {"chunk": chunk, "done": False}
 
             yield {"chunk": "", "done": True}
 
+        except SchedulerFull as e:
+            logger.warning(f"Generation shed: {e}")
+            if not header_sent and self.overload_mode == "reject":
+                raise
+            yield from self._canned_stream(scores.result() if scores is not None else None, header=not header_sent)
         except Exception as e:
             logger.error(f"LLaMA 3.2 streaming response failed: {e}", exc_info=True)
+            ERRORS.labels("generation").inc()
+            FALLBACKS.labels("generation_error").inc()
+            if not header_sent:
+                yield self._emotion_header(scores.result())
             yield {"chunk": "I'm having trouble responding right now.", "done": True}
+        finally:
+            # Reached early when the consumer goes away (client disconnect):
+            # stop decoding instead of finishing a reply nobody will read
+            if stream is not None:
+                stream.cancel()
+
+    async def agenerate_llama_response_stream(self, user_input: str, emotion_summary: str = "",
+                                              session_id: Optional[str] = None) -> AsyncGenerator[Dict[str, str], None]:
+        """Async streaming response generator: tokens arrive on the event loop, no thread is held."""
+        summary: Future = Future()
+        summary.set_result(emotion_summary)
+        async for chunk in self._arelay_generation(session_id, user_input, summary):
+            yield chunk
+
+    async def astream_reply(self, user_input: str, session_id: Optional[str] = None,
+                            shed: bool = False, trace: Optional[Trace] = None) -> AsyncGenerator[Dict, None]:
+        """Async stream_reply."""
+        scores = await self._asubmit_scores(user_input, trace)
+        if shed:
+            for chunk in self._canned_stream(await asyncio.wrap_future(scores), header=True):
+                yield chunk
+            return
+        async for chunk in self._arelay_generation(session_id, user_input, self._summary_future(scores), scores,
+                                                   trace):
+            yield chunk
+
+    async def _arelay_generation(self, session_id: Optional[str], user_input: str, summary: Future,
+                                 scores: Optional[Future] = None,
+                                 trace: Optional[Trace] = None) -> AsyncGenerator[Dict, None]:
+        stream = None
+        header_sent = scores is None
+        try:
+            if self.scheduler:
+                with span(trace, "build_prompt") as args:
+                    # A returning session's trend comes from SQLite; read it off the loop
+                    context = await self.sessions.acontext(session_id) if session_id else None
+                    tier, prefix, params, user_input = self._build_generation(session_id, user_input, context)
+                    args.update(tier=tier.name, max_tokens=params["max_tokens"])
+                stream = tier.scheduler.submit(prefix, loop=asyncio.get_running_loop(),
+                                               suffix=self._tail_future(user_input, summary), trace=trace, **params)
+            if not header_sent:
+                header_sent = True
+                yield self._emotion_header(await asyncio.wrap_future(scores), stream)
+            if stream is None:
+                FALLBACKS.labels("llama_unavailable").inc()
+                yield {"chunk": "Sorry, my generative brain isn't working right now.", "done": True}
+                return
+
+            async for chunk in stream:
+                yield {"chunk": chunk, "done": False}
+
+            yield {"chunk": "", "done": True}
 
-    def log_conversation(self, user_input: str, response: Dict, bot_reply: str):
-        self.conversation_history.append({
+        except SchedulerFull as e:
+            logger.warning(f"Generation shed: {e}")
+            if not header_sent and self.overload_mode == "reject":
+                raise
+            emotion_scores = await asyncio.wrap_future(scores) if scores is not None else None
+            for chunk in self._canned_stream(emotion_scores, header=not header_sent):
+                yield chunk
+        except Exception as e:
+            logger.error(f"LLaMA 3.2 streaming response failed: {e}", exc_info=True)
+            ERRORS.labels("generation").inc()
+            FALLBACKS.labels("generation_error").inc()
+            if not header_sent:
+                yield self._emotion_header(await asyncio.wrap_future(scores))
+            yield {"chunk": "I'm having trouble responding right now.", "done": True}
+        finally:
+            # Reached early when the consumer goes away (client disconnect):
+            # stop decoding instead of finishing a reply nobody will read
+            if stream is not None:
+                stream.cancel()
+
+    def log_conversation(self, user_input: str, response: Dict, bot_reply: str, session_id: Optional[str] = None):
+        # The full score map comes with the stream header; older callers only
+        # pass the top emotions, which are used as a partial distribution
+        scores = response.get("emotion_scores") or {
+            e['emotion']: e['confidence'] for e in response.get("emotions_detected", [])
+        }
+        record = {
             "timestamp": datetime.now().isoformat(),
             "user_input": user_input,
             "response": response,
-            "bot_reply": bot_reply
-        })
+            "bot_reply": bot_reply,
+            "session": session_id or self.log_session
+        }
+        if session_id:
+            record["emotion_trend"] = self.sessions.record_turn(
+                session_id, user_input, bot_reply,
+                response.get("emotion_summary", ""), scores
+            )
+            if self.log_web_turns:
+                self._log_writer().append(record)
+            return
+
+        self.emotion_trend.update(scores)
+        record["emotion_trend"] = self.emotion_trend.to_record()
+        self._log_writer().append(record)
 
-        emotions = [e['emotion'] for e in response.get("emotions_detected", [])]
-        self.recent_emotions.extend(emotions)
-        self.recent_emotions = self.recent_emotions[-5:]
-        self.recent_context.append({"user": user_input, "bot": bot_reply})
-        self.recent_context = self.recent_context[-3:]
-
-    def save_conversation(self, folder: str = "conversations"):
-        os.makedirs(folder, exist_ok=True)
-        if self.recent_emotions:
-            dominant = Counter(self.recent_emotions).most_common(1)[0][0]
-            self.conversation_history.append({
+        self.recent_context.append({
+            "user": user_input,
+            "bot": bot_reply,
+            "emotion_summary": response.get("emotion_summary", "")
+        })
+        if len(self.recent_context) > HISTORY_TURNS:
+            del self.recent_context[:len(self.recent_context) - HISTORY_TURNS // 2]
+
+    def emotion_trends(self, session_ids: List[str]) -> Dict[str, Dict]:
+        """Decayed emotion distribution of the given web sessions."""
+        return self.sessions.trends(session_ids)
+
+    def _trend_store(self) -> Optional[SqliteTrendStore]:
+        # Session emotion trends are kept on disk whether or not turns are logged;
+        # MIRA_SESSION_TRENDS_PATH="" keeps them in memory only
+        path = os.getenv("MIRA_SESSION_TRENDS_PATH", os.path.join(self.conversation_folder, "session_trends.sqlite"))
+        if not path:
+            return None
+        try:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            return SqliteTrendStore(path)
+        except (OSError, sqlite3.Error) as e:
+            logger.warning(f"Session trend store at {path} unavailable ({e}); trends are kept in memory only.")
+            return None
+
+    def _log_writer(self) -> ConversationLogWriter:
+        if self.conversation_log is None:
+            self.conversation_log = ConversationLogWriter(folder=self.conversation_folder)
+        return self.conversation_log
+
+    def close(self):
+        """Flush and close the conversation log; model threads are daemons and end with the process."""
+        if self.conversation_log is not None:
+            self.conversation_log.close(timeout=10)
+
+    def save_conversation(self):
+        """Close out the session in the append-only log and rebuild conversation_latest.json."""
+        if self.emotion_trend.updates:
+            self._log_writer().append({
                 "tag": "session_dominant_emotion",
-                "value": dominant
+                "value": self.emotion_trend.dominant(),
+                "trend": self.emotion_trend.to_record(),
+                "session": self.log_session
             })
 
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M')
-        timestamped_path = os.path.join(folder, f"conversation_{timestamp}.json")
-        latest_path = os.path.join(folder, "conversation_latest.json")
-
+        if self.conversation_log is None:
+            return
         try:
-            with open(timestamped_path, "w") as f:
-                json.dump(self.conversation_history, f, indent=2)
-            with open(latest_path, "w") as f:
-                json.dump(self.conversation_history, f, indent=2)
-
-            logger.info(f"Conversations saved to {timestamped_path} and {latest_path}.")
+            self.conversation_log.flush(timeout=10)
+            latest_path = rebuild_latest(self.conversation_folder, session=self.log_session)
+            logger.info(f"Conversation log flushed; {latest_path} rebuilt.")
         except Exception as e:
             logger.error(f"Failed to save conversation: {e}", exc_info=True)
 
@@ -199,9 +718,7 @@ class MIRA:
                 t0 = time.time()
                 emotion_results = self.detect_emotions(user_input)
                 t1 = time.time()
-                emotion_summary = ", ".join([
-                    f"{e['emotion']} ({e['confidence']:.0%})" for e in emotion_results
-                ]) or "unclear"
+                emotion_summary = self.format_emotion_summary(emotion_results) or "unclear"
 
                 print(f"\nMIRA: I sense you're feeling {emotion_summary}.")
                 print("MIRA: ", end="", flush=True)
@@ -214,9 +731,10 @@ class MIRA:
                         print("\n")
                 t3 = time.time()
                 logger.info(f"Emotion detection: {t1 - t0:.2f}s, LLaMA streaming: {t3 - t2:.2f}s")
-                self.log_conversation(user_input, {"emotions_detected": emotion_results}, full_response)
-
-                self.save_conversation()
+                self.log_conversation(user_input, {
+                    "emotions_detected": emotion_results,
+                    "emotion_summary": emotion_summary
+                }, full_response)
 
             except KeyboardInterrupt:
                 self.save_conversation()
@@ -6,6 +6,7 @@ import json
 from datetime import datetime
 from typing import Dict, List, Optional
 from llama_cpp import Llama
+from autotune import tuned_params
 import time
 
 # Configure logging
@@ -45,14 +46,18 @@ class MIRA:
         # llama_model_path = r"C:\Users\Shadow\OneDrive\Documents\MIRA\Llama-3.2-3B-Instruct-Q4_K_M.gguf"
 
         try:
-            self.llama = Llama.from_pretrained(
-                repo_id="bartowski/Llama-3.2-3B-Instruct-GGUF",
-	            filename="Llama-3.2-3B-Instruct-Q4_K_M.gguf",
+            # Hand-picked defaults; autotune.py's profile for this host takes precedence
+            params = tuned_params("Llama-3.2-3B-Instruct-Q4_K_M.gguf", dict(
                 n_ctx=2048,
                 n_threads=8,
                 n_batch=64,
-                n_gpu_layers=40 if torch.cuda.is_available() else 0,
-                verbose=False
+                n_gpu_layers=40 if torch.cuda.is_available() else 0
+            ))
+            self.llama = Llama.from_pretrained(
+                repo_id="bartowski/Llama-3.2-3B-Instruct-GGUF",
+                filename="Llama-3.2-3B-Instruct-Q4_K_M.gguf",
+                verbose=False,
+                **params
             )
             logger.info("LLaMA model loaded successfully.")
         except Exception as e:
@@ -6,6 +6,7 @@ import json
 from datetime import datetime
 from typing import Dict, List, Optional
 from llama_cpp import Llama
+from autotune import tuned_params
 import time
 
 # Configure logging
@@ -44,14 +45,18 @@ class MIRA:
         # Load LLaMA model
         # llama_model_path = "C:\\Users\\NITRO 5\\Desktop\\Project\\React\\Meta-Llama-3.1-8B-Instruct-Q4_K_M.gguf"
         try:
-            self.llama = Llama.from_pretrained(
-                repo_id="bartowski/Meta-Llama-3.1-8B-Instruct-GGUF",
-                filename="Meta-Llama-3.1-8B-Instruct-Q4_K_M.gguf",
+            # Hand-picked defaults; autotune.py's profile for this host takes precedence
+            params = tuned_params("Meta-Llama-3.1-8B-Instruct-Q4_K_M.gguf", dict(
                 n_ctx=1024,
                 n_threads=6,
                 n_batch=64,
-                n_gpu_layers=35,
-                verbose=False
+                n_gpu_layers=35
+            ))
+            self.llama = Llama.from_pretrained(
+                repo_id="bartowski/Meta-Llama-3.1-8B-Instruct-GGUF",
+                filename="Meta-Llama-3.1-8B-Instruct-Q4_K_M.gguf",
+                verbose=False,
+                **params
             )
             logger.info("LLaMA model loaded successfully.")
         except Exception as e:
@@ -0,0 +1,235 @@
+import asyncio
+import json
+import logging
+import queue
+import socket
+import threading
+import time
+from typing import AsyncGenerator, Dict, Generator, List, Optional
+
+from model_server import MODEL_SOCKET, read_frame, send_frame
+from scheduler import SchedulerFull
+from tracing import Trace
+
+logger = logging.getLogger("MIRA")
+
+_ERROR_REPLY = {"chunk": "I'm having trouble responding right now.", "done": True}
+
+
+class _Connection:
+    def __init__(self, path: str, timeout: Optional[float]):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(timeout)
+        self.sock.connect(path)
+        self.stream = self.sock.makefile("rwb")
+
+    def close(self):
+        try:
+            self.stream.close()
+        finally:
+            self.sock.close()
+
+
+class ModelClient:
+    """MIRA facade backed by a model_server.py process on this host (MIRA_BACKEND=server).
+
+    Exposes the methods app.py / asgi.py use. Sync calls reuse up to
+    `pool_size` idle socket connections; a stream abandoned by its reader
+    closes its connection instead of returning it, which cancels the
+    generation on the server. Async streams get a connection of their own.
+    """
+
+    def __init__(self, path: str = MODEL_SOCKET, pool_size: int = 8, timeout: Optional[float] = 120.0):
+        self.path = path
+        self.timeout = timeout
+        self._idle: "queue.LifoQueue[_Connection]" = queue.LifoQueue(maxsize=pool_size)
+        self.ready = threading.Event()
+        threading.Thread(target=self._wait_ready, name="model-client-ready", daemon=True).start()
+
+    def _wait_ready(self):
+        # The server may still be loading (or not started yet); /ready follows it
+        while not self.ready.is_set():
+            try:
+                if self._call("ready", {}, False):
+                    self.ready.set()
+                    logger.info(f"Model server at {self.path} is ready.")
+                    return
+            except OSError:
+                pass
+            time.sleep(1.0)
+
+    def _acquire(self) -> _Connection:
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            return _Connection(self.path, self.timeout)
+
+    def _release(self, connection: _Connection):
+        try:
+            self._idle.put_nowait(connection)
+        except queue.Full:
+            connection.close()
+
+    def _send(self, kind: str, payload: Dict) -> _Connection:
+        connection = self._acquire()
+        try:
+            send_frame(connection.stream, {"kind": kind, "payload": payload})
+            return connection
+        except OSError:
+            # An idle connection may have been dropped by a server restart; retry on a fresh one
+            connection.close()
+            connection = _Connection(self.path, self.timeout)
+            send_frame(connection.stream, {"kind": kind, "payload": payload})
+            return connection
+
+    def _call(self, kind: str, payload: Dict, default):
+        connection = self._send(kind, payload)
+        result = default
+        try:
+            while True:
+                frame = read_frame(connection.stream)
+                if frame is None:
+                    raise ConnectionError("Model server closed the connection.")
+                if frame["type"] == "result":
+                    result = frame["value"]
+                elif frame["type"] == "end":
+                    break
+        except BaseException:
+            connection.close()
+            raise
+        self._release(connection)
+        return result
+
+    def _stream(self, kind: str, payload: Dict, trace: Optional[Trace] = None) -> Generator[Dict, None, None]:
+        try:
+            connection = self._send(kind, payload)
+        except OSError as e:
+            logger.error(f"Model server unreachable at {self.path}: {e}")
+            yield self._error(kind, "model server unreachable")
+            return
+        finished = False
+        try:
+            while True:
+                try:
+                    frame = read_frame(connection.stream)
+                except (OSError, ValueError) as e:
+                    # Includes socket.timeout: the server stalled or sent garbage
+                    logger.error(f"Model server stream failed: {e}")
+                    yield self._error(kind, "model server stream failed")
+                    return
+                if frame is None:
+                    logger.error("Model server closed the connection mid-stream.")
+                    yield self._error(kind, "model server closed the connection")
+                    return
+                if frame["type"] == "chunk":
+                    yield frame["value"]
+                elif frame["type"] == "trace":
+                    if trace is not None:
+                        trace.merge(frame["value"])
+                elif frame["type"] == "overloaded":
+                    self._drain(connection)
+                    finished = True
+                    raise SchedulerFull("Model server is overloaded.", retry_after=frame["value"])
+                elif frame["type"] == "error":
+                    yield self._error(kind, frame["value"])
+                elif frame["type"] == "end":
+                    finished = True
+                    return
+        finally:
+            if finished:
+                self._release(connection)
+            else:
+                connection.close()
+
+    @staticmethod
+    def _error(kind: str, message: str) -> Dict:
+        # Batch results are per-message records, not chat chunks
+        return {"id": None, "error": message} if kind == "score" else _ERROR_REPLY
+
+    @staticmethod
+    def _drain(connection: _Connection):
+        while True:
+            frame = read_frame(connection.stream)
+            if frame is None or frame["type"] == "end":
+                return
+
+    def detect_emotions(self, text: str) -> List[Dict[str, float]]:
+        return self._call("emotions", {"text": text}, [{"emotion": "error", "confidence": 0.0}])
+
+    def generate_llama_response_stream(self, user_input: str, emotion_summary: str = "",
+                                       session_id: Optional[str] = None) -> Generator[Dict[str, str], None, None]:
+        return self._stream("generate", {
+            "user_input": user_input,
+            "emotion_summary": emotion_summary,
+            "session_id": session_id
+        })
+
+    def stream_reply(self, user_input: str, session_id: Optional[str] = None,
+                     shed: bool = False, trace: Optional[Trace] = None) -> Generator[Dict, None, None]:
+        return self._stream("reply", {
+            "user_input": user_input,
+            "session_id": session_id,
+            "shed": shed,
+            "trace": trace is not None
+        }, trace)
+
+    async def astream_reply(self, user_input: str, session_id: Optional[str] = None,
+                            shed: bool = False, trace: Optional[Trace] = None) -> AsyncGenerator[Dict, None]:
+        """Async stream_reply on a dedicated connection, so the event loop never blocks on the socket."""
+        try:
+            reader, writer = await asyncio.open_unix_connection(self.path, limit=2 ** 20)
+        except OSError as e:
+            logger.error(f"Model server unreachable at {self.path}: {e}")
+            yield _ERROR_REPLY
+            return
+        try:
+            payload = {"user_input": user_input, "session_id": session_id, "shed": shed, "trace": trace is not None}
+            writer.write(json.dumps({"kind": "reply", "payload": payload}).encode("utf-8") + b"\n")
+            await writer.drain()
+            while True:
+                try:
+                    line = await reader.readline()
+                    frame = json.loads(line) if line else None
+                except (OSError, ValueError) as e:
+                    logger.error(f"Model server stream failed: {e}")
+                    yield _ERROR_REPLY
+                    return
+                if frame is None:
+                    logger.error("Model server closed the connection mid-stream.")
+                    yield _ERROR_REPLY
+                    return
+                if frame["type"] == "chunk":
+                    yield frame["value"]
+                elif frame["type"] == "trace":
+                    if trace is not None:
+                        trace.merge(frame["value"])
+                elif frame["type"] == "overloaded":
+                    raise SchedulerFull("Model server is overloaded.", retry_after=frame["value"])
+                elif frame["type"] == "error":
+                    yield _ERROR_REPLY
+                elif frame["type"] == "end":
+                    return
+        finally:
+            writer.close()
+
+    def score_messages(self, messages: List) -> Generator[Dict, None, None]:
+        return self._stream("score", {"messages": messages})
+
+    def log_conversation(self, user_input: str, response: Dict, bot_reply: str, session_id: Optional[str] = None):
+        self._call("log", {
+            "user_input": user_input,
+            "response": response,
+            "bot_reply": bot_reply,
+            "session_id": session_id
+        }, None)
+
+    def emotion_trends(self, session_ids: List[str]) -> Dict[str, Dict]:
+        return self._call("trends", {"session_ids": session_ids}, {})
+
+    def close(self):
+        """Close the idle connections; streams in flight close their own."""
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
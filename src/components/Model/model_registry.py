@@ -0,0 +1,128 @@
+import logging
+import os
+from typing import Dict, List, Optional, Tuple
+
+from metrics import GENERATION_TIERS
+
+logger = logging.getLogger("MIRA")
+
+# GGUF tiers MIRA knows how to load, smallest first. MIRA_MODEL_TIERS picks
+# which to keep loaded; MIRA_GGUF_PATH_<TIER> points at a local copy.
+MODEL_TIERS: Dict[str, Tuple[str, str]] = {
+    "small": ("bartowski/Llama-3.2-3B-Instruct-GGUF", "Llama-3.2-3B-Instruct-Q4_K_M.gguf"),
+    "large": ("bartowski/Meta-Llama-3.1-8B-Instruct-GGUF", "Meta-Llama-3.1-8B-Instruct-Q4_K_M.gguf"),
+}
+
+
+def local_model_path(tier: str) -> Optional[str]:
+    """Local GGUF to memory-map: MIRA_GGUF_PATH_<TIER> (MIRA_GGUF_PATH for "small"),
+    else the Hugging Face cache, else None."""
+    path = os.getenv(f"MIRA_GGUF_PATH_{tier.upper()}") or (os.getenv("MIRA_GGUF_PATH") if tier == "small" else None)
+    if path:
+        return path
+    repo_id, filename = MODEL_TIERS[tier]
+    try:
+        from huggingface_hub import try_to_load_from_cache
+        cached = try_to_load_from_cache(repo_id=repo_id, filename=filename)
+        return cached if isinstance(cached, str) else None
+    except ImportError:
+        return None
+
+
+class ModelTier:
+    """One loaded GGUF model with its own decode worker and prompt budget."""
+
+    def __init__(self, name: str, llama, scheduler, prompt_builder):
+        self.name = name
+        self.llama = llama
+        self.scheduler = scheduler
+        self.prompt_builder = prompt_builder
+
+
+class ModelRegistry:
+    """Loaded model tiers, kept in MODEL_TIERS order (smallest first)."""
+
+    def __init__(self):
+        self._tiers: Dict[str, ModelTier] = {}
+
+    def add(self, tier: ModelTier):
+        self._tiers[tier.name] = tier
+        order = list(MODEL_TIERS)
+        self._tiers = dict(sorted(self._tiers.items(), key=lambda item: order.index(item[0])))
+
+    def get(self, name: str) -> Optional[ModelTier]:
+        return self._tiers.get(name)
+
+    @property
+    def tiers(self) -> List[ModelTier]:
+        return list(self._tiers.values())
+
+    @property
+    def default(self) -> Optional[ModelTier]:
+        return next(iter(self._tiers.values()), None)
+
+    def __len__(self) -> int:
+        return len(self._tiers)
+
+
+class TierController:
+    """Picks the model tier and reply length for each generation from live load.
+
+    The largest tier whose predicted finish time (queue wait + prefill + reply
+    at its measured token rate) fits `latency_slo` wins. When none does, the
+    smallest tier is used and `max_tokens` is cut to what still fits, down to
+    `min_tokens`, so replies get shorter rather than later under load.
+    """
+
+    def __init__(self, registry: ModelRegistry, latency_slo: float = 30.0,
+                 max_tokens: int = 256, min_tokens: int = 96):
+        self.registry = registry
+        self.latency_slo = latency_slo
+        self.max_tokens = max_tokens
+        self.min_tokens = min(min_tokens, max_tokens)
+
+    def choose(self) -> Tuple[ModelTier, int]:
+        tiers = self.registry.tiers
+        for tier in reversed(tiers):
+            if tier.scheduler.predicted_latency(self.max_tokens) <= self.latency_slo:
+                return self._chosen(tier, self.max_tokens)
+
+        tier = tiers[0]
+        scheduler = tier.scheduler
+        room = self.latency_slo - scheduler.estimated_wait() - scheduler.prefill_time
+        tokens = int(room / scheduler.token_time) if scheduler.token_time > 0 else self.max_tokens
+        return self._chosen(tier, max(self.min_tokens, min(self.max_tokens, tokens)))
+
+    @staticmethod
+    def _chosen(tier: ModelTier, max_tokens: int) -> Tuple[ModelTier, int]:
+        GENERATION_TIERS.labels(tier.name).inc()
+        logger.debug(f"Generation routed to tier '{tier.name}' with max_tokens={max_tokens}.")
+        return tier, max_tokens
+
+
+def tier_names() -> List[str]:
+    """Tiers to load from MIRA_MODEL_TIERS (default: just "small")."""
+    names = [name.strip() for name in os.getenv("MIRA_MODEL_TIERS", "small").split(",") if name.strip()]
+    unknown = [name for name in names if name not in MODEL_TIERS]
+    if unknown:
+        logger.warning(f"Unknown model tiers {unknown} in MIRA_MODEL_TIERS; known: {list(MODEL_TIERS)}.")
+    return [name for name in names if name in MODEL_TIERS] or ["small"]
+
+
+def tier_threads() -> Dict[str, int]:
+    """Per-tier thread counts from MIRA_TIER_THREADS, e.g. "small=2,large=6".
+
+    Unset tiers use the whole thread budget: only one tier decodes a given
+    reply, so tiers overlap only when several chats are in flight.
+    """
+    threads: Dict[str, int] = {}
+    for item in os.getenv("MIRA_TIER_THREADS", "").split(","):
+        name, _, count = item.partition("=")
+        name = name.strip()
+        if not name:
+            continue
+        try:
+            threads[name] = max(1, int(count))
+        except ValueError:
+            logger.warning(f"Ignoring MIRA_TIER_THREADS entry {item.strip()!r}; expected <tier>=<threads>.")
+    return threads
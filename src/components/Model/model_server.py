@@ -0,0 +1,113 @@
+"""Host-local model server: loads the models once and serves them over a Unix socket.
+
+Web workers started with MIRA_BACKEND=server talk to it through
+model_client.ModelClient instead of loading their own copy of the weights, so
+gunicorn can run many light workers, and a crashed worker doesn't reload
+anything. Run one per host:
+
+    python model_server.py            # socket at MIRA_MODEL_SOCKET
+
+Wire format: newline-delimited JSON. A client sends {"kind", "payload"} and
+reads {"type", "value"} frames ("result", "chunk", "trace", "overloaded", "error")
+until {"type": "end"}. Connections are reused for further requests; a client
+that stops reading mid-stream closes its connection, which cancels the
+generation.
+"""
+import json
+import logging
+import os
+import socketserver
+from typing import Dict, Optional
+
+from worker_pool import _END, _serve
+
+logger = logging.getLogger("MIRA")
+
+MODEL_SOCKET = os.getenv("MIRA_MODEL_SOCKET", "/tmp/mira-model.sock")
+
+
+def send_frame(stream, message: Dict):
+    stream.write(json.dumps(message).encode("utf-8") + b"\n")
+    stream.flush()
+
+
+def read_frame(stream) -> Optional[Dict]:
+    line = stream.readline()
+    return json.loads(line) if line else None
+
+
+class _FrameWriter:
+    """Stands in for the worker pool's results queue, writing each result to the socket.
+
+    A failed write (client gone) marks the request cancelled, which stops the
+    stream and with it the generation.
+    """
+
+    def __init__(self, stream, cancelled: set):
+        self.stream = stream
+        self.cancelled = cancelled
+        self.broken = False
+
+    def put(self, item):
+        request_id, kind, value = item
+        if self.broken:
+            return
+        try:
+            send_frame(self.stream, {"type": kind, "value": value})
+        except OSError:
+            self.broken = True
+            self.cancelled.add(request_id)
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        mira = self.server.mira
+        request_id = 0
+        while True:
+            try:
+                request = read_frame(self.rfile)
+            except (OSError, ValueError):
+                return
+            if request is None:
+                return
+            kind, payload = request.get("kind"), request.get("payload") or {}
+            writer = _FrameWriter(self.wfile, set())
+            if kind == "ready":
+                writer.put((request_id, "result", mira.ready.is_set()))
+                writer.put((request_id, _END, None))
+            else:
+                _serve(mira, request_id, kind, payload, writer, {request_id}, writer.cancelled)
+            if writer.broken:
+                return
+            request_id += 1
+
+
+class ModelServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path: str, mira):
+        if os.path.exists(path):
+            os.unlink(path)  # stale socket from a previous run
+        self.mira = mira
+        super().__init__(path, _Handler)
+        os.chmod(path, 0o660)
+
+
+def main():
+    from inference_backend import create_backend
+
+    # The server always holds the models itself (pool or in-process), never another client
+    mira = create_backend(kind="local", background_load=True)
+    server = ModelServer(MODEL_SOCKET, mira)
+    logger.info(f"Model server listening on {MODEL_SOCKET}.")
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        mira.close()
+        if os.path.exists(MODEL_SOCKET):
+            os.unlink(MODEL_SOCKET)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""On-demand sampling profile of a running server process (GET /debug/profile).
+
+A background thread snapshots every thread's Python stack each `interval`
+seconds for a bounded time and counts identical stacks. The result is
+either collapsed stacks (one `frame;frame;... count` line per stack, for
+flamegraph.pl or https://speedscope.app) or a top list of functions by
+self and total samples. Time spent inside llama.cpp or torch shows up as
+the Python frame that called into them.
+
+Nothing runs unless a profile is requested, and only one runs at a time.
+"""
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Dict, List, Tuple
+
+PROFILE_MAX_SECONDS = float(os.getenv("MIRA_PROFILE_MAX_S", "60"))
+
+_running = threading.Lock()
+
+
+class ProfilerBusy(Exception):
+    """Raised when a profile is requested while another one is still running."""
+
+
+def _frame_name(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def sample_stacks(seconds: float, interval: float = 0.005) -> Tuple[Counter, int, float]:
+    """Counts of each thread's stack (thread name first, then root to leaf), samples taken and seconds elapsed."""
+    seconds = min(max(seconds, interval), PROFILE_MAX_SECONDS)
+    if not _running.acquire(blocking=False):
+        raise ProfilerBusy("A profile is already running.")
+    try:
+        me = threading.get_ident()
+        stacks: Counter = Counter()
+        samples = 0
+        started = time.monotonic()
+        deadline = started + seconds
+        while time.monotonic() < deadline:
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(_frame_name(frame))
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                stacks[tuple(reversed(stack))] += 1
+            samples += 1
+            time.sleep(interval)
+        return stacks, samples, time.monotonic() - started
+    finally:
+        _running.release()
+
+
+def collapsed(stacks: Counter) -> str:
+    return "".join(f"{';'.join(stack)} {count}\n" for stack, count in stacks.most_common())
+
+
+def top(stacks: Counter, samples: int, elapsed: float, limit: int = 40) -> List[Dict]:
+    """Functions by samples on top of the stack (self) and anywhere in it (total), summed over threads."""
+    own: Counter = Counter()
+    total: Counter = Counter()
+    for stack, count in stacks.items():
+        own[stack[-1]] += count
+        for name in set(stack[1:]):
+            total[name] += count
+    return [{
+        "function": name,
+        "self_samples": own[name],
+        "total_samples": count,
+        "thread_seconds": round(count * elapsed / samples, 3)
+    } for name, count in total.most_common(limit)] if samples else []
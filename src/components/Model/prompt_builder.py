@@ -0,0 +1,84 @@
+import logging
+import threading
+from collections import OrderedDict
+from typing import List, Tuple
+
+logger = logging.getLogger("MIRA")
+
+
+class PromptBuilder:
+    """Fits a chat prompt into the LLaMA context window, counting in model tokens.
+
+    The budget is `n_ctx - max_tokens`, so the reply always has room. Token
+    counts of the system block and past turns are cached by text: the same
+    turns are re-sent on every follow-up, so each is tokenized once. When the
+    prompt does not fit, the oldest turns are dropped first; a current message
+    that is too long on its own is clipped.
+
+    Dropping turns changes the prompt right after the system block, so the
+    cached KV state of the chat stops matching. Instead of dropping one turn
+    per follow-up, only the newest turns filling `trim_to` of the room are
+    kept, and the next turns fit again without another cut.
+    """
+
+    def __init__(self, llama, max_tokens: int = 256, cache_size: int = 2048, trim_to: float = 0.5):
+        self.llama = llama
+        self.budget = llama.n_ctx() - max_tokens
+        self.trim_to = trim_to
+        self.cache_size = cache_size
+        self._counts: "OrderedDict[str, int]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _tokenize(self, text: str) -> List[int]:
+        # Same flags create_completion uses for the prompt, minus the BOS
+        return self.llama.tokenize(text.encode("utf-8"), add_bos=False, special=True)
+
+    def count(self, text: str) -> int:
+        with self._lock:
+            count = self._counts.get(text)
+            if count is not None:
+                self._counts.move_to_end(text)
+                self.hits += 1
+                return count
+            self.misses += 1
+        count = len(self._tokenize(text))
+        with self._lock:
+            self._counts[text] = count
+            if len(self._counts) > self.cache_size:
+                self._counts.popitem(last=False)
+        return count
+
+    def clip(self, text: str, max_tokens: int) -> str:
+        tokens = self._tokenize(text)
+        if len(tokens) <= max_tokens:
+            return text
+        return self.llama.detokenize(tokens[:max(0, max_tokens)]).decode("utf-8", errors="ignore")
+
+    def fit(self, fixed: List[str], turns: List[str], user_input: str, reserve: int = 0) -> Tuple[List[str], str]:
+        """Newest past turns and the (possibly clipped) user input that fit the budget.
+
+        `fixed` are the template pieces always sent (system block, turn markup),
+        `reserve` covers text only known later, such as the emotion summary.
+        """
+        available = self.budget - reserve - 1 - sum(self.count(text) for text in fixed)  # 1 for BOS
+        input_tokens = len(self._tokenize(user_input))
+        if input_tokens > available:
+            logger.info(f"User message of {input_tokens} tokens clipped to {max(0, available)} to fit the context window.")
+            user_input = self.clip(user_input, available)
+            input_tokens = available
+        available -= input_tokens
+
+        costs = [self.count(turn) for turn in turns]
+        if sum(costs) > available:
+            available = int(available * self.trim_to)
+        kept = 0
+        for cost in reversed(costs):
+            if cost > available:
+                break
+            available -= cost
+            kept += 1
+        if kept < len(turns):
+            logger.info(f"Dropped {len(turns) - kept} oldest turn(s) to fit the context window.")
+        return turns[len(turns) - kept:], user_input
@@ -0,0 +1,339 @@
+import asyncio
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import AsyncIterator, Dict, Iterator, Optional
+
+from kv_cache import SessionStateCache, compact_state
+from metrics import (ACCEPTED_TOKENS, CANCELLED_TOKENS, DRAFT_ACCEPTANCE, DRAFTED_TOKENS, GENERATIONS, PREFILL_SECONDS,
+                     QUEUE_DEPTH, SKIPPED_TOKENS, TOKEN_SECONDS, TOKENS_PER_PASS, TTFT_SECONDS)
+from tracing import span
+
+logger = logging.getLogger("MIRA")
+
+_DONE = object()
+
+
+class SchedulerFull(Exception):
+    """Raised when the generation queue is at capacity or would miss its queue-wait SLO."""
+
+    def __init__(self, message: str, retry_after: float = 1.0):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class GenerationRequest:
+    """A queued completion whose tokens are delivered to the caller's own stream.
+
+    Sync callers iterate it; callers that pass an event loop `async for` over it,
+    with tokens handed to the loop thread-safely so no thread waits on them.
+    """
+
+    def __init__(self, prompt, params: Dict, session_id: Optional[str] = None,
+                 loop: Optional[asyncio.AbstractEventLoop] = None,
+                 time_budget: Optional[float] = None, suffix: Optional[Future] = None,
+                 max_wait: Optional[float] = None, model: Optional[str] = None, trace=None):
+        self.prompt = prompt
+        self.suffix = suffix
+        self.params = params
+        self.session_id = session_id
+        self.time_budget = time_budget
+        self.max_wait = max_wait
+        # Name of the scheduler (model tier) decoding it
+        self.model = model
+        self.enqueued_at = time.time()
+        self.started_at: Optional[float] = None
+        self.cancelled = False
+        self.finished = False
+        self.tokens = 0
+        # Draft/accept counts when speculative decoding is on
+        self.speculation: Optional[Dict] = None
+        # tracing.Trace of a sampled request: stage spans and per-token timestamps
+        self.trace = trace
+        self._loop = loop
+        self._out = asyncio.Queue() if loop is not None else queue.Queue()
+
+    def _emit(self, item):
+        if self._loop is None:
+            self._out.put(item)
+            return
+        try:
+            self._loop.call_soon_threadsafe(self._out.put_nowait, item)
+        except RuntimeError:
+            # Event loop already closed; nobody is left to read this stream
+            self.cancelled = True
+
+    def cancel(self):
+        """Ask the decode worker to stop this generation at the next token."""
+        if not self.finished:
+            self.cancelled = True
+
+    def __iter__(self) -> Iterator[str]:
+        while True:
+            item = self._out.get()
+            if item is _DONE:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+
+    async def __aiter__(self) -> AsyncIterator[str]:
+        while True:
+            item = await self._out.get()
+            if item is _DONE:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+
+
+class GenerationScheduler:
+    """Owns a Llama instance and runs every completion on one dedicated decode worker.
+
+    llama-cpp-python drives a single sequence per `Llama` object (one KV cache,
+    one `n_tokens` cursor), so concurrent `create_completion` calls from request
+    threads would corrupt each other. Requests are queued here instead and the
+    worker streams each one's tokens back through its own `GenerationRequest`.
+    BatchedGenerationScheduler decodes several of them in one forward pass.
+
+    With a `state_cache`, the worker saves the loaded session's state when a
+    different session's turn comes up and restores that one's, so follow-up
+    turns only prefill new tokens.
+
+    Generations are checked between tokens for cancellation (client gone) and
+    for their wall-clock `time_budget`; either frees the decode slot at once.
+
+    A request submitted with a `suffix` future has its `prompt` prefilled right
+    away; the suffix (e.g. the emotion summary) is appended once it resolves, so
+    only those last tokens are evaluated after the classifier finishes.
+    """
+
+    def __init__(self, llama, max_queue: int = 32, name: str = "llama",
+                 state_cache: Optional[SessionStateCache] = None):
+        self.llama = llama
+        self.name = name
+        self.state_cache = state_cache
+        self._loaded_session: Optional[str] = None
+        self._queue: "queue.Queue[GenerationRequest]" = queue.Queue(maxsize=max_queue)
+        self._active: Optional[GenerationRequest] = None
+        self._queue_gauge = QUEUE_DEPTH.labels(name)
+        # Moving averages of how long one generation holds the decode worker,
+        # and of its prefill and per-token decode time (for reply-length budgets)
+        self.service_time = 2.0
+        self.prefill_time = 0.5
+        self.token_time = 0.05
+        self.stats: Dict[str, int] = {
+            "completed": 0,
+            "cancelled": 0,
+            "timed_out": 0,
+            # Dropped after waiting in the queue longer than their max_wait
+            "shed": 0,
+            # Tokens decoded for streams nobody read to the end
+            "cancelled_tokens": 0,
+            # Remaining max_tokens budget that was never decoded
+            "skipped_tokens": 0
+        }
+        self._worker = threading.Thread(target=self._run, name=f"{name}-decode", daemon=True)
+        self._worker.start()
+
+    @property
+    def queue_depth(self) -> int:
+        return self._queue.qsize()
+
+    @property
+    def busy(self) -> bool:
+        return self._active is not None
+
+    def estimated_wait(self) -> float:
+        """Seconds a generation submitted now would likely wait for the decode worker."""
+        return (self.queue_depth + self.busy) * self.service_time
+
+    def predicted_latency(self, max_tokens: int) -> float:
+        """Seconds until a reply of `max_tokens` submitted now would likely be finished."""
+        return self.estimated_wait() + self.prefill_time + max_tokens * self.token_time
+
+    def submit(self, prompt, session_id: Optional[str] = None,
+               loop: Optional[asyncio.AbstractEventLoop] = None,
+               time_budget: Optional[float] = None, suffix: Optional[Future] = None,
+               max_wait: Optional[float] = None, trace=None, **params) -> GenerationRequest:
+        """Queue a generation; raises SchedulerFull if it can't start within `max_wait` seconds."""
+        wait = self.estimated_wait()
+        if max_wait is not None and wait > max_wait:
+            raise SchedulerFull(f"Generation queue '{self.name}' wait ~{wait:.1f}s exceeds {max_wait:.1f}s.",
+                                retry_after=wait)
+        request = GenerationRequest(prompt, params, session_id=session_id, loop=loop,
+                                    time_budget=time_budget, suffix=suffix, max_wait=max_wait, model=self.name,
+                                    trace=trace)
+        try:
+            self._queue.put_nowait(request)
+        except queue.Full:
+            raise SchedulerFull(f"Generation queue '{self.name}' is full ({self._queue.maxsize} waiting).",
+                                retry_after=wait)
+        self._queue_gauge.set(self.queue_depth)
+        logger.debug(f"Queued generation on '{self.name}', depth={self.queue_depth}")
+        return request
+
+    def _run(self):
+        while True:
+            request = self._queue.get()
+            self._queue_gauge.set(self.queue_depth)
+            self._active = request
+            request.started_at = time.time()
+            trace = request.trace
+            if trace is not None:
+                trace.add("queue_wait", request.enqueued_at, request.started_at, model=self.name)
+            try:
+                if request.cancelled:
+                    # Abandoned while still queued; never touch the model
+                    self._record_stop(request, "cancelled")
+                    continue
+                waited = request.started_at - request.enqueued_at
+                if request.max_wait is not None and waited > request.max_wait:
+                    # The caller falls back to a fast answer instead of a late one
+                    self._record_stop(request, "shed")
+                    request._emit(SchedulerFull(f"Waited {waited:.1f}s for '{self.name}'.",
+                                                retry_after=self.estimated_wait()))
+                    continue
+                with span(trace, "switch_session"):
+                    self._switch_session(request.session_id)
+                self._decode(request)
+                self._loaded_session = request.session_id
+                self.service_time += 0.2 * (time.time() - request.started_at - self.service_time)
+            except Exception as e:
+                logger.error(f"Generation on '{self.name}' failed: {e}", exc_info=True)
+                GENERATIONS.labels("error").inc()
+                self._loaded_session = None
+                request._emit(e)
+            finally:
+                request.finished = True
+                request._emit(_DONE)
+                self._active = None
+
+    def _decode(self, request: GenerationRequest):
+        deadline = request.started_at + request.time_budget if request.time_budget else None
+        prompt = request.prompt
+        trace = request.trace
+        if request.suffix is not None:
+            if not request.suffix.done():
+                with span(trace, "prefill_prefix"):
+                    self._prefill(prompt)
+            waited_from = time.time()
+            prompt += request.suffix.result(timeout=request.time_budget)
+            if trace is not None:
+                trace.add("wait_emotions", waited_from)
+        # Per-token timestamps, only for traced requests
+        token_times = [] if trace is not None else None
+        completion_started = time.time()
+        drafter = getattr(self.llama, "draft_model", None)
+        if drafter is not None:
+            drafter.reset()
+        stream = self.llama.create_completion(prompt, stream=True, **request.params)
+        last_token = None
+        first_token = None
+        try:
+            for output in stream:
+                if request.cancelled:
+                    self._record_stop(request, "cancelled")
+                    return
+                now = time.time()
+                if deadline is not None and now > deadline:
+                    self._record_stop(request, "timed_out")
+                    return
+                if last_token is None:
+                    first_token = now
+                    PREFILL_SECONDS.observe(now - completion_started)
+                    TTFT_SECONDS.observe(now - request.enqueued_at)
+                else:
+                    TOKEN_SECONDS.observe(now - last_token)
+                last_token = now
+                if token_times is not None:
+                    token_times.append(now)
+                request.tokens += 1
+                request._emit(output["choices"][0]["text"])
+            self.stats["completed"] += 1
+            GENERATIONS.labels("completed").inc()
+        finally:
+            stream.close()
+            if first_token is not None:
+                self.prefill_time += 0.2 * (first_token - completion_started - self.prefill_time)
+                if request.tokens > 1:
+                    self.token_time += 0.2 * ((last_token - first_token) / (request.tokens - 1) - self.token_time)
+            if drafter is not None and request.tokens:
+                self._record_speculation(request, drafter, time.time() - first_token)
+            if trace is not None and first_token is not None:
+                trace.add("prefill", completion_started, first_token, model=self.name)
+                trace.add("decode", first_token, last_token, tokens=request.tokens,
+                          cancelled=request.cancelled, speculation=request.speculation)
+                trace.tokens(token_times)
+
+    def _prefill(self, text: str):
+        """Evaluate `text` into the KV cache, reusing whatever prefix is already there.
+
+        Mirrors the prefix matching create_completion does, so the later call with
+        the full prompt finds these tokens evaluated and only processes the rest.
+        """
+        tokens = self.llama.tokenize(text.encode("utf-8"), special=True)
+        common = 0
+        for cached, token in zip(self.llama._input_ids, tokens):
+            if cached != token:
+                break
+            common += 1
+        if common < len(tokens):
+            self.llama.n_tokens = common
+            self.llama.eval(tokens[common:])
+
+    def _record_speculation(self, request: GenerationRequest, drafter, decode_seconds: float):
+        # Every draft is verified in one forward pass that also samples the next
+        # token, so tokens = 1 (from the prompt pass) + accepted + draft passes
+        passes = drafter.calls + 1
+        accepted = min(drafter.drafted, max(0, request.tokens - passes))
+        acceptance = accepted / drafter.drafted if drafter.drafted else 0.0
+        request.speculation = {
+            "drafted": drafter.drafted,
+            "accepted": accepted,
+            "acceptance": acceptance,
+            "tokens_per_pass": request.tokens / passes
+        }
+        DRAFTED_TOKENS.inc(drafter.drafted)
+        ACCEPTED_TOKENS.inc(accepted)
+        DRAFT_ACCEPTANCE.observe(acceptance)
+        TOKENS_PER_PASS.observe(request.tokens / passes)
+        rate = f", {(request.tokens - 1) / decode_seconds:.1f} tokens/s" if decode_seconds > 0 else ""
+        logger.info(f"Speculative decode on '{self.name}': {accepted}/{drafter.drafted} drafted tokens accepted "
+                    f"({acceptance:.0%}), {request.tokens} tokens in {passes} forward passes "
+                    f"({request.tokens / passes:.2f}x){rate}.")
+
+    def _record_stop(self, request: GenerationRequest, reason: str):
+        self.stats[reason] += 1
+        GENERATIONS.labels(reason).inc()
+        skipped = max(0, request.params.get("max_tokens", 0) - request.tokens)
+        self.stats["cancelled_tokens"] += request.tokens
+        self.stats["skipped_tokens"] += skipped
+        CANCELLED_TOKENS.labels(self.name).inc(request.tokens)
+        SKIPPED_TOKENS.labels(self.name).inc(skipped)
+        logger.info(f"Generation on '{self.name}' {reason.replace('_', ' ')} after {request.tokens} tokens.")
+
+    def _switch_session(self, session_id: Optional[str]):
+        """Make `session_id`'s tokens the loaded ones before its generation.
+
+        The loaded session's state is only saved here, when another chat is
+        about to overwrite it: back-to-back turns of one chat reuse the live KV
+        cache and never pay for a copy. A restored state leaves the cache until
+        it is switched out again.
+        """
+        if self.state_cache is None or (session_id and session_id == self._loaded_session):
+            return
+        if self._loaded_session:
+            self.state_cache.put(self._loaded_session, compact_state(self.llama.save_state()))
+        self._loaded_session = None
+        if not session_id:
+            return
+        state = self.state_cache.get(session_id)
+        if state is not None:
+            self.llama.load_state(state)
+            self.state_cache.discard(session_id)
+            logger.debug(f"Restored KV state for session {session_id}.")
+        # On a miss the previous session's tokens stay loaded; the shared
+        # system prompt prefix is still reused by create_completion.
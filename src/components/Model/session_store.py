@@ -0,0 +1,254 @@
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Dict, List, Optional, Tuple
+
+from emotion_trend import EmotionTrend
+
+logger = logging.getLogger("MIRA")
+
+# Rough per-object overhead so the byte budget isn't only counting characters
+_TURN_OVERHEAD = 200
+_SESSION_OVERHEAD = 800
+# Turns a chat keeps; the context window usually trims them sooner (PromptBuilder.fit)
+HISTORY_TURNS = int(os.getenv("MIRA_HISTORY_TURNS", "64"))
+
+
+class SqliteTrendStore:
+    """Emotion trends of chat sessions in a local SQLite file.
+
+    A session's trend outlives its in-memory context: it is reloaded when the
+    session comes back after eviction or a restart, and every worker process
+    sharing the file sees the same trends. Rows untouched for `retention_seconds`
+    are pruned.
+    """
+
+    def __init__(self, path: str, retention_seconds: float = 30 * 24 * 3600):
+        self.path = path
+        self.retention_seconds = retention_seconds
+        self._local = threading.local()
+        self._writes = 0
+        with self._connect() as db:
+            db.execute("CREATE TABLE IF NOT EXISTS session_trend (session_id TEXT PRIMARY KEY, "
+                       "sums TEXT NOT NULL, weight REAL NOT NULL, updates INTEGER NOT NULL, updated REAL NOT NULL)")
+            db.execute("CREATE INDEX IF NOT EXISTS session_trend_updated ON session_trend (updated)")
+
+    def _connect(self) -> sqlite3.Connection:
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=1.0)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            self._local.db = db
+        return db
+
+    def get(self, session_id: str) -> Optional[EmotionTrend]:
+        row = self._connect().execute(
+            "SELECT sums, weight, updates FROM session_trend WHERE session_id = ? AND updated > ?",
+            (session_id, time.time() - self.retention_seconds)
+        ).fetchone()
+        return EmotionTrend.from_state(json.loads(row[0]), row[1], row[2]) if row else None
+
+    def put(self, session_id: str, trend: EmotionTrend):
+        sums, weight, updates = trend.state()
+        with self._connect() as db:
+            db.execute("INSERT OR REPLACE INTO session_trend VALUES (?, ?, ?, ?, ?)",
+                       (session_id, json.dumps(sums), weight, updates, time.time()))
+            self._writes += 1
+            if self._writes % 1000 == 0:
+                db.execute("DELETE FROM session_trend WHERE updated <= ?", (time.time() - self.retention_seconds,))
+
+
+class Session:
+    """One chat's recent turns plus its decayed emotion trend."""
+
+    __slots__ = ("session_id", "turns", "trend", "last_seen", "size_bytes")
+
+    def __init__(self, session_id: str):
+        self.session_id = session_id
+        self.turns: "deque[Tuple[str, str, str]]" = deque()
+        self.trend = EmotionTrend()
+        self.last_seen = time.monotonic()
+        self.size_bytes = _SESSION_OVERHEAD
+
+    def context(self) -> List[Dict[str, str]]:
+        return [
+            {"user": user, "bot": bot, "emotion_summary": emotion_summary}
+            for user, bot, emotion_summary in self.turns
+        ]
+
+    def _recount(self):
+        self.size_bytes = _SESSION_OVERHEAD + sum(
+            len(user) + len(bot) + len(summary) + _TURN_OVERHEAD for user, bot, summary in self.turns
+        )
+
+
+class SessionStore:
+    """Per-session conversation context with LRU + TTL eviction and a hard memory cap.
+
+    Replaces the process-wide `recent_context` list and emotion trend for the
+    web service so concurrent students never see each other's turns. With a
+    `trend_store`, each session's emotion trend is also saved after every turn
+    and restored when an evicted (or pre-restart) session returns.
+
+    Turns accumulate instead of sliding, so each prompt extends the last one
+    and the chat's KV state stays reusable. Past `max_turns` the oldest half is
+    dropped at once; `drop_oldest` applies the prompt builder's trims.
+    """
+
+    def __init__(self, max_sessions: int = 10000, ttl_seconds: float = 3600,
+                 max_bytes: int = 64 * 1024 * 1024, max_turns: int = HISTORY_TURNS,
+                 max_turn_chars: int = 4000, trend_store: Optional[SqliteTrendStore] = None):
+        self.max_sessions = max_sessions
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self.max_turns = max_turns
+        self.max_turn_chars = max_turn_chars
+        self.trend_store = trend_store
+        self._sessions: "OrderedDict[str, Session]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    @property
+    def size_bytes(self) -> int:
+        return self._bytes
+
+    def _live(self, session_id: str) -> Optional[Session]:
+        session = self._sessions.get(session_id)
+        if session is None:
+            return None
+        if time.monotonic() - session.last_seen > self.ttl_seconds:
+            self._drop(session_id)
+            return None
+        return session
+
+    def get(self, session_id: str) -> Optional[Session]:
+        with self._lock:
+            session = self._live(session_id)
+            if session is not None:
+                session.last_seen = time.monotonic()
+                self._sessions.move_to_end(session_id)
+            return session
+
+    def context(self, session_id: str) -> Tuple[List[Dict[str, str]], Dict[str, float]]:
+        """Recent turns and the current emotion trend distribution."""
+        with self._lock:
+            session = self._live(session_id)
+            if session is not None:
+                return session.context(), session.trend.distribution()
+        trend = self._stored_trend(session_id)
+        return [], trend.distribution() if trend is not None else {}
+
+    async def acontext(self, session_id: str) -> Tuple[List[Dict[str, str]], Dict[str, float]]:
+        """`context` for an event loop: a stored trend is read in the default executor."""
+        with self._lock:
+            session = self._live(session_id)
+            if session is not None:
+                return session.context(), session.trend.distribution()
+        trend = await asyncio.get_running_loop().run_in_executor(None, self._stored_trend, session_id)
+        return [], trend.distribution() if trend is not None else {}
+
+    def trends(self, session_ids: List[str]) -> Dict[str, Dict]:
+        """Emotion trends of the given sessions (live or stored), for dashboards."""
+        found: Dict[str, Dict] = {}
+        with self._lock:
+            for session_id in session_ids:
+                session = self._live(session_id)
+                if session is not None:
+                    found[session_id] = session.trend.to_record()
+        for session_id in session_ids:
+            if session_id not in found:
+                trend = self._stored_trend(session_id)
+                if trend is not None:
+                    found[session_id] = trend.to_record()
+        return found
+
+    def _stored_trend(self, session_id: str) -> Optional[EmotionTrend]:
+        if self.trend_store is None:
+            return None
+        try:
+            return self.trend_store.get(session_id)
+        except sqlite3.Error as e:
+            logger.warning(f"Session trend read failed: {e}")
+            return None
+
+    def record_turn(self, session_id: str, user_input: str, bot_reply: str,
+                    emotion_summary: str, emotion_scores: Dict[str, float]) -> Dict:
+        """Store the turn, fold its emotion scores into the trend and return the trend record."""
+        with self._lock:
+            known = self._live(session_id) is not None
+        # A returning session picks its trend back up from the store
+        stored = None if known else self._stored_trend(session_id)
+        with self._lock:
+            session = self._live(session_id)
+            if session is None:
+                session = Session(session_id)
+                if stored is not None:
+                    session.trend = stored
+                self._sessions[session_id] = session
+            else:
+                self._bytes -= session.size_bytes
+
+            session.turns.append((
+                user_input[:self.max_turn_chars],
+                bot_reply[:self.max_turn_chars],
+                emotion_summary
+            ))
+            if len(session.turns) > self.max_turns:
+                for _ in range(len(session.turns) - self.max_turns // 2):
+                    session.turns.popleft()
+            session.trend.update(emotion_scores)
+            session.last_seen = time.monotonic()
+            session._recount()
+            self._bytes += session.size_bytes
+            self._sessions.move_to_end(session_id)
+            self._evict()
+            trend = EmotionTrend.from_state(*session.trend.state())
+        if self.trend_store is not None:
+            try:
+                self.trend_store.put(session_id, trend)
+            except sqlite3.Error as e:
+                logger.warning(f"Session trend write failed: {e}")
+        return trend.to_record()
+
+    def drop_oldest(self, session_id: str, count: int):
+        """Forget the session's `count` oldest turns, e.g. ones left out of its prompt."""
+        with self._lock:
+            session = self._live(session_id)
+            if session is None:
+                return
+            self._bytes -= session.size_bytes
+            for _ in range(min(count, len(session.turns))):
+                session.turns.popleft()
+            session._recount()
+            self._bytes += session.size_bytes
+
+    def discard(self, session_id: str):
+        with self._lock:
+            self._drop(session_id)
+
+    def _drop(self, session_id: str):
+        session = self._sessions.pop(session_id, None)
+        if session is not None:
+            self._bytes -= session.size_bytes
+
+    def _evict(self):
+        now = time.monotonic()
+        # Oldest first: expired sessions, then whatever the caps require
+        while self._sessions:
+            oldest_id, oldest = next(iter(self._sessions.items()))
+            over_cap = len(self._sessions) > self.max_sessions or self._bytes > self.max_bytes
+            if not over_cap and now - oldest.last_seen <= self.ttl_seconds:
+                break
+            self._drop(oldest_id)
+            self.evictions += 1
+            logger.debug(f"Evicted session {oldest_id} from context store.")
@@ -0,0 +1,27 @@
+from typing import Any
+
+from llama_cpp.llama_speculative import LlamaPromptLookupDecoding
+
+
+class CountingPromptLookup(LlamaPromptLookupDecoding):
+    """Prompt-lookup drafter that counts the tokens it proposes.
+
+    Drafts are n-gram continuations copied from earlier in the prompt. llama.cpp
+    evaluates them in the same forward pass as the next token and keeps only
+    those the model would have sampled itself, so replies are unchanged; the
+    counters let the scheduler report acceptance per request.
+    """
+
+    def __init__(self, max_ngram_size: int = 2, num_pred_tokens: int = 10):
+        super().__init__(max_ngram_size=max_ngram_size, num_pred_tokens=num_pred_tokens)
+        self.reset()
+
+    def reset(self):
+        self.calls = 0
+        self.drafted = 0
+
+    def __call__(self, input_ids, /, **kwargs: Any):
+        draft = super().__call__(input_ids, **kwargs)
+        self.calls += 1
+        self.drafted += len(draft)
+        return draft
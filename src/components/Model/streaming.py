@@ -0,0 +1,125 @@
+import asyncio
+import json
+import os
+import time
+from typing import AsyncIterable, AsyncIterator, Dict, Iterable, Iterator, Optional
+
+# Text chunks are held back for at most this long since the last write, or
+# until this many bytes are pending; MIRA_STREAM_WINDOW_MS=0 sends every token
+STREAM_WINDOW = float(os.getenv("MIRA_STREAM_WINDOW_MS", "30")) / 1000
+STREAM_MAX_BYTES = int(os.getenv("MIRA_STREAM_MAX_BYTES", "256"))
+
+NDJSON_MIMETYPE = "application/json"
+SSE_MIMETYPE = "text/event-stream"
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+
+class _Coalescer:
+    """Merges consecutive {"chunk", "done"} messages into fewer, larger ones.
+
+    The first text chunk, the emotion header and the final `done` message are
+    passed through at once. Text in between is buffered and sent when a token
+    arrives `window` seconds after the previous write, or `max_bytes` pile up.
+    The async path also flushes once `window` passes with no new token.
+    """
+
+    def __init__(self, window: float, max_bytes: int):
+        self.window = window
+        self.max_bytes = max_bytes
+        self._text = []
+        self._bytes = 0
+        self._last_flush = float("-inf")
+
+    def push(self, message: Dict) -> Optional[Dict]:
+        if "emotions" in message:
+            return message
+        self._text.append(message["chunk"])
+        self._bytes += len(message["chunk"].encode("utf-8"))
+        now = time.monotonic()
+        if message["done"] or self._bytes >= self.max_bytes or now - self._last_flush >= self.window:
+            self._last_flush = now
+            return self._take(message["done"])
+        return None
+
+    def time_left(self) -> Optional[float]:
+        """Seconds until buffered text is due, or None when nothing is buffered."""
+        if not self._text:
+            return None
+        return max(0.0, self._last_flush + self.window - time.monotonic())
+
+    def flush(self) -> Dict:
+        self._last_flush = time.monotonic()
+        return self._take(False)
+
+    def drain(self) -> Optional[Dict]:
+        # Only reached when the stream ends without a `done` message
+        return self._take(False) if self._text else None
+
+    def _take(self, done: bool) -> Dict:
+        text = "".join(self._text)
+        self._text, self._bytes = [], 0
+        return {"chunk": text, "done": done}
+
+
+def coalesce(messages: Iterable[Dict], window: float = STREAM_WINDOW,
+             max_bytes: int = STREAM_MAX_BYTES) -> Iterator[Dict]:
+    if window <= 0:
+        yield from messages
+        return
+    coalescer = _Coalescer(window, max_bytes)
+    for message in messages:
+        merged = coalescer.push(message)
+        if merged is not None:
+            yield merged
+    tail = coalescer.drain()
+    if tail is not None:
+        yield tail
+
+
+async def acoalesce(messages: AsyncIterable[Dict], window: float = STREAM_WINDOW,
+                    max_bytes: int = STREAM_MAX_BYTES) -> AsyncIterator[Dict]:
+    if window <= 0:
+        async for message in messages:
+            yield message
+        return
+    coalescer = _Coalescer(window, max_bytes)
+    iterator = messages.__aiter__()
+    pending = None
+    try:
+        while True:
+            if pending is None:
+                pending = asyncio.ensure_future(iterator.__anext__())
+            done, _ = await asyncio.wait({pending}, timeout=coalescer.time_left())
+            if not done:
+                # Generation stalled: send what is buffered instead of holding it
+                yield coalescer.flush()
+                continue
+            next_message, pending = pending, None
+            try:
+                message = next_message.result()
+            except StopAsyncIteration:
+                break
+            merged = coalescer.push(message)
+            if merged is not None:
+                yield merged
+    finally:
+        if pending is not None:
+            # Consumer went away mid-wait; stop the read so the source can be closed
+            pending.cancel()
+            try:
+                await pending
+            except (asyncio.CancelledError, StopAsyncIteration):
+                pass
+    tail = coalescer.drain()
+    if tail is not None:
+        yield tail
+
+
+def wants_sse(accept: Optional[str]) -> bool:
+    return SSE_MIMETYPE in (accept or "")
+
+
+def frame(message: Dict, sse: bool = False) -> str:
+    """One wire frame: a JSON line, or an SSE `data:` event carrying the same JSON."""
+    payload = json.dumps(message)
+    return f"data: {payload}\n\n" if sse else payload + "\n"
@@ -0,0 +1,137 @@
+import asyncio
+import hashlib
+import os
+import threading
+import time
+from typing import AsyncGenerator, Dict, Generator, List, Optional
+
+from tracing import Trace
+
+LABELS = ["anger", "disgust", "fear", "joy", "neutral", "sadness", "surprise"]
+
+WORDS = [
+    "I", "hear", "you", "and", "that", "sounds", "really", "tough", "it's", "okay", "to",
+    "feel", "this", "way", "want", "talk", "more", "about", "what", "happened", "today", "?"
+]
+
+CANNED_REPLY = "I see. How can I support you today?"
+
+
+class StubMIRA:
+    """Deterministic stand-in for MIRA with no model weights, for benchmarks and CI.
+
+    Emotions and replies are derived from a hash of the input, and latencies are
+    fixed sleeps (STUB_EMOTION_MS, STUB_PREFILL_MS, STUB_TOKEN_MS, STUB_TOKENS),
+    so runs are repeatable and measure the serving path rather than the models.
+    """
+
+    def __init__(self):
+        self.emotion_ms = float(os.getenv("STUB_EMOTION_MS", "15"))
+        self.prefill_ms = float(os.getenv("STUB_PREFILL_MS", "50"))
+        self.token_ms = float(os.getenv("STUB_TOKEN_MS", "20"))
+        self.max_tokens = int(os.getenv("STUB_TOKENS", "64"))
+        self.ready = threading.Event()
+        self.ready.set()
+
+    @staticmethod
+    def _seed(text: str) -> int:
+        return int.from_bytes(hashlib.sha1(text.encode("utf-8")).digest()[:8], "big")
+
+    def _emotions(self, text: str) -> List[Dict[str, float]]:
+        seed = self._seed(text)
+        first, second = LABELS[seed % len(LABELS)], LABELS[(seed // 7 + 1) % len(LABELS)]
+        if second == first:
+            second = LABELS[(LABELS.index(first) + 1) % len(LABELS)]
+        return [
+            {"emotion": first, "confidence": 0.5 + (seed % 50) / 100},
+            {"emotion": second, "confidence": 0.1 + (seed % 30) / 100}
+        ]
+
+    def _tokens(self, user_input: str) -> List[str]:
+        seed = self._seed(user_input)
+        count = self.max_tokens // 2 + seed % (self.max_tokens // 2 + 1)
+        return [" " + WORDS[(seed >> (i % 48)) % len(WORDS)] for i in range(count)]
+
+    def detect_emotions(self, text: str) -> List[Dict[str, float]]:
+        time.sleep(self.emotion_ms / 1000)
+        return self._emotions(text)
+
+    async def adetect_emotions(self, text: str) -> List[Dict[str, float]]:
+        await asyncio.sleep(self.emotion_ms / 1000)
+        return self._emotions(text)
+
+    def generate_llama_response_stream(self, user_input: str, emotion_summary: str = "",
+                                       session_id: Optional[str] = None) -> Generator[Dict[str, str], None, None]:
+        time.sleep(self.prefill_ms / 1000)
+        for token in self._tokens(user_input):
+            time.sleep(self.token_ms / 1000)
+            yield {"chunk": token, "done": False}
+        yield {"chunk": "", "done": True}
+
+    async def agenerate_llama_response_stream(self, user_input: str, emotion_summary: str = "",
+                                              session_id: Optional[str] = None) -> AsyncGenerator[Dict[str, str], None]:
+        await asyncio.sleep(self.prefill_ms / 1000)
+        for token in self._tokens(user_input):
+            await asyncio.sleep(self.token_ms / 1000)
+            yield {"chunk": token, "done": False}
+        yield {"chunk": "", "done": True}
+
+    def _header(self, text: str) -> Dict:
+        emotions = self._emotions(text)
+        return {
+            "emotions": emotions,
+            "emotion_summary": ", ".join(f"{e['emotion']} ({e['confidence']:.0%})" for e in emotions),
+            "chunk": "",
+            "done": False
+        }
+
+    def stream_reply(self, user_input: str, session_id: Optional[str] = None,
+                     shed: bool = False, trace: Optional[Trace] = None) -> Generator[Dict, None, None]:
+        # Prefill overlaps emotion detection, as in MIRA.stream_reply
+        started = time.time()
+        time.sleep(self.emotion_ms / 1000)
+        if trace is not None:
+            trace.add("detect_emotions", started)
+        yield self._header(user_input)
+        if shed:
+            yield {"chunk": CANNED_REPLY, "done": True}
+            return
+        time.sleep(max(0.0, self.prefill_ms - self.emotion_ms) / 1000)
+        token_times = []
+        for token in self._tokens(user_input):
+            time.sleep(self.token_ms / 1000)
+            token_times.append(time.time())
+            yield {"chunk": token, "done": False}
+        if trace is not None:
+            trace.add("prefill", started, token_times[0] if token_times else None)
+            trace.tokens(token_times)
+        yield {"chunk": "", "done": True}
+
+    async def astream_reply(self, user_input: str, session_id: Optional[str] = None,
+                            shed: bool = False, trace: Optional[Trace] = None) -> AsyncGenerator[Dict, None]:
+        started = time.time()
+        await asyncio.sleep(self.emotion_ms / 1000)
+        if trace is not None:
+            trace.add("detect_emotions", started)
+        yield self._header(user_input)
+        if shed:
+            yield {"chunk": CANNED_REPLY, "done": True}
+            return
+        await asyncio.sleep(max(0.0, self.prefill_ms - self.emotion_ms) / 1000)
+        for token in self._tokens(user_input):
+            await asyncio.sleep(self.token_ms / 1000)
+            yield {"chunk": token, "done": False}
+        yield {"chunk": "", "done": True}
+
+    def score_messages(self, messages: List) -> Generator[Dict, None, None]:
+        for message_id, text in messages:
+            yield {"id": message_id, "emotions": self._emotions(text)}
+
+    def log_conversation(self, user_input: str, response: Dict, bot_reply: str, session_id: Optional[str] = None):
+        pass
+
+    def emotion_trends(self, session_ids: List[str]) -> Dict[str, Dict]:
+        return {}
+
+    def close(self):
+        pass
@@ -0,0 +1,14 @@
+import os
+import sys
+
+import pytest
+
+# The Model modules import each other by bare name, as when run from this directory
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fake_llama import FakeLlama  # noqa: E402
+
+
+@pytest.fixture
+def fake_llama():
+    return FakeLlama()
@@ -0,0 +1,64 @@
+import threading
+import time
+
+
+class FakeLlama:
+    """Just enough of llama_cpp.Llama for the scheduler and prompt builder: one token per word."""
+
+    def __init__(self, n_ctx: int = 256, token_delay: float = 0.0):
+        self._n_ctx = n_ctx
+        self.token_delay = token_delay
+        self._input_ids = []
+        self.n_tokens = 0
+        self.saves = 0
+        self.loads = 0
+        self.decoded = 0
+        self.started = threading.Event()
+
+    def n_ctx(self) -> int:
+        return self._n_ctx
+
+    def tokenize(self, text: bytes, add_bos: bool = True, special: bool = False):
+        tokens = [sum(word.encode("utf-8")) % 50000 + 10 for word in text.decode("utf-8").split()]
+        return ([1] if add_bos else []) + tokens
+
+    def detokenize(self, tokens, prev_tokens=None, special=False) -> bytes:
+        return " ".join(f"w{token}" for token in tokens).encode("utf-8")
+
+    def eval(self, tokens):
+        self._input_ids = self._input_ids[:self.n_tokens] + list(tokens)
+        self.n_tokens = len(self._input_ids)
+
+    def create_completion(self, prompt, max_tokens: int = 16, stream: bool = False, **params):
+        tokens = self.tokenize(prompt.encode("utf-8"), special=True)
+        common = 0
+        for cached, token in zip(self._input_ids[:self.n_tokens], tokens):
+            if cached != token:
+                break
+            common += 1
+        self.n_tokens = min(common, len(tokens) - 1)
+        self.eval(tokens[self.n_tokens:])
+
+        def generate():
+            for index in range(max_tokens):
+                self.started.set()
+                time.sleep(self.token_delay)
+                self.eval([7])
+                self.decoded += 1
+                yield {"choices": [{"text": f" t{index}"}]}
+        return generate()
+
+    def save_state(self):
+        self.saves += 1
+        return _State(list(self._input_ids[:self.n_tokens]))
+
+    def load_state(self, state):
+        self.loads += 1
+        self._input_ids = list(state.ids)
+        self.n_tokens = len(state.ids)
+
+
+class _State:
+    def __init__(self, ids):
+        self.ids = ids
+        self.llama_state_size = 100 * len(ids)
@@ -0,0 +1,41 @@
+import admission as admission_module
+from admission import AdmissionController, client_key, retry_after_header
+
+
+def test_per_user_limit_and_release():
+    admission = AdmissionController(max_per_user=2)
+    assert admission.acquire("u1")
+    assert admission.acquire("u1")
+    assert not admission.acquire("u1")
+    assert admission.acquire("u2")
+    admission.release("u1")
+    assert admission.acquire("u1")
+
+
+def test_released_users_are_forgotten():
+    admission = AdmissionController(max_per_user=1)
+    admission.acquire("u1")
+    admission.release("u1")
+    assert admission._active == {}
+
+
+def test_zero_means_unlimited():
+    admission = AdmissionController(max_per_user=0)
+    assert all(admission.acquire("u1") for _ in range(10))
+
+
+def test_retry_after_is_a_whole_number_of_seconds():
+    assert retry_after_header(0.2) == "1"
+    assert retry_after_header(2.1) == "3"
+
+
+def test_client_key_ignores_forwarded_for_unless_proxies_are_trusted(monkeypatch):
+    monkeypatch.setattr(admission_module, "TRUSTED_PROXIES", 0)
+    assert client_key("10.0.0.5", "6.6.6.6") == "10.0.0.5"
+    assert client_key(None) == ""
+    monkeypatch.setattr(admission_module, "TRUSTED_PROXIES", 1)
+    # The client can prepend anything; the trusted proxy appends what it saw
+    assert client_key("10.0.0.5", "6.6.6.6, 203.0.113.7") == "203.0.113.7"
+    assert client_key("10.0.0.5", "") == "10.0.0.5"
+    monkeypatch.setattr(admission_module, "TRUSTED_PROXIES", 2)
+    assert client_key("10.0.0.5", "6.6.6.6, 203.0.113.7, 10.0.0.9") == "203.0.113.7"
@@ -0,0 +1,41 @@
+import importlib
+import json
+
+import pytest
+
+pytest.importorskip("starlette")
+pytest.importorskip("httpx")
+from starlette.testclient import TestClient  # noqa: E402
+
+from admission import AdmissionController  # noqa: E402
+
+
+@pytest.fixture
+def asgi(monkeypatch):
+    for name, value in {"MIRA_BACKEND": "stub", "STUB_EMOTION_MS": "0", "STUB_PREFILL_MS": "0",
+                        "STUB_TOKEN_MS": "0", "STUB_TOKENS": "8"}.items():
+        monkeypatch.setenv(name, value)
+    import asgi
+    asgi = importlib.reload(asgi)
+    asgi.admission = AdmissionController(max_per_user=1)
+    return asgi
+
+
+def test_model_streams_the_reply_and_releases_the_slot(asgi):
+    client = TestClient(asgi.app)
+    response = client.post("/model", json={"input": "I feel a bit lost", "session_id": "s1"})
+    assert response.status_code == 200
+    messages = [json.loads(line) for line in response.text.splitlines() if line.strip()]
+    assert "emotions" in messages[0]
+    assert messages[-1]["done"] and "".join(m.get("chunk", "") for m in messages[1:]).strip()
+    assert asgi.admission._active == {}
+
+
+def test_a_new_session_id_does_not_bypass_the_client_limit(asgi):
+    client = TestClient(asgi.app)
+    # One stream already open for this client (TestClient connects as "testclient")
+    assert asgi.admission.acquire("testclient")
+    response = client.post("/model", json={"input": "hello", "session_id": "fresh-chat-id"})
+    assert response.status_code == 503
+    asgi.admission.release("testclient")
+    assert client.post("/model", json={"input": "hello", "session_id": "fresh-chat-id"}).status_code == 200
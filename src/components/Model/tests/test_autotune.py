@@ -0,0 +1,28 @@
+import json
+
+from autotune import host_fingerprint, tuned_params
+
+DEFAULTS = dict(n_ctx=2048, n_threads=6, n_batch=64, n_gpu_layers=0)
+
+
+def write_profile(path, params, host=None):
+    path.write_text(json.dumps({
+        "host": host or host_fingerprint(),
+        "models": {"model.gguf": {"params": params}}
+    }))
+    return str(path)
+
+
+def test_profile_never_changes_the_context_window(tmp_path):
+    # Older profiles picked the leanest n_ctx; the app's window must survive them
+    path = write_profile(tmp_path / "profile.json", {"n_threads": 4, "n_batch": 256, "n_ctx": 1024})
+    params = tuned_params("/models/model.gguf", DEFAULTS, path=path)
+    assert params == dict(DEFAULTS, n_threads=4, n_batch=256)
+
+
+def test_profile_from_another_host_or_model_is_ignored(tmp_path):
+    path = write_profile(tmp_path / "profile.json", {"n_threads": 4}, host={"machine": "elsewhere"})
+    assert tuned_params("model.gguf", DEFAULTS, path=path) == DEFAULTS
+    path = write_profile(tmp_path / "other.json", {"n_threads": 4})
+    assert tuned_params("other.gguf", DEFAULTS, path=path) == DEFAULTS
+    assert tuned_params("model.gguf", DEFAULTS, path=str(tmp_path / "missing.json")) == DEFAULTS
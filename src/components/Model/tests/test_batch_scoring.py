@@ -0,0 +1,37 @@
+import io
+
+from batch_scoring import read_messages, score_messages
+
+
+def test_reads_a_json_array_and_message_table_rows():
+    body = '  [{"messageid": 7, "message_content": "hi"}, "plain", {"id": "x", "text": 3}]'
+    assert list(read_messages(io.StringIO(body))) == [("7", "hi"), ("1", "plain"), ("x", "")]
+
+
+def test_reads_json_lines_and_skips_blank_ones():
+    body = '{"id": "a", "text": "one"}\n\n{"messageID": "b", "text": "two"}\n'
+    assert list(read_messages(io.StringIO(body))) == [("a", "one"), ("b", "two")]
+    assert list(read_messages(io.StringIO("  \n"))) == []
+
+
+def fake_classifier(batches):
+    def classify_many(texts):
+        batches.append(list(texts))
+        return [[{"label": "joy", "score": 0.1 * len(text)}, {"label": "fear", "score": 0.2}] for text in texts]
+    return classify_many
+
+
+def test_scores_in_length_sorted_batches_tagged_by_id():
+    batches = []
+    messages = [("long", "a much longer one"), ("empty", "  "), ("short", "hi"), ("mid", "hello")]
+    results = list(score_messages(fake_classifier(batches), messages, batch_size=2))
+    assert batches == [["hi", "hello"], ["a much longer one"]]
+    assert results[0] == {"id": "empty", "error": "empty text"}
+    by_id = {result["id"]: result for result in results}
+    assert [e["emotion"] for e in by_id["mid"]["emotions"]] == ["joy", "fear"]
+    assert by_id["long"]["scores"] == {"joy": 1.7, "fear": 0.2}
+
+
+def test_classifier_errors_become_per_message_errors():
+    results = list(score_messages(lambda texts: [RuntimeError("boom")] * len(texts), [("a", "x")]))
+    assert results == [{"id": "a", "error": "boom"}]
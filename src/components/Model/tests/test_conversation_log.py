@@ -0,0 +1,42 @@
+import glob
+import json
+import os
+
+from conversation_log import ConversationLogWriter, read_log, rebuild_latest
+
+
+def test_appended_records_are_on_disk_after_flush(tmp_path):
+    log = ConversationLogWriter(folder=str(tmp_path), fsync_every=1000, flush_interval=60)
+    log.append({"session": "a", "user_input": "hi"})
+    log.append({"session": "a", "user_input": "hällo"})
+    assert log.flush(timeout=5)
+    assert [record["user_input"] for record in read_log(str(tmp_path))] == ["hi", "hällo"]
+    log.close(timeout=5)
+
+
+def test_log_rotates_by_size_and_reads_back_in_order(tmp_path):
+    log = ConversationLogWriter(folder=str(tmp_path), max_bytes=1)
+    for index in range(3):
+        log.append({"session": "a", "turn": index})
+        # File names have microsecond timestamps; keep them apart
+        assert log.flush(timeout=5)
+    log.close(timeout=5)
+    assert len(glob.glob(os.path.join(str(tmp_path), "conversation_*.jsonl"))) == 3
+    assert [record["turn"] for record in read_log(str(tmp_path))] == [0, 1, 2]
+
+
+def test_partial_last_line_is_skipped(tmp_path):
+    path = tmp_path / "conversation_20240101_000000_000000.jsonl"
+    path.write_text(json.dumps({"session": "a", "turn": 0}) + '\n{"session": "a", "tu')
+    assert list(read_log(str(tmp_path))) == [{"session": "a", "turn": 0}]
+
+
+def test_rebuild_latest_keeps_the_newest_session(tmp_path):
+    log = ConversationLogWriter(folder=str(tmp_path))
+    for session, turn in (("old", 0), ("new", 1), ("old", 2), ("new", 3)):
+        log.append({"session": session, "turn": turn})
+    log.close(timeout=5)
+    with open(rebuild_latest(str(tmp_path)), encoding="utf-8") as f:
+        assert json.load(f) == [{"turn": 1}, {"turn": 3}]
+    with open(rebuild_latest(str(tmp_path), session="old"), encoding="utf-8") as f:
+        assert json.load(f) == [{"turn": 0}, {"turn": 2}]
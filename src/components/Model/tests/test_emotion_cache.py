@@ -0,0 +1,52 @@
+import time
+
+from emotion_cache import EmotionCache, SqliteEmotionStore, normalize
+
+SCORES = [{"emotion": "joy", "confidence": 0.9}]
+
+
+def test_hit_after_put_and_miss_for_unknown_text():
+    cache = EmotionCache("model")
+    assert cache.get("hello") is None
+    cache.put("hello", SCORES)
+    assert cache.get("hello") == SCORES
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_normalized_forms_share_an_entry():
+    cache = EmotionCache("model")
+    cache.put(normalize("  Café "), SCORES)
+    assert cache.get(normalize("Café")) == SCORES
+
+
+def test_namespace_separates_classifier_setups():
+    cache = EmotionCache("model-a")
+    cache.put("hello", SCORES)
+    assert EmotionCache("model-b").key("hello") != cache.key("hello")
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = EmotionCache("model", max_entries=2)
+    cache.put("a", SCORES)
+    cache.put("b", SCORES)
+    cache.get("a")
+    cache.put("c", SCORES)
+    assert cache.get("b") is None
+    assert cache.get("a") == SCORES
+    assert cache.evictions == 1
+
+
+def test_entries_expire(monkeypatch):
+    cache = EmotionCache("model", ttl_seconds=10)
+    cache.put("a", SCORES)
+    later = time.time() + 11
+    monkeypatch.setattr(time, "time", lambda: later)
+    assert cache.get("a") is None
+
+
+def test_shared_store_serves_other_caches(tmp_path):
+    path = str(tmp_path / "emotions.sqlite")
+    EmotionCache("model", store=SqliteEmotionStore(path)).put("hello", SCORES)
+    other = EmotionCache("model", store=SqliteEmotionStore(path))
+    assert other.get("hello") == SCORES
+    assert other.hits == 1
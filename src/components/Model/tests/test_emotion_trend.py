@@ -0,0 +1,39 @@
+import pytest
+
+from emotion_trend import EmotionTrend
+
+
+def test_new_trend_is_empty_and_neutral():
+    trend = EmotionTrend()
+    assert trend.distribution() == {}
+    assert trend.dominant() == "neutral"
+
+
+def test_a_message_weighs_half_after_half_life_newer_ones():
+    trend = EmotionTrend()
+    trend.update({"sadness": 1.0}, half_life=2)
+    trend.update({"joy": 1.0}, half_life=2)
+    trend.update({"joy": 1.0}, half_life=2)
+    mood = trend.distribution()
+    # Weights 0.5, 0.707, 1.0 for the sad message and the two joyful ones
+    assert mood["sadness"] == pytest.approx(0.5 / 2.207, abs=1e-3)
+    assert mood["joy"] == pytest.approx(1.707 / 2.207, abs=1e-3)
+    assert trend.dominant() == "joy"
+
+
+def test_unknown_labels_are_ignored():
+    trend = EmotionTrend()
+    trend.update({"joy": 0.6, "boredom": 0.4})
+    assert set(trend.distribution()) == {"anger", "disgust", "fear", "joy", "neutral", "sadness", "surprise"}
+    assert trend.distribution()["joy"] == pytest.approx(0.6)
+
+
+def test_state_round_trip():
+    trend = EmotionTrend()
+    trend.update({"fear": 0.7, "neutral": 0.3})
+    trend.update({"fear": 0.9})
+    restored = EmotionTrend.from_state(*trend.state())
+    assert restored.to_record() == trend.to_record()
+    assert restored.to_record()["updates"] == 2
+    # A state from a different label set is dropped rather than misread
+    assert EmotionTrend.from_state([1.0], 1.0, 1).distribution() == {}
@@ -0,0 +1,33 @@
+from kv_cache import SessionStateCache, state_cache_bytes
+
+PER_TOKEN = 112 * 1024
+
+
+class State:
+    def __init__(self, size):
+        self.llama_state_size = size
+
+
+def test_default_budget_fits_the_expected_chats(monkeypatch):
+    monkeypatch.delenv("MIRA_KV_CACHE_MB", raising=False)
+    monkeypatch.setenv("MIRA_KV_CACHE_CHATS", "8")
+    assert state_cache_bytes(PER_TOKEN, 2048) == 8 * PER_TOKEN * 2048
+    # Split over worker processes, rounding up so every worker keeps a chat
+    assert state_cache_bytes(PER_TOKEN, 2048, workers=4) == 2 * PER_TOKEN * 2048
+    assert state_cache_bytes(PER_TOKEN, 2048, workers=16) == PER_TOKEN * 2048
+    assert state_cache_bytes(None, 2048) > 0
+
+
+def test_explicit_budget_is_split_over_workers_and_tiers(monkeypatch):
+    monkeypatch.setenv("MIRA_KV_CACHE_MB", "1024")
+    assert state_cache_bytes(PER_TOKEN, 2048, tier_count=2, workers=2) == 256 * 1024 * 1024
+
+
+def test_a_default_budget_holds_that_many_full_states(monkeypatch):
+    monkeypatch.delenv("MIRA_KV_CACHE_MB", raising=False)
+    monkeypatch.setenv("MIRA_KV_CACHE_CHATS", "2")
+    cache = SessionStateCache(max_bytes=state_cache_bytes(PER_TOKEN, 2048))
+    for session_id in ("a", "b", "c"):
+        cache.put(session_id, State(PER_TOKEN * 2048))
+    assert (cache.get("a"), cache.evictions) == (None, 1)
+    assert cache.get("b") is not None and cache.get("c") is not None
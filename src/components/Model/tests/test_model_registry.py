@@ -0,0 +1,54 @@
+from model_registry import ModelRegistry, ModelTier, TierController, tier_threads
+
+
+class FakeScheduler:
+    def __init__(self, wait=0.0, prefill_time=0.5, token_time=0.05):
+        self.wait = wait
+        self.prefill_time = prefill_time
+        self.token_time = token_time
+
+    def estimated_wait(self):
+        return self.wait
+
+    def predicted_latency(self, max_tokens):
+        return self.wait + self.prefill_time + max_tokens * self.token_time
+
+
+def registry(small, large):
+    models = ModelRegistry()
+    # Added out of order: the registry keeps MODEL_TIERS order, smallest first
+    models.add(ModelTier("large", None, large, None))
+    models.add(ModelTier("small", None, small, None))
+    return models
+
+
+def test_largest_tier_within_the_slo_answers():
+    controller = TierController(registry(FakeScheduler(), FakeScheduler(token_time=0.1)),
+                                latency_slo=30.0, max_tokens=256)
+    tier, max_tokens = controller.choose()
+    assert (tier.name, max_tokens) == ("large", 256)
+
+
+def test_loaded_large_tier_falls_back_to_the_small_one():
+    controller = TierController(registry(FakeScheduler(), FakeScheduler(wait=40.0)),
+                                latency_slo=30.0, max_tokens=256)
+    tier, max_tokens = controller.choose()
+    assert (tier.name, max_tokens) == ("small", 256)
+
+
+def test_reply_shrinks_when_no_tier_fits_but_not_below_the_floor():
+    small = FakeScheduler(wait=20.0, prefill_time=1.0, token_time=0.1)
+    controller = TierController(registry(small, FakeScheduler(wait=60.0)),
+                                latency_slo=30.0, max_tokens=256, min_tokens=50)
+    tier, max_tokens = controller.choose()
+    assert (tier.name, max_tokens) == ("small", 90)
+
+    small.wait = 29.0
+    assert controller.choose()[1] == 50
+
+
+def test_tier_threads_parses_per_tier_counts(monkeypatch):
+    monkeypatch.setenv("MIRA_TIER_THREADS", "small=2, large=6,bogus,medium=x")
+    assert tier_threads() == {"small": 2, "large": 6}
+    monkeypatch.delenv("MIRA_TIER_THREADS")
+    assert tier_threads() == {}
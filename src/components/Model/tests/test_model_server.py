@@ -0,0 +1,69 @@
+import asyncio
+import shutil
+import tempfile
+import threading
+
+import pytest
+
+from model_client import ModelClient
+from model_server import ModelServer
+from stub_mira import StubMIRA
+
+
+class FailingScores(StubMIRA):
+    def score_messages(self, messages):
+        raise RuntimeError("classifier failed")
+        yield
+
+
+@pytest.fixture
+def client(monkeypatch):
+    for name in ("STUB_EMOTION_MS", "STUB_PREFILL_MS", "STUB_TOKEN_MS"):
+        monkeypatch.setenv(name, "0")
+    # Unix socket paths are short; pytest's tmp_path can be too long
+    folder = tempfile.mkdtemp()
+    server = ModelServer(f"{folder}/model.sock", FailingScores())
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    client = ModelClient(f"{folder}/model.sock", timeout=10)
+    yield client
+    client.close()
+    server.shutdown()
+    server.server_close()
+    shutil.rmtree(folder)
+
+
+def text_of(messages):
+    return "".join(message["chunk"] for message in messages if "emotions" not in message)
+
+
+def test_client_follows_server_readiness_and_calls(client):
+    assert client.ready.wait(5)
+    assert client.detect_emotions("hello") == StubMIRA().detect_emotions("hello")
+    assert client.emotion_trends(["s1"]) == {}
+
+
+def test_streams_match_the_local_backend_and_reuse_connections(client):
+    assert client.ready.wait(5)
+    local = list(StubMIRA().stream_reply("I feel a bit lost", session_id="s1"))
+    assert list(client.stream_reply("I feel a bit lost", session_id="s1")) == local
+    assert client._idle.qsize() == 1
+    assert list(client.stream_reply("I feel a bit lost", session_id="s1")) == local
+    assert client._idle.qsize() == 1
+
+    async def collect():
+        return [message async for message in client.astream_reply("I feel a bit lost", session_id="s1")]
+
+    assert text_of(asyncio.run(collect())) == text_of(local)
+
+
+def test_abandoned_stream_closes_its_connection(client):
+    assert client.ready.wait(5)
+    assert client._idle.qsize() == 1
+    stream = client.stream_reply("hello there")
+    next(stream)
+    stream.close()
+    assert client._idle.qsize() == 0
+
+
+def test_failed_score_stream_ends_with_a_score_shaped_error(client):
+    assert list(client.score_messages([("m1", "hi")])) == [{"id": None, "error": "classifier failed"}]
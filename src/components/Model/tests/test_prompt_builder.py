@@ -0,0 +1,47 @@
+from prompt_builder import PromptBuilder
+from fake_llama import FakeLlama
+
+
+def words(count: int, tag: str = "w") -> str:
+    return " ".join(f"{tag}{index}" for index in range(count))
+
+
+def test_everything_is_kept_when_it_fits():
+    builder = PromptBuilder(FakeLlama(n_ctx=200), max_tokens=50)
+    turns = [words(10, "a"), words(10, "b")]
+    kept, user_input = builder.fit([words(20, "s")], turns, "how are you")
+    assert kept == turns
+    assert user_input == "how are you"
+
+
+def test_oldest_turns_are_dropped_down_to_the_trim_fraction():
+    # budget 150 - 1 BOS - 20 fixed - 3 input = 126; 6 turns of 30 don't fit
+    builder = PromptBuilder(FakeLlama(n_ctx=200), max_tokens=50, trim_to=0.5)
+    turns = [words(30, f"t{index}_") for index in range(6)]
+    kept, _ = builder.fit([words(20, "s")], turns, "how are you")
+    # Only the newest turns within half the room (63 tokens) are kept
+    assert kept == turns[-2:]
+
+
+def test_trim_to_one_drops_only_what_is_needed():
+    builder = PromptBuilder(FakeLlama(n_ctx=200), max_tokens=50, trim_to=1.0)
+    turns = [words(30, f"t{index}_") for index in range(6)]
+    kept, _ = builder.fit([words(20, "s")], turns, "how are you")
+    assert kept == turns[-4:]
+
+
+def test_overlong_message_is_clipped_to_the_budget():
+    builder = PromptBuilder(FakeLlama(n_ctx=100), max_tokens=50)
+    kept, user_input = builder.fit([words(9, "s")], [words(5)], words(80, "m"))
+    assert kept == []
+    assert len(user_input.split()) == 40  # 50 - 1 BOS - 9 fixed
+
+
+def test_token_counts_are_cached():
+    builder = PromptBuilder(FakeLlama(n_ctx=200), max_tokens=50)
+    turns = [words(10, "a")]
+    builder.fit([words(5, "s")], turns, "hi")
+    misses = builder.misses
+    builder.fit([words(5, "s")], turns, "hi again")
+    assert builder.misses == misses
+    assert builder.hits >= 2
@@ -0,0 +1,138 @@
+import time
+from concurrent.futures import Future
+
+import pytest
+
+from batched_scheduler import BatchedGenerationScheduler, _Sampler
+from kv_cache import SessionStateCache
+from scheduler import GenerationScheduler, SchedulerFull
+from fake_llama import FakeLlama
+
+
+def test_tokens_stream_back_to_the_caller(fake_llama):
+    scheduler = GenerationScheduler(fake_llama)
+    assert "".join(scheduler.submit("hello there", max_tokens=3)) == " t0 t1 t2"
+    assert scheduler.stats["completed"] == 1
+
+
+def test_cancel_stops_the_decode_and_counts_skipped_tokens():
+    llama = FakeLlama(token_delay=0.01)
+    scheduler = GenerationScheduler(llama)
+    request = scheduler.submit("hello there", max_tokens=200)
+    stream = iter(request)
+    next(stream)
+    request.cancel()
+    list(stream)
+    assert scheduler.stats["cancelled"] == 1
+    assert llama.decoded < 200
+    assert scheduler.stats["skipped_tokens"] == 200 - request.tokens
+
+
+def test_request_cancelled_while_queued_never_decodes():
+    llama = FakeLlama(token_delay=0.01)
+    scheduler = GenerationScheduler(llama)
+    running = scheduler.submit("first", max_tokens=20)
+    queued = scheduler.submit("second", max_tokens=20)
+    queued.cancel()
+    assert list(queued) == []
+    assert queued.tokens == 0
+    list(running)
+
+
+def test_full_queue_is_refused():
+    llama = FakeLlama(token_delay=0.05)
+    scheduler = GenerationScheduler(llama, max_queue=1)
+    running = scheduler.submit("first", max_tokens=5)
+    llama.started.wait(1)
+    scheduler.submit("second", max_tokens=5)
+    with pytest.raises(SchedulerFull):
+        scheduler.submit("third", max_tokens=5)
+    running.cancel()
+
+
+def test_session_state_is_saved_only_when_another_session_takes_over(fake_llama):
+    scheduler = GenerationScheduler(fake_llama, state_cache=SessionStateCache(max_bytes=10 ** 6))
+    for _ in range(3):
+        list(scheduler.submit("system chat a", session_id="a", max_tokens=2))
+    assert fake_llama.saves == 0
+    list(scheduler.submit("system chat b", session_id="b", max_tokens=2))
+    assert fake_llama.saves == 1
+    list(scheduler.submit("system chat a again", session_id="a", max_tokens=2))
+    assert fake_llama.loads == 1
+
+
+def test_suffix_is_appended_once_it_resolves(fake_llama):
+    scheduler = GenerationScheduler(fake_llama)
+    suffix = Future()
+    request = scheduler.submit("prefix words", suffix=suffix, max_tokens=2)
+    suffix.set_result(" summary")
+    assert "".join(request) == " t0 t1"
+
+
+class FakeEngine:
+    """Stands in for SequenceBatch: checks positions per sequence and records each forward pass."""
+
+    def __init__(self, n_ctx=512, n_batch=64, delay=0.0):
+        self.n_ctx = n_ctx
+        self.n_batch = n_batch
+        self.delay = delay
+        self.sequences = {}
+        self.passes = []
+
+    def truncate(self, seq_id, keep):
+        del self.sequences.setdefault(seq_id, [])[keep:]
+
+    def clear(self):
+        self.sequences.clear()
+
+    def decode(self, entries):
+        time.sleep(self.delay)
+        for token, pos, seq_id, _ in entries:
+            sequence = self.sequences.setdefault(seq_id, [])
+            assert pos == len(sequence)
+            sequence.append(token)
+        self.passes.append({seq_id for _, _, seq_id, _ in entries})
+
+    def sampler(self, temperature, top_p):
+        counter = iter(range(100, 10 ** 6))
+        return _Sampler(lambda index: next(counter), lambda: None)
+
+    def is_eog(self, token):
+        return token == 2
+
+    def piece(self, token):
+        return f" t{token}".encode("utf-8")
+
+
+def test_batched_scheduler_decodes_several_chats_per_pass():
+    engine = FakeEngine()
+    scheduler = BatchedGenerationScheduler(FakeLlama(), slots=3, engine=engine)
+    requests = [scheduler.submit(f"chat number {index}", session_id=f"s{index}", max_tokens=20) for index in range(3)]
+    replies = ["".join(request) for request in requests]
+    assert all(reply.split() == [f"t{token}" for token in range(100, 120)] for reply in replies)
+    assert max(len(seq_ids) for seq_ids in engine.passes) == 3
+
+
+def test_batched_scheduler_stop_strings_and_cancel():
+    scheduler = BatchedGenerationScheduler(FakeLlama(), slots=2, engine=FakeEngine(delay=0.002))
+    assert "".join(scheduler.submit("hello", max_tokens=50, stop=["t103"])) == " t100 t101 t102 "
+    request = scheduler.submit("hello", max_tokens=500)
+    stream = iter(request)
+    next(stream)
+    request.cancel()
+    list(stream)
+    assert scheduler.stats["cancelled"] == 1
+    assert scheduler.active == 0
+
+
+def test_batched_scheduler_reuses_a_sessions_sequence():
+    engine = FakeEngine()
+    scheduler = BatchedGenerationScheduler(FakeLlama(), slots=2, engine=engine)
+    list(scheduler.submit("a long shared system prompt turn one", session_id="a", max_tokens=2))
+    engine.passes.clear()
+    prefilled = []
+    decode = engine.decode
+    engine.decode = lambda entries: (prefilled.append(len(entries)), decode(entries))
+    list(scheduler.submit("a long shared system prompt turn one and two", session_id="a", max_tokens=2))
+    # Only the two new words (and the re-evaluated last prompt token) are prefilled
+    assert prefilled[0] <= 3
@@ -0,0 +1,103 @@
+import asyncio
+import threading
+import time
+
+from session_store import SessionStore
+
+SCORES = {"joy": 0.8, "sadness": 0.2}
+
+
+def record(store, session_id, text="hello", reply="hi there"):
+    return store.record_turn(session_id, text, reply, "joy (80%)", SCORES)
+
+
+def test_turns_accumulate_and_halve_past_max_turns():
+    store = SessionStore(max_turns=6)
+    for index in range(6):
+        record(store, "s1", text=f"turn {index}")
+    assert len(store.get("s1").turns) == 6
+    record(store, "s1", text="turn 6")
+    turns, _ = store.context("s1")
+    assert [turn["user"] for turn in turns] == ["turn 4", "turn 5", "turn 6"]
+
+
+def test_drop_oldest_keeps_newest_turns_and_byte_count():
+    store = SessionStore()
+    for index in range(4):
+        record(store, "s1", text=f"turn {index}")
+    before = store.size_bytes
+    store.drop_oldest("s1", 3)
+    turns, _ = store.context("s1")
+    assert [turn["user"] for turn in turns] == ["turn 3"]
+    assert store.size_bytes < before
+    assert store.size_bytes == store.get("s1").size_bytes
+
+
+def test_least_recently_used_session_is_evicted_over_max_sessions():
+    store = SessionStore(max_sessions=2)
+    record(store, "a")
+    record(store, "b")
+    store.get("a")
+    record(store, "c")
+    assert store.get("b") is None
+    assert store.get("a") is not None and store.get("c") is not None
+    assert store.evictions == 1
+
+
+def test_sessions_are_evicted_over_the_byte_cap():
+    store = SessionStore(max_bytes=3000, max_turn_chars=1000)
+    record(store, "a", text="x" * 1000)
+    record(store, "b", text="y" * 1000)
+    assert store.get("a") is None
+    assert store.size_bytes <= 3000
+
+
+def test_expired_sessions_are_dropped(monkeypatch):
+    store = SessionStore(ttl_seconds=60)
+    record(store, "a")
+    later = time.monotonic() + 61
+    monkeypatch.setattr(time, "monotonic", lambda: later)
+    assert store.get("a") is None
+    assert len(store) == 0
+
+
+def test_turn_text_is_truncated():
+    store = SessionStore(max_turn_chars=5)
+    record(store, "a", text="abcdefgh", reply="123456789")
+    turns, _ = store.context("a")
+    assert turns[0]["user"] == "abcde" and turns[0]["bot"] == "12345"
+
+
+def test_trend_survives_eviction_with_a_trend_store(tmp_path):
+    from session_store import SqliteTrendStore
+
+    store = SessionStore(trend_store=SqliteTrendStore(str(tmp_path / "trends.sqlite")))
+    record(store, "a")
+    store.discard("a")
+    turns, mood = store.context("a")
+    assert turns == []
+    assert max(mood, key=mood.get) == "joy"
+    assert store.trends(["a", "missing"]).keys() == {"a"}
+
+
+def test_acontext_reads_a_stored_trend_off_the_event_loop(tmp_path):
+    from session_store import SqliteTrendStore
+
+    class RecordingTrendStore(SqliteTrendStore):
+        def get(self, session_id):
+            self.read_on = threading.current_thread()
+            return super().get(session_id)
+
+    trend_store = RecordingTrendStore(str(tmp_path / "trends.sqlite"))
+    store = SessionStore(trend_store=trend_store)
+    record(store, "a")
+    record(store, "live", text="still here")
+    store.discard("a")
+
+    async def fetch():
+        return await store.acontext("a"), await store.acontext("live"), threading.current_thread()
+
+    (turns, mood), (live_turns, _), loop_thread = asyncio.run(fetch())
+    assert turns == [] and max(mood, key=mood.get) == "joy"
+    assert trend_store.read_on is not loop_thread
+    assert [turn["user"] for turn in live_turns] == ["still here"]
@@ -0,0 +1,104 @@
+import asyncio
+import json
+import time
+
+from streaming import acoalesce, coalesce, frame
+from stub_mira import StubMIRA
+
+
+def text_of(messages):
+    return "".join(message["chunk"] for message in messages if "emotions" not in message)
+
+
+def stub(monkeypatch, token_ms="1"):
+    monkeypatch.setenv("STUB_EMOTION_MS", "0")
+    monkeypatch.setenv("STUB_PREFILL_MS", "0")
+    monkeypatch.setenv("STUB_TOKEN_MS", token_ms)
+    return StubMIRA()
+
+
+def test_coalescing_keeps_the_text_and_merges_chunks(monkeypatch):
+    mira = stub(monkeypatch)
+    raw = list(mira.stream_reply("I feel a bit lost today"))
+    merged = list(coalesce(iter(raw), window=1.0, max_bytes=10 ** 6))
+    assert text_of(merged) == text_of(raw)
+    assert len(merged) < len(raw)
+    # Emotion header first, then the first text chunk at once, then one flush at `done`
+    assert "emotions" in merged[0]
+    assert merged[-1]["done"] and not any(message["done"] for message in merged[:-1])
+
+
+def test_byte_cap_flushes_early(monkeypatch):
+    mira = stub(monkeypatch)
+    merged = list(coalesce(mira.stream_reply("I feel a bit lost today"), window=60.0, max_bytes=16))
+    assert all(len(message["chunk"].encode("utf-8")) < 32 for message in merged)
+
+
+def test_zero_window_passes_every_message(monkeypatch):
+    mira = stub(monkeypatch)
+    raw = list(mira.stream_reply("hello"))
+    assert list(coalesce(iter(raw), window=0)) == raw
+
+
+def test_async_coalescing_matches_sync(monkeypatch):
+    mira = stub(monkeypatch)
+
+    async def collect():
+        return [message async for message in acoalesce(mira.astream_reply("hello there"), window=1.0)]
+
+    merged = asyncio.run(collect())
+    assert text_of(merged) == text_of(mira.stream_reply("hello there"))
+    assert merged[-1]["done"]
+
+
+def test_async_coalescing_flushes_a_stalled_stream():
+    produced = {}
+
+    async def slow_tokens():
+        yield {"chunk": "first", "done": False}
+        yield {"chunk": " buffered", "done": False}
+        await asyncio.sleep(0.3)
+        produced["late"] = time.monotonic()
+        yield {"chunk": " late", "done": False}
+        yield {"chunk": "", "done": True}
+
+    async def collect():
+        return [(time.monotonic(), message) async for message in acoalesce(slow_tokens(), window=0.05)]
+
+    received = asyncio.run(collect())
+    messages = [message for _, message in received]
+    assert "".join(message["chunk"] for message in messages) == "first buffered late"
+    # " buffered" goes out after the window, not with the next token
+    sent_at = next(at for at, message in received if message["chunk"] == " buffered")
+    assert sent_at < produced["late"]
+    assert messages[-1]["done"]
+
+
+def test_async_coalescing_releases_its_source_mid_wait():
+    closed = []
+
+    async def stalls():
+        try:
+            yield {"chunk": "first", "done": False}
+            yield {"chunk": " second", "done": False}
+            await asyncio.sleep(10)
+        finally:
+            closed.append(True)
+
+    async def read_two_then_close():
+        source = stalls()
+        stream = acoalesce(source, window=0.05)
+        chunks = [(await stream.__anext__())["chunk"], (await stream.__anext__())["chunk"]]
+        # " second" was flushed while a read was still waiting; closing must
+        # cancel that read so the source can be closed, as asgi.py does
+        await stream.aclose()
+        await source.aclose()
+        return chunks
+
+    assert asyncio.run(read_two_then_close()) == ["first", " second"]
+    assert closed == [True]
+
+
+def test_frames():
+    assert json.loads(frame({"chunk": "a", "done": False})) == {"chunk": "a", "done": False}
+    assert frame({"chunk": "a"}, sse=True).startswith("data: ")
@@ -0,0 +1,76 @@
+from types import SimpleNamespace
+
+import pytest
+
+np = pytest.importorskip("numpy")
+pytest.importorskip("transformers")
+from emotion_backends import WindowedClassifier  # noqa: E402
+
+LABELS = {0: "joy", 1: "sadness"}
+SAD = 99
+
+
+class WordTokenizer:
+    """One token per word; long texts overflow into windows overlapping by `stride`."""
+
+    model_max_length = 4
+
+    def __call__(self, texts, truncation, max_length, stride, return_overflowing_tokens):
+        encoded = {"input_ids": [], "attention_mask": [], "overflow_to_sample_mapping": []}
+        for owner, text in enumerate(texts):
+            ids = [SAD if word == "sad" else 1 for word in text.split()]
+            start = 0
+            while True:
+                window = ids[start:start + max_length]
+                encoded["input_ids"].append(window)
+                encoded["attention_mask"].append([1] * len(window))
+                encoded["overflow_to_sample_mapping"].append(owner)
+                if start + max_length >= len(ids):
+                    break
+                start += max_length - stride
+        return encoded
+
+
+class ScriptedWindows(WindowedClassifier):
+    """Scores a window as sad if it holds the word "sad", else as joyful."""
+
+    def _forward(self, features):
+        self.passes.append(len(features))
+        return np.array([[0.1, 0.9] if SAD in f["input_ids"] else [0.8, 0.2] for f in features], dtype=np.float32)
+
+
+def classifier(aggregate):
+    config = SimpleNamespace(max_position_embeddings=514, id2label=LABELS)
+    pipeline = SimpleNamespace(model=SimpleNamespace(config=config), tokenizer=WordTokenizer())
+    windowed = ScriptedWindows(pipeline, aggregate=aggregate, stride=1)
+    windowed.passes = []
+    return windowed
+
+
+def scores(result):
+    return {entry["label"]: round(entry["score"], 3) for entry in result}
+
+
+# Windows of 4 words overlapping by 1; only the last, shorter one holds "sad"
+LONG = "i am so happy but also quite tired and a bit sad"
+
+
+def test_max_keeps_an_emotion_shown_by_any_window():
+    windowed = classifier("max")
+    short, long = windowed(["so happy", LONG])
+    assert scores(short) == {"joy": 0.8, "sadness": 0.2}
+    assert scores(long) == {"joy": 0.8, "sadness": 0.9}
+    # Short and long texts run as two padded passes, not one per window
+    assert windowed.passes == [1, 4]
+
+
+def test_mean_and_weighted_average_the_windows():
+    assert scores(classifier("mean")(LONG)) == {"joy": 0.625, "sadness": 0.375}
+    # The sad window is the shortest, so weighting by length lowers its share
+    weighted = scores(classifier("weighted")(LONG))
+    assert weighted["sadness"] < 0.375 and weighted["joy"] > 0.625
+
+
+def test_unknown_aggregation_is_rejected():
+    with pytest.raises(ValueError):
+        classifier("median")
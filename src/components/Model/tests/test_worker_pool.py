@@ -0,0 +1,87 @@
+import os
+import subprocess
+import sys
+import textwrap
+
+import pytest
+
+from worker_pool import WorkerPool
+
+MODEL_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Stand-ins for the model-owning modules, importable by the spawned workers
+FAKE_MIRA = '''
+import threading
+
+
+class MIRA:
+    def __init__(self, n_threads=None, workers=1, background_load=True):
+        self.ready = threading.Event()
+        self.ready.set()
+
+    def score_messages(self, messages):
+        raise RuntimeError("classifier failed")
+        yield
+
+    def close(self):
+        pass
+'''
+FAKE_TORCH = '''
+def set_num_threads(n):
+    pass
+'''
+
+
+@pytest.fixture
+def fake_models(tmp_path, monkeypatch):
+    (tmp_path / "mira.py").write_text(FAKE_MIRA)
+    (tmp_path / "torch.py").write_text(FAKE_TORCH)
+    monkeypatch.syspath_prepend(str(tmp_path))
+    return tmp_path
+
+
+def test_failed_score_stream_ends_with_a_score_shaped_error(fake_models):
+    pool = WorkerPool(1)
+    try:
+        assert pool.ready.wait(60)
+        assert list(pool.score_messages([("m1", "hello")])) == [{"id": None, "error": "classifier failed"}]
+    finally:
+        pool.close()
+
+
+def test_app_run_as_main_starts_its_pool_once(fake_models):
+    pytest.importorskip("flask")
+    pytest.importorskip("flask_cors")
+    launcher = fake_models / "launch_app.py"
+    launcher.write_text(textwrap.dedent(f'''
+        import runpy
+        import sys
+        import time
+
+        import flask
+        import worker_pool
+
+        # Share one CPU between the workers so this runs on small machines too
+        worker_pool._split_cpus = lambda n, per_worker=None: [[min(worker_pool.os.sched_getaffinity(0))]] * n
+
+        def run(app, *args, **kwargs):
+            client = app.test_client()
+            deadline = time.monotonic() + 60
+            status = None
+            while time.monotonic() < deadline:
+                status = client.get("/ready").status_code
+                if status == 200:
+                    break
+                time.sleep(0.1)
+            print("ready", status)
+            sys.modules["__main__"].mira.close()
+
+        flask.Flask.run = run
+        runpy.run_path({os.path.join(MODEL_DIR, "app.py")!r}, run_name="__main__")
+    '''))
+    env = dict(os.environ, MIRA_WORKERS="2", MIRA_BACKEND="local",
+               PYTHONPATH=os.pathsep.join([str(fake_models), MODEL_DIR] + sys.path))
+    result = subprocess.run([sys.executable, str(launcher)], env=env, cwd=str(fake_models),
+                            capture_output=True, text=True, timeout=120)
+    assert "ready 200" in result.stdout, result.stderr
+    assert "bootstrapping phase" not in result.stderr
@@ -0,0 +1,159 @@
+"""Opt-in, sampled per-request tracing, exported in Chrome trace-event format.
+
+A sampled /model request records a span for each stage (waiting for the
+emotion header, emotion detection, prompt building and tokenization, queue
+wait, prefill, decode, writing the reply, logging the turn) plus a timestamp
+for every decoded token. Open the JSON from `GET /debug/traces/<id>` or
+MIRA_TRACE_DIR in chrome://tracing or https://ui.perfetto.dev.
+
+Traces are off unless MIRA_TRACE_SAMPLE (fraction of requests, 0-1) is set,
+or a request sends `X-MIRA-Trace: 1` with the debug token. An untraced
+request pays one random() call and a few `is not None` checks.
+"""
+import hmac
+import json
+import logging
+import multiprocessing
+import os
+import random
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from contextlib import contextmanager, nullcontext
+from typing import Dict, Iterator, List, Optional, Sequence
+
+from metrics import TRACES
+
+logger = logging.getLogger("MIRA")
+
+SAMPLE_RATE = float(os.getenv("MIRA_TRACE_SAMPLE", "0"))
+TRACE_DIR = os.getenv("MIRA_TRACE_DIR")
+TRACE_KEEP = int(os.getenv("MIRA_TRACE_KEEP", "32"))
+# /debug/* endpoints and forced traces need this token; without it they are off
+DEBUG_TOKEN = os.getenv("MIRA_DEBUG_TOKEN")
+
+
+class Trace:
+    """Timed events of one request, possibly spanning threads and processes.
+
+    Times are wall-clock (time.time()), so spans recorded by a worker process
+    or the model server on the same host line up with the web process's.
+    """
+
+    def __init__(self, name: str, trace_id: Optional[str] = None):
+        self.name = name
+        self.trace_id = trace_id or uuid.uuid4().hex[:16]
+        self.started_at = time.time()
+        self.events: List[Dict] = []
+        self._threads: Dict[tuple, str] = {}
+
+    def _event(self, name: str, phase: str, at: float, args: Dict) -> Dict:
+        thread = threading.current_thread()
+        pid, tid = os.getpid(), threading.get_native_id()
+        self._threads[(pid, tid)] = thread.name
+        event = {"name": name, "ph": phase, "ts": round(at * 1e6), "pid": pid, "tid": tid}
+        if args:
+            event["args"] = args
+        return event
+
+    def add(self, name: str, start: float, end: Optional[float] = None, **args):
+        """A span from `start` to `end` (default now), on the calling thread."""
+        end = time.time() if end is None else end
+        event = self._event(name, "X", start, args)
+        event["dur"] = round((end - start) * 1e6)
+        self.events.append(event)
+
+    def instant(self, name: str, at: Optional[float] = None, **args):
+        event = self._event(name, "i", time.time() if at is None else at, args)
+        event["s"] = "t"
+        self.events.append(event)
+
+    @contextmanager
+    def span(self, name: str, **args) -> Iterator[Dict]:
+        """Times the block; the yielded dict can be filled with args on the way."""
+        start = time.time()
+        try:
+            yield args
+        finally:
+            self.add(name, start, **args)
+
+    def tokens(self, timestamps: Sequence[float]):
+        for index, at in enumerate(timestamps):
+            self.instant("token", at, index=index)
+
+    def merge(self, events: List[Dict]):
+        """Add events exported by the same request's trace in another process."""
+        self.events.extend(events)
+
+    def export(self) -> List[Dict]:
+        """Events plus the process/thread names Chrome shows for them."""
+        names = [{"name": "process_name", "ph": "M", "pid": os.getpid(), "tid": 0,
+                  "args": {"name": multiprocessing.current_process().name}}]
+        names += [{"name": "thread_name", "ph": "M", "pid": pid, "tid": tid, "args": {"name": thread_name}}
+                  for (pid, tid), thread_name in self._threads.items()]
+        return names + self.events
+
+    def to_chrome(self) -> Dict:
+        return {
+            "traceEvents": self.export(),
+            "displayTimeUnit": "ms",
+            "otherData": {"trace_id": self.trace_id, "name": self.name, "started_at": self.started_at}
+        }
+
+    def summary(self) -> Dict:
+        """Total ms per span name, for listing recent traces."""
+        stages: Dict[str, float] = {}
+        for event in self.events:
+            if event["ph"] == "X":
+                stages[event["name"]] = stages.get(event["name"], 0.0) + event["dur"] / 1000
+        return {"trace_id": self.trace_id, "name": self.name, "started_at": self.started_at,
+                "stages_ms": {name: round(ms, 3) for name, ms in stages.items()}}
+
+
+_recent: "OrderedDict[str, Trace]" = OrderedDict()
+_recent_lock = threading.Lock()
+
+
+def span(trace: Optional[Trace], name: str, **args):
+    """`trace.span(name)`, or a no-op block for an untraced request."""
+    return trace.span(name, **args) if trace is not None else nullcontext(args)
+
+
+def debug_authorized(token: Optional[str]) -> bool:
+    return bool(DEBUG_TOKEN) and token is not None and hmac.compare_digest(token, DEBUG_TOKEN)
+
+
+def start_trace(name: str, force: bool = False) -> Optional[Trace]:
+    """A Trace for a sampled (or forced) request, else None."""
+    if force or (SAMPLE_RATE > 0 and random.random() < SAMPLE_RATE):
+        return Trace(name)
+    return None
+
+
+def finish_trace(trace: Trace):
+    """Keep the trace for /debug/traces and write it to MIRA_TRACE_DIR if set."""
+    with _recent_lock:
+        _recent[trace.trace_id] = trace
+        while len(_recent) > TRACE_KEEP:
+            _recent.popitem(last=False)
+    TRACES.inc()
+    if TRACE_DIR:
+        try:
+            os.makedirs(TRACE_DIR, exist_ok=True)
+            path = os.path.join(TRACE_DIR, f"{int(trace.started_at)}-{trace.trace_id}.json")
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump(trace.to_chrome(), f)
+        except OSError as e:
+            logger.warning(f"Could not write trace {trace.trace_id}: {e}")
+
+
+def recent_traces() -> List[Dict]:
+    with _recent_lock:
+        traces = list(_recent.values())
+    return [trace.summary() for trace in reversed(traces)]
+
+
+def get_trace(trace_id: str) -> Optional[Trace]:
+    with _recent_lock:
+        return _recent.get(trace_id)
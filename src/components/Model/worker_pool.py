@@ -0,0 +1,332 @@
+import asyncio
+import itertools
+import logging
+import multiprocessing
+import os
+import queue
+import threading
+from collections import OrderedDict
+from typing import AsyncGenerator, Dict, Generator, List, Optional
+
+from scheduler import SchedulerFull
+from tracing import Trace
+
+logger = logging.getLogger("MIRA")
+
+_END = "end"
+
+
+def _split_cpus(num_workers: int, cpus_per_worker: Optional[int] = None) -> List[List[int]]:
+    if hasattr(os, "sched_getaffinity"):
+        cpus = sorted(os.sched_getaffinity(0))
+    else:
+        cpus = list(range(os.cpu_count() or 1))
+    per_worker = cpus_per_worker or max(1, len(cpus) // num_workers)
+    sets = [cpus[i * per_worker:(i + 1) * per_worker] for i in range(num_workers)]
+    if any(not cpu_set for cpu_set in sets):
+        raise ValueError(f"Cannot give {num_workers} workers {per_worker} CPUs each; only {len(cpus)} available.")
+    return sets
+
+
+def _serve(mira, request_id: int, kind: str, payload: Dict, results, active: set, cancelled: set):
+    try:
+        if kind == "emotions":
+            results.put((request_id, "result", mira.detect_emotions(payload["text"])))
+        elif kind == "trends":
+            results.put((request_id, "result", mira.emotion_trends(payload["session_ids"])))
+        elif kind in ("generate", "reply", "score"):
+            # The caller's trace lives in another process; stages recorded here are sent back to it
+            trace = Trace(kind) if payload.get("trace") else None
+            if kind == "score":
+                stream = mira.score_messages(payload["messages"])
+            elif kind == "generate":
+                stream = mira.generate_llama_response_stream(
+                    payload["user_input"], payload["emotion_summary"], session_id=payload["session_id"]
+                )
+            else:
+                stream = mira.stream_reply(payload["user_input"], session_id=payload["session_id"],
+                                           shed=payload["shed"], trace=trace)
+            try:
+                for chunk in stream:
+                    if request_id in cancelled:
+                        break
+                    results.put((request_id, "chunk", chunk))
+            finally:
+                stream.close()
+            if trace is not None and request_id not in cancelled:
+                results.put((request_id, "trace", trace.export()))
+        elif kind == "log":
+            mira.log_conversation(payload["user_input"], payload["response"],
+                                  payload["bot_reply"], session_id=payload["session_id"])
+    except SchedulerFull as e:
+        results.put((request_id, "overloaded", e.retry_after))
+    except Exception as e:
+        logger.error(f"Worker request {request_id} ({kind}) failed: {e}", exc_info=True)
+        results.put((request_id, "error", str(e)))
+    finally:
+        active.discard(request_id)
+        cancelled.discard(request_id)
+        results.put((request_id, _END, None))
+
+
+def _worker_main(index: int, cpu_set: List[int], requests, results, ready, num_workers: int = 1):
+    # Pin before torch / llama.cpp spin up their thread pools
+    if hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cpu_set)
+    os.environ["OMP_NUM_THREADS"] = str(len(cpu_set))
+    os.environ["EMOTION_INTRA_OP_THREADS"] = str(len(cpu_set))
+
+    import torch
+    from mira import MIRA
+
+    torch.set_num_threads(len(cpu_set))
+    mira = MIRA(n_threads=len(cpu_set), workers=num_workers)
+    ready.set()
+    logger.info(f"Model worker {index} ready on CPUs {cpu_set}.")
+
+    active: set = set()
+    cancelled: set = set()
+    while True:
+        message = requests.get()
+        if message is None:
+            mira.close()
+            break
+        request_id, kind, payload = message
+        if kind == "cancel":
+            if request_id in active:
+                cancelled.add(request_id)
+            continue
+        # Requests are served concurrently; the worker's own scheduler and
+        # emotion batcher serialize and batch access to its models
+        active.add(request_id)
+        threading.Thread(target=_serve, args=(mira, request_id, kind, payload, results, active, cancelled),
+                         daemon=True).start()
+
+
+class WorkerPool:
+    """N model-owning processes, each pinned to a disjoint CPU set, behind a router.
+
+    Exposes the MIRA methods app.py uses. Chats stick to the worker that holds
+    their session context and KV state; everything else goes to the worker with
+    the fewest requests in flight.
+    """
+
+    def __init__(self, num_workers: int, cpus_per_worker: Optional[int] = None, max_affinity: int = 100000):
+        self._requests = []
+        self._processes = []
+        self._worker_ready = []
+        self._in_flight = [0] * num_workers
+        self._affinity: "OrderedDict[str, int]" = OrderedDict()
+        self._max_affinity = max_affinity
+        self._pending: Dict[int, "queue.Queue"] = {}
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+        self.ready = threading.Event()
+        if multiprocessing.current_process().name != "MainProcess":
+            # A spawned process re-imports the launcher's __main__ (`python app.py`),
+            # which builds the backend again at import time. Workers belong to the
+            # parent only; starting them here fails during the child's bootstrap.
+            # (parent_process() is only set after that re-import; the name is set before.)
+            logger.debug("Not starting a worker pool inside a child process.")
+            return
+
+        ctx = multiprocessing.get_context("spawn")
+        self._results = ctx.Queue()
+        for index, cpu_set in enumerate(_split_cpus(num_workers, cpus_per_worker)):
+            requests, ready = ctx.Queue(), ctx.Event()
+            process = ctx.Process(target=_worker_main, args=(index, cpu_set, requests, self._results, ready, num_workers),
+                                  name=f"mira-worker-{index}", daemon=True)
+            process.start()
+            self._requests.append(requests)
+            self._processes.append(process)
+            self._worker_ready.append(ready)
+        threading.Thread(target=self._route_results, name="pool-router", daemon=True).start()
+        threading.Thread(target=self._wait_ready, name="pool-ready", daemon=True).start()
+
+    def _wait_ready(self):
+        for ready in self._worker_ready:
+            ready.wait()
+        self.ready.set()
+        logger.info(f"All {len(self._processes)} model workers ready.")
+
+    def _route_results(self):
+        while True:
+            request_id, kind, value = self._results.get()
+            with self._lock:
+                out = self._pending.get(request_id)
+            if out is not None:
+                out.put((kind, value))
+
+    def _pick_worker(self, session_id: Optional[str]) -> int:
+        with self._lock:
+            if session_id and session_id in self._affinity:
+                worker = self._affinity[session_id]
+                if self._processes[worker].is_alive():
+                    self._affinity.move_to_end(session_id)
+                    return worker
+            alive = [i for i, p in enumerate(self._processes) if p.is_alive()]
+            if not alive:
+                raise RuntimeError("No model workers are alive.")
+            worker = min(alive, key=lambda i: self._in_flight[i])
+            if session_id:
+                self._affinity[session_id] = worker
+                if len(self._affinity) > self._max_affinity:
+                    self._affinity.popitem(last=False)
+            return worker
+
+    def _dispatch(self, kind: str, payload: Dict, session_id: Optional[str] = None,
+                  worker: Optional[int] = None):
+        if worker is None:
+            worker = self._pick_worker(session_id)
+        request_id = next(self._ids)
+        out: "queue.Queue" = queue.Queue()
+        with self._lock:
+            self._pending[request_id] = out
+            self._in_flight[worker] += 1
+        self._requests[worker].put((request_id, kind, payload))
+        return worker, request_id, out
+
+    def _next(self, worker: int, out: "queue.Queue"):
+        while True:
+            try:
+                return out.get(timeout=1.0)
+            except queue.Empty:
+                if not self._processes[worker].is_alive():
+                    logger.error(f"Model worker {worker} died with requests in flight.")
+                    return "error", "worker died"
+
+    def _release(self, worker: int, request_id: int):
+        with self._lock:
+            self._pending.pop(request_id, None)
+            self._in_flight[worker] -= 1
+
+    def _result(self, worker: int, request_id: int, out: "queue.Queue", default):
+        try:
+            result = default
+            while True:
+                kind, value = self._next(worker, out)
+                if kind == "result":
+                    result = value
+                elif kind in (_END, "error"):
+                    return result
+        finally:
+            self._release(worker, request_id)
+
+    def detect_emotions(self, text: str) -> List[Dict[str, float]]:
+        return self._result(*self._dispatch("emotions", {"text": text}), [{"emotion": "error", "confidence": 0.0}])
+
+    def emotion_trends(self, session_ids: List[str]) -> Dict[str, Dict]:
+        # Each session lives in the worker that served it; ask every worker and merge
+        calls = [self._dispatch("trends", {"session_ids": session_ids}, worker=worker)
+                 for worker, process in enumerate(self._processes) if process.is_alive()]
+        trends: Dict[str, Dict] = {}
+        for call in calls:
+            trends.update(self._result(*call, {}))
+        return trends
+
+    def generate_llama_response_stream(self, user_input: str, emotion_summary: str = "",
+                                       session_id: Optional[str] = None) -> Generator[Dict[str, str], None, None]:
+        return self._stream("generate", {
+            "user_input": user_input,
+            "emotion_summary": emotion_summary,
+            "session_id": session_id
+        }, session_id)
+
+    def stream_reply(self, user_input: str, session_id: Optional[str] = None,
+                     shed: bool = False, trace: Optional[Trace] = None) -> Generator[Dict, None, None]:
+        # One round trip: the worker overlaps emotion detection and prefill itself
+        return self._stream("reply", {
+            "user_input": user_input,
+            "session_id": session_id,
+            "shed": shed,
+            "trace": trace is not None
+        }, session_id, trace)
+
+    async def astream_reply(self, user_input: str, session_id: Optional[str] = None,
+                            shed: bool = False, trace: Optional[Trace] = None) -> AsyncGenerator[Dict, None]:
+        """stream_reply for an event loop: waits for each result in the default executor."""
+        loop = asyncio.get_running_loop()
+        worker, request_id, out = self._dispatch("reply", {
+            "user_input": user_input,
+            "session_id": session_id,
+            "shed": shed,
+            "trace": trace is not None
+        }, session_id)
+        finished = False
+        try:
+            while True:
+                kind, value = await loop.run_in_executor(None, self._next, worker, out)
+                if kind == "chunk":
+                    yield value
+                elif kind == "trace":
+                    if trace is not None:
+                        trace.merge(value)
+                elif kind == "overloaded":
+                    finished = True
+                    raise SchedulerFull(f"Model worker {worker} is overloaded.", retry_after=value)
+                elif kind == "error":
+                    finished = True
+                    yield {"chunk": "I'm having trouble responding right now.", "done": True}
+                    return
+                elif kind == _END:
+                    finished = True
+                    return
+        finally:
+            if not finished:
+                self._requests[worker].put((request_id, "cancel", None))
+            self._release(worker, request_id)
+
+    def score_messages(self, messages: List) -> Generator[Dict, None, None]:
+        return self._stream("score", {"messages": messages}, None)
+
+    def _stream(self, kind: str, payload: Dict, session_id: Optional[str],
+                trace: Optional[Trace] = None) -> Generator[Dict, None, None]:
+        worker, request_id, out = self._dispatch(kind, payload, session_id)
+        finished = False
+        try:
+            while True:
+                frame, value = self._next(worker, out)
+                if frame == "chunk":
+                    yield value
+                elif frame == "trace":
+                    if trace is not None:
+                        trace.merge(value)
+                elif frame == "overloaded":
+                    finished = True
+                    raise SchedulerFull(f"Model worker {worker} is overloaded.", retry_after=value)
+                elif frame == "error":
+                    finished = True
+                    if kind == "score":
+                        # Batch results are per-message records, not chat chunks
+                        yield {"id": None, "error": value}
+                    else:
+                        yield {"chunk": "I'm having trouble responding right now.", "done": True}
+                    return
+                elif frame == _END:
+                    finished = True
+                    return
+        finally:
+            if not finished:
+                # Consumer went away (client disconnect); stop the worker's decode
+                self._requests[worker].put((request_id, "cancel", None))
+            self._release(worker, request_id)
+
+    def log_conversation(self, user_input: str, response: Dict, bot_reply: str, session_id: Optional[str] = None):
+        worker, request_id, out = self._dispatch("log", {
+            "user_input": user_input,
+            "response": response,
+            "bot_reply": bot_reply,
+            "session_id": session_id
+        }, session_id)
+        # Fire-and-forget: the router drops the END message once released
+        self._release(worker, request_id)
+
+    def close(self, timeout: float = 10.0):
+        """Stop the workers; each flushes its conversation log first."""
+        for requests, process in zip(self._requests, self._processes):
+            if process.is_alive():
+                requests.put(None)
+        for process in self._processes:
+            process.join(timeout)
+            if process.is_alive():
+                process.terminate()
@@ -216,13 +216,15 @@ const ChatScreen = () => {
       const response = await fetch("https://api.mirahub.me/model", {
         method: "POST",
         headers: { "Content-Type": "application/json" },
-        body: JSON.stringify({ input }),
+        body: JSON.stringify({ input, session_id: chatId }),
       });
       if (!response.ok) throw new Error("Network response was not ok");
 
       const reader = response.body.getReader();
       const decoder = new TextDecoder();
       let done = false;
+      // A read can end mid-line, so keep the unfinished tail for the next one
+      let pending = "";
 
       // Add the user's message immediately
       await saveMessage(chatId, input, "human");
@@ -230,12 +232,11 @@ const ChatScreen = () => {
       while (!done) {
         const { value, done: streamDone } = await reader.read();
         if (streamDone) break;
-        const lines = decoder
-          .decode(value, { stream: true })
-          .split("\n")
-          .filter(Boolean);
+        pending += decoder.decode(value, { stream: true });
+        const lines = pending.split("\n");
+        pending = lines.pop();
 
-        for (const line of lines) {
+        for (const line of lines.filter(Boolean)) {
           try {
             const data = JSON.parse(line);
             if (data.chunk) {